@@ -0,0 +1,115 @@
+import os
+import sys
+from typing import List, Optional
+
+import psutil
+
+
+# invalid cpu ids listed in errors, which are returned to API clients
+MAX_REPORTED_CPUS = 8
+
+
+def parse_cpu_list(cpus: str) -> List[int]:
+    """
+    Parses a cpu list in the style of `taskset`, e.g. "0-3,6" -> [0, 1, 2, 3, 6]. Raises ValueError if it's malformed
+    or lists cores past the number of cores of the machine
+    """
+    n_cpus = os.cpu_count() or 1
+    out = []
+    for part in cpus.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = part.split("-")
+        if len(bounds) > 2 or not all(bound.strip().isdigit() for bound in bounds):
+            raise ValueError(f"invalid cpu list {cpus!r}")
+        start, end = int(bounds[0]), int(bounds[-1])
+        if start > end:
+            raise ValueError(f"invalid cpu range {part!r} in {cpus!r}")
+        # checked before the range is expanded, so that its size is bounded by the number of cores
+        if end >= n_cpus:
+            raise ValueError(f"cpu {end} of {part!r} is out of range, the machine has {n_cpus} cores")
+        out.extend(range(start, end + 1))
+    return out
+
+
+def get_available_cpus() -> List[int]:
+    """The cores the current process may be pinned to"""
+    process = psutil.Process()
+    if hasattr(process, "cpu_affinity"):
+        return process.cpu_affinity()
+    return list(range(psutil.cpu_count()))
+
+
+def validate_cpu_list(cpus: str) -> List[int]:
+    """Parses `cpus` like `parse_cpu_list`, raising ValueError if it's malformed or has cores that aren't available"""
+    cpu_list = parse_cpu_list(cpus)
+    available = get_available_cpus()
+    unavailable = sorted(set(cpu_list) - set(available))
+    if unavailable:
+        listed = ", ".join(map(str, unavailable[:MAX_REPORTED_CPUS]))
+        if len(unavailable) > MAX_REPORTED_CPUS:
+            listed += ", ..."
+        raise ValueError(f"{len(unavailable)} of the cpus aren't available ({listed}), {len(available)} cpus are")
+    return cpu_list
+
+
+def set_high_priority(process: psutil.Process):
+    if sys.platform == "win32":
+        process.nice(psutil.HIGH_PRIORITY_CLASS)
+    else:
+        # negative niceness usually needs elevated privileges
+        process.nice(-10)
+
+
+def configure_process(
+    num_threads: int = 0,
+    num_interop_threads: int = 0,
+    cpu_affinity: Optional[List[int]] = None,
+    high_priority: bool = False,
+    logger=None,
+):
+    """
+    Sets the torch intra-op & inter-op threads, the cores the current process may run on & its scheduling priority.
+    Zero / empty values leave the corresponding setting as is. Settings the platform or the user's privileges don't
+    allow are skipped with a warning.
+    """
+    # imported here so that the cpu lists can be validated without importing torch
+    import torch
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0 and num_interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # only possible before any inter-op parallel work has started
+            if logger:
+                logger.warn(f"can't set the inter-op threads: {e}")
+
+    process = psutil.Process()
+    if cpu_affinity:
+        if hasattr(process, "cpu_affinity"):
+            try:
+                process.cpu_affinity(cpu_affinity)
+            except (ValueError, OSError, psutil.Error) as e:
+                # e.g. cores that aren't available to the process
+                if logger:
+                    logger.warn(f"can't set the cpu affinity to {cpu_affinity}: {e}")
+        elif logger:
+            # macOS has no cpu affinity api
+            logger.warn(f"cpu affinity is not supported on {sys.platform}")
+
+    if high_priority:
+        try:
+            set_high_priority(process)
+        except (psutil.Error, OSError) as e:
+            if logger:
+                logger.warn(f"can't raise the process priority: {e}")
+
+    if logger:
+        affinity = process.cpu_affinity() if hasattr(process, "cpu_affinity") else "n/a"
+        logger.info(
+            f"torch threads={torch.get_num_threads()} interop_threads={torch.get_num_interop_threads()} "
+            f"cpu_affinity={affinity} nice={process.nice()}"
+        )
@@ -0,0 +1,141 @@
+import abc
+import argparse
+import os
+from abc import abstractmethod
+from typing import Dict, Type
+
+import numpy as np
+import torch
+
+from ai.spectrogram_conversion.model_optimization import load_optimized
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+class InferenceBackend(abc.ABC):
+    """
+    Runs the two models of the pipeline: the preprocessor, which extracts content features from 16kHz audio, & the
+    conversion model, which renders 24kHz audio from the content features & a target speaker embedding.
+    """
+
+    def __init__(self, opt: argparse.Namespace, device: torch.device, models_root: str, cache_root: str):
+        self._opt = opt
+        self.device = device
+        self._models_root = models_root
+        self._cache_root = cache_root
+
+    @abstractmethod
+    def preprocess(self, wav_src: np.ndarray) -> torch.Tensor:
+        """`wav_src` is a (batch, samples) array of 16kHz audio"""
+        pass
+
+    @abstractmethod
+    def convert(self, c: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        """Returns (batch, 1, samples) 24kHz audio for the content features `c` & one target embedding per item"""
+        pass
+
+
+class TorchScriptBackend(InferenceBackend):
+    """TorchScript models, with the preprocessor running on CoreML on Apple silicon"""
+
+    def __init__(self, opt: argparse.Namespace, device: torch.device, models_root: str, cache_root: str):
+        super().__init__(opt, device, models_root, cache_root)
+        self.mac_silicon_device = torch.backends.mps.is_available()
+
+        # TODO: add brancing logic for windows vs mac.
+        self.model = self._load_torchscript(os.path.join(models_root, "model.pt"))
+        self._load_model_preprocessor()
+
+    def _load_model_preprocessor(self):
+        if self.mac_silicon_device:
+            import coremltools as ct
+
+            self.pmodel = ct.models.MLModel(os.path.join(self._models_root, "model.mlpackage"))
+        else:
+            # TODO: add branching logic for windows vs mac
+            self.pmodel = self._load_torchscript(os.path.join(self._models_root, "b_model.pt"))
+
+    def _load_torchscript(self, path: str) -> torch.jit.ScriptModule:
+        """
+        Uses the frozen & optimized variant of the model, cached by torch version & device, unless disabled. The int8
+        variant is opt-in as it trades some accuracy for CPU speed
+        """
+        if getattr(self._opt, "quantize", False):
+            if self.device.type == "cpu":
+                return load_optimized(path, self.device, self._cache_root, variant="int8")
+            _LOGGER.warn(f"int8 models are only supported on cpu, not {self.device}")
+
+        if not getattr(self._opt, "optimize_models", True):
+            return torch.jit.load(path).to(self.device)
+        return load_optimized(path, self.device, self._cache_root)
+
+    def preprocess(self, wav_src: np.ndarray) -> torch.Tensor:
+        if not self.mac_silicon_device:
+            wav_src = torch.from_numpy(wav_src).to(self.device)
+            return self.pmodel(wav_src)
+
+        c = [self.pmodel.predict({"input_values": w[np.newaxis, :]})["var_3641"] for w in wav_src]
+        return torch.from_numpy(np.concatenate(c, axis=0)).to(self.device)
+
+    def convert(self, c: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        return self.model(c, targets)
+
+
+# names of the onnxruntime.GraphOptimizationLevel values, by the value of `opt.ort_graph_optimization_level`
+ORT_GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX Runtime on CPU, for the model.onnx & b_model.onnx exported from the TorchScript models by `export_onnx.py`.
+    Runs on numpy arrays, so features & audio are exchanged with the rest of the pipeline as CPU tensors.
+    """
+
+    def __init__(self, opt: argparse.Namespace, device: torch.device, models_root: str, cache_root: str):
+        super().__init__(opt, device, models_root, cache_root)
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        # 0 lets onnxruntime pick, i.e. one thread per physical core
+        session_options.intra_op_num_threads = getattr(opt, "ort_intra_op_threads", 0)
+        session_options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel,
+            ORT_GRAPH_OPTIMIZATION_LEVELS[getattr(opt, "ort_graph_optimization_level", "all")],
+        )
+
+        self.psession = self._load_session(ort, session_options, "b_model.onnx")
+        self.session = self._load_session(ort, session_options, "model.onnx")
+        self._p_input = self.psession.get_inputs()[0].name
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def _load_session(self, ort, session_options, fname: str):
+        path = os.path.join(self._models_root, fname)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"{path} not found, export it with `python -m ai.spectrogram_conversion.export_onnx`"
+            )
+        return ort.InferenceSession(path, session_options, providers=["CPUExecutionProvider"])
+
+    def preprocess(self, wav_src: np.ndarray) -> torch.Tensor:
+        (c,) = self.psession.run(None, {self._p_input: wav_src})
+        return torch.from_numpy(c)
+
+    def convert(self, c: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        inputs = {
+            self._inputs[0]: c.cpu().numpy(),
+            self._inputs[1]: targets.cpu().numpy().astype(np.float32, copy=False),
+        }
+        (audio,) = self.session.run(None, inputs)
+        return torch.from_numpy(audio)
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    "torchscript": TorchScriptBackend,
+    "onnxruntime": OnnxRuntimeBackend,
+}
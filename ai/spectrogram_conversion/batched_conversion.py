@@ -0,0 +1,363 @@
+"""
+Serves many concurrent conversion sessions from a single copy of the models. Each session streams windows into its own
+q_in ring buffer, as the PyAudio callback does, and the worker converts the packets that are due in the same time slice
+in one batched forward pass with the sessions' target embeddings stacked.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from dataclasses import dataclass
+from multiprocessing import Process, Value
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.cross_fade import LinearCrossFade
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.params import CROSS_FADE_DURATION_MS, MAX_INFER_SAMPLES_VC, SEED, sample_rate
+from ai.spectrogram_conversion.perf_counter import DebugPerfCounter
+from ai.spectrogram_conversion.resampler import StreamingResampler
+from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
+from ai.spectrogram_conversion.utils.multiprocessing_utils import SharedRingBuffer
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+from ai.spectrogram_conversion.voice_conversion import ModelConversionPipeline
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+# number of packets each of a session's q_in & q_out can hold
+RING_BUFFER_CAPACITY = 8
+MAX_BATCH_SIZE = 8
+# how long the worker waits for the remaining sessions' packets once the first packet of a batch is ready
+BATCH_WINDOW_MS = 5
+# how often the worker, blocked on its control queue while no session is attached, checks whether it should stop
+IDLE_POLL_S = 0.5
+
+
+@dataclass
+class SessionSpec:
+    """Everything the worker needs to serve a session. Sent over the control queue, so it must be picklable"""
+
+    session_id: str
+    q_in: SharedRingBuffer
+    q_out: SharedRingBuffer
+    HDW_FRAMES_PER_BUFFER: int
+    target_speaker: str
+    noise_suppression_threshold: float = 5.0
+
+
+class _Session:
+    """Per session streaming state kept by the worker"""
+
+    def __init__(self, spec: SessionSpec, target: torch.Tensor, p_window_len: int, p_sampling_rate: int):
+        self.spec = spec
+        self.target = target
+        self.cross_fade = LinearCrossFade(int(CROSS_FADE_DURATION_MS / 1000 * sample_rate))
+        self.stream_resampler = StreamingResampler(sample_rate, p_sampling_rate, p_window_len)
+        self.wav_buffer = np.zeros(spec.q_in.slot_len, dtype=np.float32)
+        self.last_p_id = -1
+
+
+class BatchedConversionWorker(ModelConversionPipeline):
+    """
+    online_crossfade conversion for many sessions at once. Each session keeps its own streaming resampler & cross-fade
+    state, only the forward pass is shared.
+    """
+
+    def __init__(self, opt: argparse.Namespace):
+        super().__init__(opt)
+
+        self.max_batch_size = getattr(opt, "max_batch_size", MAX_BATCH_SIZE)
+        self.batch_window_s = getattr(opt, "batch_window_ms", BATCH_WINDOW_MS) / 1000
+
+        self._p_window_len = self.p_resampler.output_length(MAX_INFER_SAMPLES_VC)
+        self._sessions: Dict[str, _Session] = {}
+        # sessions are served round robin, so that no session is starved once there are more than max_batch_size
+        self._next_session = 0
+        self._perf_counter = DebugPerfCounter("batched_voice_conversion", _LOGGER)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def attach(self, spec: SessionSpec):
+        try:
+            target = self._load_target(spec.target_speaker)
+        except FileNotFoundError as e:
+            # the other sessions are served by the same process, which a bad voice mustn't take down
+            _LOGGER.warn(f"{e}, session={spec.session_id} uses the default voice")
+            target = self.target
+        self._sessions[spec.session_id] = _Session(spec, target, self._p_window_len, self.p_sampling_rate)
+        _LOGGER.info(f"attached session={spec.session_id} sessions={len(self._sessions)}")
+
+    def detach(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+
+        session.spec.q_in.close()
+        session.spec.q_out.close()
+        _LOGGER.info(f"detached session={session_id} sessions={len(self._sessions)}")
+
+    def set_noise_suppression_threshold(self, session_id: str, value: float):
+        if session_id in self._sessions:
+            self._sessions[session_id].spec.noise_suppression_threshold = value
+
+    def set_target_speaker(self, session_id: str, speaker_id: str):
+        """Takes effect on the session's next packet, embeddings are preloaded so no disk access is needed"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+
+        try:
+            session.target = self._load_target(speaker_id)
+            session.spec.target_speaker = speaker_id
+        except FileNotFoundError as e:
+            _LOGGER.warn(e)
+
+    def run(self, wavs: np.ndarray, HDW_FRAMES_PER_BUFFER: int) -> np.ndarray:
+        """Stateless batched conversion of (batch, MAX_INFER_SAMPLES_VC) windows, used for warmup"""
+        return self.infer_batch(wavs)[:, -HDW_FRAMES_PER_BUFFER:]
+
+    def _poll(self, sessions: List[_Session]) -> List[Tuple[_Session, int, float, np.ndarray]]:
+        packets = []
+        for session in sessions:
+            packet = session.spec.q_in.get(out=session.wav_buffer)
+            if packet is not None:
+                packets.append((session, *packet))
+        return packets
+
+    def step(self) -> int:
+        """Converts at most one packet per session in a single forward pass, returns the number of packets converted"""
+        sessions = list(self._sessions.values())
+        if not sessions:
+            return 0
+
+        start = self._next_session % len(sessions)
+        sessions = (sessions[start:] + sessions[:start])[: self.max_batch_size]
+
+        packets = self._poll(sessions)
+        if not packets:
+            return 0
+
+        # give the other sessions a moment to catch up, as packets of sessions with the same callback latency arrive
+        # at about the same time
+        deadline = time.time() + self.batch_window_s
+        while len(packets) < len(sessions) and time.time() < deadline:
+            time.sleep(0.0005)
+            ready = {id(packet[0]) for packet in packets}
+            packets += self._poll([session for session in sessions if id(session) not in ready])
+
+        self._next_session = start + len(sessions)
+        self.run_batch(packets)
+        return len(packets)
+
+    def run_batch(self, packets: List[Tuple[_Session, int, float, np.ndarray]]):
+        with self._perf_counter:
+            wavs = np.stack([wav for _, _, _, wav in packets])
+            wav_srcs = np.zeros((len(packets), self._p_window_len), dtype=np.float32)
+            for i, (session, p_id, _, wav) in enumerate(packets):
+                n_new_samples = (p_id - session.last_p_id) * session.spec.HDW_FRAMES_PER_BUFFER
+                session.last_p_id = p_id
+                if n_new_samples >= len(wav):
+                    # no overlap with the previous window, e.g. after packets were dropped
+                    session.stream_resampler.reset()
+                    n_new_samples = len(wav)
+                session.stream_resampler.push(wav[-n_new_samples:])
+                wav_srcs[i] = session.stream_resampler.window(self._p_window_len)
+
+            targets = torch.cat([session.target for session, _, _, _ in packets])
+            outs = self.infer_batch(wavs, wav_srcs=wav_srcs, targets=targets)
+
+            for (session, p_id, p_start_s, wav), out in zip(packets, outs):
+                out = self.suppress_noise(out, wav, session.spec.noise_suppression_threshold)
+                out = session.cross_fade(out, session.spec.HDW_FRAMES_PER_BUFFER)
+                if not session.spec.q_out.put(p_id, p_start_s, out):
+                    _LOGGER.info(f"session={session.spec.session_id} q_out: full, dropping packet")
+
+
+def batched_conversion_process_target(
+    stop: Value,
+    control_queue: multiprocessing.Queue,
+    model_warmup_complete: Value,
+    opt: argparse.Namespace,
+):
+    """
+    Control messages are tuples of ("attach", SessionSpec), ("detach", session_id),
+    ("noise_suppression_threshold", session_id, value) or ("target_speaker", session_id, speaker_id).
+    """
+    worker = BatchedConversionWorker(opt)
+
+    # warmup models into the cache, for every batch size so that later batches don't hit new code paths
+    for batch_size in range(1, worker.max_batch_size + 1):
+        wavs = np.random.rand(batch_size, MAX_INFER_SAMPLES_VC).astype(np.float32)
+        worker.run(wavs, MAX_INFER_SAMPLES_VC // 10)
+    model_warmup_complete.value = 1
+
+    try:
+        while not stop.value:
+            while True:
+                try:
+                    # blocks while idle, the queue is only polled between the batches of the attached sessions
+                    message = control_queue.get(timeout=IDLE_POLL_S) if not len(worker) else control_queue.get_nowait()
+                except queue.Empty:
+                    break
+                except FileNotFoundError:
+                    # the session was detached, & its shared memory unlinked, before it was ever attached
+                    continue
+
+                if message[0] == "attach":
+                    worker.attach(message[1])
+                elif message[0] == "detach":
+                    worker.detach(message[1])
+                elif message[0] == "noise_suppression_threshold":
+                    worker.set_noise_suppression_threshold(message[1], message[2])
+                elif message[0] == "target_speaker":
+                    worker.set_target_speaker(message[1], message[2])
+                else:
+                    _LOGGER.warn(f"unknown control message: {message}")
+
+            if not worker.step():
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for session_id in list(worker._sessions):
+            worker.detach(session_id)
+        _LOGGER.info("batched_conversion_process_target: stopped")
+
+
+class BatchedConversionServer:
+    """
+    Owns the worker process, along with the shared memory of the sessions attached to it. Sessions can be attached as
+    soon as it's started, their packets are converted once the worker is ready.
+    """
+
+    def __init__(self, opt: argparse.Namespace):
+        self._opt = opt
+        self._stop = Value("i", 0)
+        self._model_warmup_complete = Value("i", 0)
+        self._control_queue = multiprocessing.Queue()
+        self._process: Optional[Process] = None
+        self._sessions: Dict[str, SessionSpec] = {}
+
+    def start(self):
+        """Starts loading the models, see `wait_until_ready`"""
+        self._process = Process(
+            target=batched_conversion_process_target,
+            args=(self._stop, self._control_queue, self._model_warmup_complete, self._opt),
+        )
+        self._process.start()
+
+    @property
+    def is_ready(self) -> bool:
+        return bool(self._model_warmup_complete.value)
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def wait_until_ready(self, poll_s: float = 0.2):
+        """Raises RuntimeError if the worker died, e.g. while loading the models"""
+        with TimedScope("model_warmup", _LOGGER):
+            while not self.is_ready:
+                if not self.is_alive:
+                    raise RuntimeError(f"the batched conversion worker has died, exit code: {self._process.exitcode}")
+                time.sleep(poll_s)
+
+    def attach(
+        self,
+        session_id: str,
+        HDW_FRAMES_PER_BUFFER: int,
+        target_speaker: str,
+        noise_suppression_threshold: float,
+    ) -> Tuple[SharedRingBuffer, SharedRingBuffer]:
+        """Returns the session's q_in & q_out, to be fed with MAX_INFER_SAMPLES_VC windows & drained of packets"""
+        spec = SessionSpec(
+            session_id,
+            SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC),
+            SharedRingBuffer(RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER),
+            HDW_FRAMES_PER_BUFFER,
+            target_speaker,
+            noise_suppression_threshold,
+        )
+        self._sessions[session_id] = spec
+        self._control_queue.put(("attach", spec))
+        return spec.q_in, spec.q_out
+
+    def set_noise_suppression_threshold(self, session_id: str, value: float):
+        self._control_queue.put(("noise_suppression_threshold", session_id, value))
+
+    def set_target_speaker(self, session_id: str, speaker_id: str):
+        self._control_queue.put(("target_speaker", session_id, speaker_id))
+
+    def detach(self, session_id: str):
+        spec = self._sessions.pop(session_id, None)
+        if spec is None:
+            return
+
+        self._control_queue.put(("detach", session_id))
+        # the worker keeps its mapping until it processes the detach, unlinking only removes the name
+        for q in (spec.q_in, spec.q_out):
+            q.close()
+            q.unlink()
+
+    def stop(self):
+        with self._stop.get_lock():
+            self._stop.value = 1
+        if self._process:
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+
+        for session_id in list(self._sessions):
+            self.detach(session_id)
+
+
+if __name__ == "__main__":
+    # important for running applications that have been frozen for e.g. with PyInstaller
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--duration-s", type=float, default=10)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    opt = parser.parse_args()
+    opt.mode = InferencePipelineMode.online_crossfade
+    opt.noise_suppression_threshold = 5.0
+
+    # feeds synthetic sessions at real-time rate & reports the roundtrip latency per session
+    set_seed(SEED)
+    HDW_FRAMES_PER_BUFFER = int(sample_rate * opt.callback_latency_ms / 1000)
+    server = BatchedConversionServer(opt)
+    server.start()
+    server.wait_until_ready()
+
+    sessions = {}
+    for i in range(opt.sessions):
+        q_in, q_out = server.attach(str(i), HDW_FRAMES_PER_BUFFER, opt.target_speaker, 5.0)
+        sessions[str(i)] = (q_in, q_out, SlidingWindow(MAX_INFER_SAMPLES_VC), [])
+
+    try:
+        n_packets = int(opt.duration_s * sample_rate / HDW_FRAMES_PER_BUFFER)
+        for p_id in range(n_packets):
+            start_s = time.time()
+            for q_in, q_out, window, roundtrips in sessions.values():
+                window.append(np.random.rand(HDW_FRAMES_PER_BUFFER).astype(np.float32) - 0.5)
+                q_in.put(p_id, start_s, window.view())
+                while (packet := q_out.get()) is not None:
+                    roundtrips.append(time.time() - packet[1])
+            time.sleep(max(0.0, HDW_FRAMES_PER_BUFFER / sample_rate - (time.time() - start_s)))
+
+        for session_id, (_, _, _, roundtrips) in sessions.items():
+            roundtrips_ms = 1000 * np.array(roundtrips[len(roundtrips) // 10 :])
+            _LOGGER.info(
+                f"session={session_id} packets={len(roundtrips)}/{n_packets} "
+                f"roundtrip p50={np.percentile(roundtrips_ms, 50):0.1f}ms p99={np.percentile(roundtrips_ms, 99):0.1f}ms"
+            )
+    finally:
+        server.stop()
@@ -0,0 +1,56 @@
+"""
+Sweeps the online_crossfade context length against per-packet inference time & spectral distance to the output
+obtained with the whole MAX_INFER_SAMPLES_VC window.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_context_length --target-speaker zeus --input clip.wav
+"""
+import argparse
+import math
+import os
+
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.benchmarks.bench_utils import (format_latency_ms, load_reference_clip, mel_distance,
+                                                              stream_through_pipeline)
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.inference_rt import ConversionPipeline
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC, SEED, sample_rate
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--input", type=str, default=None, help="reference clip, synthesised if not given")
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--context-length-ms", type=float, nargs="+", default=[500, 750, 1000])
+    opt = parser.parse_args()
+
+    set_seed(SEED)
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    full_context_ms = MAX_INFER_SAMPLES_VC / sample_rate * 1000
+
+    wav = load_reference_clip(opt.input)
+    voice_conversion = ConversionPipeline(
+        argparse.Namespace(
+            mode=InferencePipelineMode.online_crossfade,
+            noise_suppression_threshold=5.0,
+            target_speaker=opt.target_speaker,
+            context_length_ms=0,
+        )
+    )
+
+    # warmup
+    stream_through_pipeline(voice_conversion, wav[: 10 * HDW_FRAMES_PER_BUFFER], HDW_FRAMES_PER_BUFFER)
+
+    reference, durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+    _LOGGER.info(f"context {full_context_ms:0.0f}ms (full): \t{format_latency_ms(durations_ms)}")
+
+    for context_length_ms in opt.context_length_ms:
+        voice_conversion._opt.context_length_ms = context_length_ms
+        out, durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+        _LOGGER.info(
+            f"context {context_length_ms:0.0f}ms: \t{format_latency_ms(durations_ms)} \t"
+            f"mel distance to full: {mel_distance(out, reference):0.2f}dB"
+        )
@@ -0,0 +1,80 @@
+"""
+Compares the online_crossfade pipeline with & without the content feature cache: per-packet inference time, the
+relative error of the cached features against a full recomputation, and the spectral distance between the outputs.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_feature_cache --target-speaker zeus --input clip.wav
+"""
+import argparse
+import math
+import os
+
+import numpy as np
+
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.benchmarks.bench_utils import (format_latency_ms, load_reference_clip, mel_distance,
+                                                              stream_through_pipeline)
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.inference_rt import ConversionPipeline
+from ai.spectrogram_conversion.params import FEATURE_CACHE_MARGIN_MS, MAX_INFER_SAMPLES_VC, SEED, sample_rate
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def feature_errors(voice_conversion: ConversionPipeline, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int) -> np.ndarray:
+    """Relative L2 error of the cached features against features recomputed from scratch, per packet"""
+    voice_conversion.reset()
+    window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+    p_window_len = voice_conversion.p_resampler.output_length(MAX_INFER_SAMPLES_VC)
+
+    errors = []
+    for i in range(0, len(wav) - HDW_FRAMES_PER_BUFFER + 1, HDW_FRAMES_PER_BUFFER):
+        window.append(wav[i : i + HDW_FRAMES_PER_BUFFER])
+        voice_conversion._push_window(window.view(), HDW_FRAMES_PER_BUFFER)
+
+        cached = voice_conversion._feature_cache(voice_conversion._stream_resampler, p_window_len)
+        full = voice_conversion._feature_cache.full(voice_conversion._stream_resampler, p_window_len)
+        errors.append(float((cached - full).norm() / full.norm()))
+    return np.array(errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--input", type=str, default=None, help="reference clip, synthesised if not given")
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--feature-cache-margin-ms", type=float, nargs="+", default=[FEATURE_CACHE_MARGIN_MS])
+    opt = parser.parse_args()
+
+    set_seed(SEED)
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+
+    wav = load_reference_clip(opt.input)
+    pipeline_opt = argparse.Namespace(
+        mode=InferencePipelineMode.online_crossfade,
+        noise_suppression_threshold=5.0,
+        target_speaker=opt.target_speaker,
+        feature_cache=False,
+    )
+    voice_conversion = ConversionPipeline(pipeline_opt)
+
+    # warmup
+    stream_through_pipeline(voice_conversion, wav[: 10 * HDW_FRAMES_PER_BUFFER], HDW_FRAMES_PER_BUFFER)
+
+    reference, durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+    _LOGGER.info(f"feature cache off: \t{format_latency_ms(durations_ms)}")
+
+    for margin_ms in opt.feature_cache_margin_ms:
+        pipeline_opt.feature_cache = True
+        pipeline_opt.feature_cache_margin_ms = margin_ms
+        voice_conversion = ConversionPipeline(pipeline_opt)
+        stream_through_pipeline(voice_conversion, wav[: 10 * HDW_FRAMES_PER_BUFFER], HDW_FRAMES_PER_BUFFER)
+
+        out, durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+        errors = feature_errors(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+        _LOGGER.info(
+            f"feature cache margin {margin_ms:0.0f}ms: \t{format_latency_ms(durations_ms)} \t"
+            f"feature rel. error mean: {np.mean(errors):0.2e} max: {np.max(errors):0.2e} \t"
+            f"mel distance to cache off: {mel_distance(out, reference):0.2f}dB"
+        )
@@ -0,0 +1,74 @@
+"""
+Import-time profile of the desktop app server, based on `python -X importtime`. Reports the time until `main` is
+imported, i.e. until `/is-alive` can be served, next to the cost of the ML & audio stacks that are now deferred to the
+background preload.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_import_time --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+SERVER_ROOT = os.path.join(os.path.dirname(__file__), "../../../services/desktop_app/server")
+DEFERRED_MODULES = [
+    "numpy",
+    "librosa",
+    "soundfile",
+    "torch",
+    "ai.spectrogram_conversion.inference_rt",
+    "common.aws_utils",
+]
+
+
+def import_times(statement: str, cwd: str) -> List[Tuple[str, int, int, int]]:
+    """Runs `statement` in a fresh interpreter, returns (module, depth, self_us, cumulative_us) per imported module"""
+    # main.py resolves the ai package relative to the server directory, the deferred modules from the repo root
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(os.path.join(SERVER_ROOT, "../../..")))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        # nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+def report(label: str, statement: str, cwd: str, top: int) -> int:
+    times = import_times(statement, cwd)
+    total_us = sum(self_us for _, _, self_us, _ in times)
+    _LOGGER.info(f"{label}: {total_us / 1000:0.1f}ms, {len(times)} modules")
+
+    # modules imported directly by the statement, sorted by the time spent importing them & their dependencies
+    top_level = sorted((t for t in times if t[1] == 0), key=lambda t: -t[3])
+    for name, _, _, cumulative_us in top_level[:top]:
+        _LOGGER.info(f"\t{cumulative_us / 1000:8.1f}ms \t{name}")
+    return total_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=10, help="number of modules to list per report")
+    opt = parser.parse_args()
+
+    server_us = report("import main (time until the API is up)", "import main", SERVER_ROOT, opt.top)
+    deferred_us = report(
+        "deferred to preload_modules", f"import {', '.join(DEFERRED_MODULES)}", SERVER_ROOT, opt.top
+    )
+    _LOGGER.info(f"startup saving: {deferred_us / 1000:0.1f}ms, {deferred_us / max(server_us, 1):0.1f}x main's imports")
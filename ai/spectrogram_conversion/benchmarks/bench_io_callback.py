@@ -0,0 +1,115 @@
+"""
+Microbenchmark of the PyAudio callback of the realtime pipeline, `inference_rt.get_io_stream_callback`, along with the
+window assembly it used to do with a deque for reference. q_out is fed with a converted packet before every callback,
+as the conversion process would, so that the callback takes its usual path of playing back a converted packet.
+
+Allocations are traced per callback: the peak of the memory allocated during the callback, & the number of packet
+sized buffers that peak amounts to, which is 0 when the callback only writes into preallocated buffers.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_io_callback --callback-latency-ms 100
+"""
+import argparse
+import logging
+import math
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+from ai.spectrogram_conversion import inference_rt
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC, sample_rate
+from ai.spectrogram_conversion.utils.latency_histogram import LatencyHistograms
+from ai.spectrogram_conversion.utils.multiprocessing_utils import FrameHealth, SharedRingBuffer
+
+RECORD_SEGMENTS = 64
+
+
+def get_deque_callback(q_in: SharedRingBuffer, q_out: SharedRingBuffer, HDW_FRAMES_PER_BUFFER: int):
+    # window assembly & output prior to SlidingWindow & the preallocated output buffers
+    NUM_CHUNKS = math.ceil(MAX_INFER_SAMPLES_VC / HDW_FRAMES_PER_BUFFER)
+    data = deque([np.zeros(HDW_FRAMES_PER_BUFFER, dtype=np.float32) for _ in range(NUM_CHUNKS)], maxlen=NUM_CHUNKS)
+
+    def callback(in_data: bytes, frame_count: int, time_info, status):
+        data.append(np.frombuffer(in_data, dtype=np.float32))
+        q_in.put(0, 0.0, np.array(data).flatten().astype(np.float32)[-MAX_INFER_SAMPLES_VC:])
+        _, _, out = q_out.get()
+        return out.tobytes(), 0
+
+    return callback
+
+
+def get_pipeline_callback(q_in: SharedRingBuffer, q_out: SharedRingBuffer, HDW_FRAMES_PER_BUFFER: int):
+    inference_rt.PACKET_ID, inference_rt.PACKET_COUNT, inference_rt.PACKET_START_S = 0, 0, time.time()
+    audio_in = np.zeros((RECORD_SEGMENTS, HDW_FRAMES_PER_BUFFER), dtype=np.float32)
+    audio_out = np.zeros((RECORD_SEGMENTS, HDW_FRAMES_PER_BUFFER), dtype=np.float32)
+    return inference_rt.get_io_stream_callback(
+        q_in,
+        inference_rt.SlidingWindow(MAX_INFER_SAMPLES_VC),
+        audio_in,
+        q_out,
+        audio_out,
+        RECORD_SEGMENTS,
+        frame_health,
+        latency_histograms,
+    )
+
+
+def benchmark(name: str, callback, q_in: SharedRingBuffer, q_out: SharedRingBuffer, HDW_FRAMES_PER_BUFFER: int):
+    in_data = np.random.rand(HDW_FRAMES_PER_BUFFER).astype(np.float32).tobytes()
+    converted = np.random.rand(HDW_FRAMES_PER_BUFFER).astype(np.float32)
+    wav_buffer = np.zeros(q_in.slot_len, dtype=np.float32)
+
+    def run_callback(i: int):
+        # the conversion process' side, outside of the measurements
+        q_out.put(i, time.time(), converted)
+        start_ns = time.perf_counter_ns()
+        callback(in_data, HDW_FRAMES_PER_BUFFER, None, 0)
+        duration_ns = time.perf_counter_ns() - start_ns
+        q_in.get(out=wav_buffer)
+        return duration_ns
+
+    durations_us = np.array([run_callback(i) for i in range(opt.iterations)]) / 1000
+
+    # traced separately, as tracing slows down the callback
+    packet_bytes = HDW_FRAMES_PER_BUFFER * np.dtype(np.float32).itemsize
+    peak_bytes = np.zeros(opt.trace_iterations)
+    tracemalloc.start()
+    for i in range(opt.trace_iterations):
+        q_out.put(i, time.time(), converted)
+        tracemalloc.reset_peak()
+        current_bytes, _ = tracemalloc.get_traced_memory()
+        callback(in_data, HDW_FRAMES_PER_BUFFER, None, 0)
+        peak_bytes[i] = tracemalloc.get_traced_memory()[1] - current_bytes
+        q_in.get(out=wav_buffer)
+    tracemalloc.stop()
+
+    print(
+        f"{name}: {' ' * (16 - len(name))}"
+        f"mean: {np.mean(durations_us):0.1f}us \tp99: {np.percentile(durations_us, 99):0.1f}us \t"
+        f"peak alloc per callback: mean {np.mean(peak_bytes) / 1024:0.1f}KiB max {np.max(peak_bytes) / 1024:0.1f}KiB \t"
+        f"packet buffers per callback: {np.mean(peak_bytes // packet_bytes):0.2f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--trace-iterations", type=int, default=200)
+    opt = parser.parse_args()
+
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    # the callback logs the roundtrip of every 3rd packet, which would flood the output
+    inference_rt._LOGGER.setLevel(logging.WARNING)
+    q_in = SharedRingBuffer(inference_rt.RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC)
+    q_out = SharedRingBuffer(inference_rt.RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER)
+    frame_health = FrameHealth()
+    latency_histograms = LatencyHistograms()
+    try:
+        for name, get_callback in [("deque", get_deque_callback), ("pipeline", get_pipeline_callback)]:
+            benchmark(name, get_callback(q_in, q_out, HDW_FRAMES_PER_BUFFER), q_in, q_out, HDW_FRAMES_PER_BUFFER)
+    finally:
+        for shared in (q_in, q_out, frame_health, latency_histograms):
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,56 @@
+"""
+Per-packet latency of the online_crossfade pipeline with the TorchScript models as is (fp32), frozen & optimized for
+inference (frozen), dynamically quantized (int8) & exported to ONNX Runtime (onnxruntime), along with the spectral
+distance of each output to the fp32 one. Hide the GPUs to measure CPU latency, which int8 & onnxruntime require.
+
+CUDA_VISIBLE_DEVICES= python -m ai.spectrogram_conversion.benchmarks.bench_model_optimization --target-speaker zeus
+"""
+import argparse
+import math
+import os
+
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.benchmarks.bench_utils import (format_latency_ms, load_reference_clip, mel_distance,
+                                                              stream_through_pipeline)
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.inference_rt import ConversionPipeline
+from ai.spectrogram_conversion.params import SEED, sample_rate
+from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--input", type=str, default=None, help="reference clip, synthesised if not given")
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--variants", type=str, nargs="+", default=["fp32", "frozen", "int8", "onnxruntime"])
+    opt = parser.parse_args()
+
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    wav = load_reference_clip(opt.input)
+
+    outs = {}
+    for variant in ["fp32"] + [v for v in opt.variants if v != "fp32"]:
+        set_seed(SEED)
+        with TimedScope(f"{variant} model load", _LOGGER):
+            voice_conversion = ConversionPipeline(
+                argparse.Namespace(
+                    mode=InferencePipelineMode.online_crossfade,
+                    noise_suppression_threshold=5.0,
+                    target_speaker=opt.target_speaker,
+                    optimize_models=variant != "fp32",
+                    quantize=variant == "int8",
+                    backend="onnxruntime" if variant == "onnxruntime" else "torchscript",
+                )
+            )
+
+        # warmup, the TorchScript profiling executor specializes the graph over the first few runs
+        stream_through_pipeline(voice_conversion, wav[: 10 * HDW_FRAMES_PER_BUFFER], HDW_FRAMES_PER_BUFFER)
+
+        outs[variant], durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+        _LOGGER.info(
+            f"{variant} ({voice_conversion.device}): \t{format_latency_ms(durations_ms)} \t"
+            f"mel distance to fp32: {mel_distance(outs[variant], outs['fp32']):0.3f}dB"
+        )
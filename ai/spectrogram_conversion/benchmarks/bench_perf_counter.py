@@ -0,0 +1,52 @@
+"""
+Overhead of timing a scope with PerfCounter, recording into shared & process memory histograms, which has to stay
+below 1us per scope to leave the audio path unaffected.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_perf_counter
+"""
+import argparse
+import os
+import timeit
+
+from ai.spectrogram_conversion.perf_counter import PerfCounter, use_histograms
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.latency_histogram import LatencyHistograms
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+MAX_OVERHEAD_NS = 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=1_000_000, help="scopes timed per repeat")
+    parser.add_argument("--repeat", type=int, default=5, help="the fastest repeat is reported")
+    opt = parser.parse_args()
+
+    histograms = LatencyHistograms()
+    use_histograms(histograms)
+    counters = {
+        "shared": PerfCounter("model"),
+        "local": PerfCounter("bench_perf_counter"),
+    }
+
+    def measure_ns(stmt: str, **globals) -> float:
+        return min(timeit.repeat(stmt, globals=globals, number=opt.number, repeat=opt.repeat)) / opt.number * 1e9
+
+    try:
+        baseline_ns = measure_ns("pass")
+        for name, counter in counters.items():
+            overhead_ns = measure_ns("with counter: pass", counter=counter) - baseline_ns
+            _LOGGER.info(
+                f"{name}: \t{overhead_ns:0.0f}ns per scope"
+                + ("" if overhead_ns < MAX_OVERHEAD_NS else f", above the {MAX_OVERHEAD_NS}ns budget")
+            )
+
+        overhead_ns = measure_ns("counter.record_ns(2_000_000)", counter=counters["shared"]) - baseline_ns
+        _LOGGER.info(f"record_ns: \t{overhead_ns:0.0f}ns per call")
+        overhead_ns = measure_ns("with PerfCounter('model'): pass", PerfCounter=PerfCounter) - baseline_ns
+        _LOGGER.info(f"created per scope: \t{overhead_ns:0.0f}ns per scope")
+    finally:
+        counters.clear()
+        histograms.close()
+        histograms.unlink()
@@ -0,0 +1,68 @@
+"""
+CPU cost of encoding a session's recordings with each of the recording codecs, against the disk & upload volume it
+saves over uncompressed float WAV. The recording is written by a RecordingWriter, packet by packet, as during a session.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_recording_codecs --duration-s 60 --upload-mbps 10
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from ai.spectrogram_conversion.benchmarks.bench_utils import load_reference_clip
+from ai.spectrogram_conversion.params import sample_rate
+from ai.spectrogram_conversion.recording import RECORDING_CODECS, RecordingWriter, get_recording_fname
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def encode(wav: np.ndarray, codec: str, root: str, segment_len: int, segments_per_write: int) -> float:
+    """Records `wav` with `codec` & returns the CPU seconds the writer took"""
+    n_packets = len(wav) // segment_len
+    # holds every packet, so that nothing is dropped regardless of how the writes are scheduled
+    buffer = wav[: n_packets * segment_len].reshape(n_packets, segment_len)
+
+    packet_count = [0]
+    writer = RecordingWriter(
+        {get_recording_fname(root, "original", codec): buffer}, lambda: packet_count[0], sample_rate, codec=codec
+    )
+    start_s = time.process_time()
+    # the writer's polls, without the waits in between
+    while packet_count[0] < n_packets:
+        packet_count[0] = min(packet_count[0] + segments_per_write, n_packets)
+        writer._write_completed()
+    writer.stop()
+    return time.process_time() - start_s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, default=None, help="reference clip, synthesised if not given")
+    parser.add_argument("--duration-s", type=float, default=60)
+    parser.add_argument("--callback-latency-ms", type=float, default=400)
+    parser.add_argument("--poll-s", type=float, default=0.5, help="interval between the writer's writes")
+    parser.add_argument("--upload-mbps", type=float, default=10, help="upload bandwidth the upload times assume")
+    opt = parser.parse_args()
+
+    wav = load_reference_clip(opt.input, duration_s=opt.duration_s)
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    segments_per_write = max(round(opt.poll_s * sample_rate / HDW_FRAMES_PER_BUFFER), 1)
+    audio_s = len(wav) / sample_rate
+
+    with tempfile.TemporaryDirectory() as root:
+        cpu_s, n_bytes = {}, {}
+        for codec in RECORDING_CODECS:
+            cpu_s[codec] = encode(wav, codec, root, HDW_FRAMES_PER_BUFFER, segments_per_write)
+            n_bytes[codec] = os.path.getsize(get_recording_fname(root, "original", codec))
+
+        for codec in RECORDING_CODECS:
+            _LOGGER.info(
+                f"{codec}: \t{n_bytes[codec] / 2 ** 20 / audio_s * 60:0.2f}MB per minute "
+                f"({n_bytes[codec] / n_bytes['wav']:0.1%} of wav) \t"
+                f"cpu {cpu_s[codec] / audio_s * 1000:0.2f}ms per second of audio \t"
+                f"upload {n_bytes[codec] * 8 / (opt.upload_mbps * 1e6):0.2f}s at {opt.upload_mbps:g}Mbps"
+            )
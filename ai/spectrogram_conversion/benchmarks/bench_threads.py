@@ -0,0 +1,56 @@
+"""
+Sweeps the torch intra-op thread count of the online_crossfade pipeline & reports the per-packet latency. Pinning the
+benchmark to the cores the conversion process would get shows how many threads those cores can sustain.
+
+python -m ai.spectrogram_conversion.benchmarks.bench_threads --target-speaker zeus --num-threads 1 2 4 8 --cpu-affinity 2-5
+"""
+import argparse
+import math
+import os
+
+from ai.common.process_utils import configure_process, parse_cpu_list
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.benchmarks.bench_utils import (format_latency_ms, load_reference_clip,
+                                                              stream_through_pipeline)
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.inference_rt import ConversionPipeline
+from ai.spectrogram_conversion.params import SEED, sample_rate
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--input", type=str, default=None, help="reference clip, synthesised if not given")
+    parser.add_argument("--callback-latency-ms", type=float, default=100)
+    parser.add_argument("--num-threads", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--cpu-affinity", type=str, default="", help="cores to pin the benchmark to, e.g. 2-5")
+    parser.add_argument("--high-priority", action="store_true")
+    opt = parser.parse_args()
+
+    set_seed(SEED)
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    configure_process(
+        cpu_affinity=parse_cpu_list(opt.cpu_affinity) if opt.cpu_affinity else None,
+        high_priority=opt.high_priority,
+        logger=_LOGGER,
+    )
+
+    wav = load_reference_clip(opt.input)
+    voice_conversion = ConversionPipeline(
+        argparse.Namespace(
+            mode=InferencePipelineMode.online_crossfade,
+            noise_suppression_threshold=5.0,
+            target_speaker=opt.target_speaker,
+        )
+    )
+
+    for num_threads in opt.num_threads:
+        configure_process(num_threads=num_threads)
+        # warmup at the new thread count
+        stream_through_pipeline(voice_conversion, wav[: 10 * HDW_FRAMES_PER_BUFFER], HDW_FRAMES_PER_BUFFER)
+
+        _, durations_ms = stream_through_pipeline(voice_conversion, wav, HDW_FRAMES_PER_BUFFER)
+        _LOGGER.info(f"threads {num_threads}: \t{format_latency_ms(durations_ms)}")
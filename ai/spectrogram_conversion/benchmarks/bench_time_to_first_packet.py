@@ -0,0 +1,104 @@
+"""
+Time from starting a session to its first converted packet, with a fresh conversion process per session (cold) vs a
+ConversionWorker started & warmed up ahead of time (warm).
+
+python -m ai.spectrogram_conversion.benchmarks.bench_time_to_first_packet --target-speaker zeus
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import time
+from multiprocessing import Process, Value
+
+import numpy as np
+
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.inference_rt import (RING_BUFFER_CAPACITY, ConversionWorker,
+                                                    conversion_process_target)
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC, sample_rate
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.multiprocessing_utils import SharedRingBuffer
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def wait_for_first_packet(q_in: SharedRingBuffer, q_out: SharedRingBuffer, start_s: float) -> float:
+    """Keeps q_in fed with a window until a converted packet shows up on q_out, returns the elapsed time in seconds"""
+    wav = np.random.rand(MAX_INFER_SAMPLES_VC).astype(np.float32) - 0.5
+    p_id = 0
+    while len(q_out) == 0:
+        if len(q_in) == 0:
+            q_in.put(p_id, time.time(), wav)
+            p_id += 1
+        time.sleep(0.001)
+    return time.time() - start_s
+
+
+def time_cold(opt: argparse.Namespace, HDW_FRAMES_PER_BUFFER: int) -> float:
+    start_s = time.time()
+    stop, model_warmup_complete = Value("i", 0), Value("i", 0)
+    q_in = SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC)
+    q_out = SharedRingBuffer(RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER)
+
+    process = Process(
+        target=conversion_process_target,
+        args=(stop, q_in, q_out, model_warmup_complete, opt, HDW_FRAMES_PER_BUFFER),
+    )
+    process.start()
+    try:
+        return wait_for_first_packet(q_in, q_out, start_s)
+    finally:
+        stop.value = 1
+        process.join()
+        for q in (q_in, q_out):
+            q.close()
+            q.unlink()
+
+
+def time_warm(worker: ConversionWorker, HDW_FRAMES_PER_BUFFER: int) -> float:
+    start_s = time.time()
+    q_in = SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC)
+    q_out = SharedRingBuffer(RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER)
+
+    worker.attach(q_in, q_out, HDW_FRAMES_PER_BUFFER)
+    try:
+        return wait_for_first_packet(q_in, q_out, start_s)
+    finally:
+        worker.detach()
+        for q in (q_in, q_out):
+            q.close()
+            q.unlink()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--callback-latency-ms", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=3, help="number of sessions started one after the other")
+    opt = parser.parse_args()
+
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms / 1000)
+    pipeline_opt = argparse.Namespace(
+        mode=InferencePipelineMode.online_crossfade,
+        noise_suppression_threshold=Value("d", 5.0),
+        callback_latency_ms=Value("I", opt.callback_latency_ms),
+        context_length_ms=Value("I", 0),
+        target_speaker=opt.target_speaker,
+    )
+
+    cold_s = [time_cold(pipeline_opt, HDW_FRAMES_PER_BUFFER) for _ in range(opt.sessions)]
+    _LOGGER.info(f"cold: time to first packet {', '.join(f'{t:0.2f}s' for t in cold_s)}")
+
+    start_s = time.time()
+    worker = ConversionWorker(pipeline_opt)
+    worker.start()
+    worker.wait_until_ready()
+    _LOGGER.info(f"warm: worker startup (paid once, at server startup) {time.time() - start_s:0.2f}s")
+    try:
+        warm_s = [time_warm(worker, HDW_FRAMES_PER_BUFFER) for _ in range(opt.sessions)]
+        _LOGGER.info(f"warm: time to first packet {', '.join(f'{1000 * t:0.1f}ms' for t in warm_s)}")
+    finally:
+        worker.stop()
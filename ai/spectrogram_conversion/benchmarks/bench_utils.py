@@ -0,0 +1,65 @@
+import time
+from typing import Optional, Tuple
+
+import librosa
+import numpy as np
+
+from ai.spectrogram_conversion.params import (MAX_INFER_SAMPLES_VC, SEED, fmax, fmin, hop_length, n_fft, num_mels,
+                                              sample_rate, win_length)
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+
+
+def load_reference_clip(path: Optional[str], duration_s: float = 10) -> np.ndarray:
+    """Loads `path` at `sample_rate`, or synthesises a clip when no reference recording is given"""
+    if path:
+        wav, _ = librosa.load(path, sr=sample_rate, duration=duration_s)
+        return wav.astype(np.float32)
+
+    rng = np.random.default_rng(SEED)
+    t = np.arange(int(duration_s * sample_rate)) / sample_rate
+    f0 = 120 + 40 * np.sin(2 * np.pi * 0.5 * t)
+    wav = sum(0.2 / k * np.sin(2 * np.pi * k * np.cumsum(f0) / sample_rate) for k in range(1, 8))
+    return (wav * (0.5 + 0.5 * np.sin(2 * np.pi * 2 * t) ** 2) + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def stream_through_pipeline(voice_conversion, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Feeds `wav` packet by packet, as the PyAudio callback would. Returns the output & per-packet durations in ms"""
+    voice_conversion.reset()
+    window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+
+    outs, durations_ms = [], []
+    for i in range(0, len(wav) - HDW_FRAMES_PER_BUFFER + 1, HDW_FRAMES_PER_BUFFER):
+        window.append(wav[i : i + HDW_FRAMES_PER_BUFFER])
+
+        start_ns = time.perf_counter_ns()
+        outs.append(np.array(voice_conversion.run(window.view(), HDW_FRAMES_PER_BUFFER)))
+        durations_ms.append((time.perf_counter_ns() - start_ns) / 1e6)
+
+    return np.concatenate(outs), np.array(durations_ms)
+
+
+def log_mel(wav: np.ndarray) -> np.ndarray:
+    mel = librosa.feature.melspectrogram(
+        y=wav,
+        sr=sample_rate,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        win_length=win_length,
+        n_mels=num_mels,
+        fmin=fmin,
+        fmax=fmax,
+    )
+    return librosa.power_to_db(mel, ref=1.0, top_db=None)
+
+
+def mel_distance(wav: np.ndarray, reference: np.ndarray) -> float:
+    """Mean absolute log-mel spectral distance, in dB"""
+    n = min(len(wav), len(reference))
+    return float(np.mean(np.abs(log_mel(wav[:n]) - log_mel(reference[:n]))))
+
+
+def format_latency_ms(durations_ms: np.ndarray) -> str:
+    return (
+        f"mean: {np.mean(durations_ms):0.2f}ms \tp50: {np.percentile(durations_ms, 50):0.2f}ms \t"
+        f"p99: {np.percentile(durations_ms, 99):0.2f}ms"
+    )
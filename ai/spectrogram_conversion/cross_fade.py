@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class LinearCrossFade:
+    """
+    Stitches consecutive, overlapping model outputs together with a linear cross-fade. The last `fade_samples` of each
+    output are held back and faded into the start of the next packet, which delays the output by `fade_samples`.
+    """
+
+    def __init__(self, fade_samples: int):
+        self.fade_samples = fade_samples
+
+        self._linear_fade_in = np.linspace(0, 1, fade_samples, dtype=np.float32)
+        self._linear_fade_out = np.linspace(1, 0, fade_samples, dtype=np.float32)
+        self._old_samples = np.zeros(fade_samples, dtype=np.float32)
+
+    def reset(self):
+        self._old_samples[:] = 0
+
+    def __call__(self, out: np.ndarray, HDW_FRAMES_PER_BUFFER: int, future_samples: int = 0) -> np.ndarray:
+        """
+        Returns the `HDW_FRAMES_PER_BUFFER` samples to send for `out`, which is modified in place. The last
+        `future_samples` of `out` are lookahead context and are never sent.
+        """
+        fade_samples = self.fade_samples
+        if future_samples:
+            out = out[:-future_samples]
+
+        # cross-fade = fade_in + fade_out
+        out[-(HDW_FRAMES_PER_BUFFER + fade_samples) : -HDW_FRAMES_PER_BUFFER] = (
+            out[-(HDW_FRAMES_PER_BUFFER + fade_samples) : -HDW_FRAMES_PER_BUFFER] * self._linear_fade_in
+        ) + (self._old_samples * self._linear_fade_out)
+        # save
+        self._old_samples[:] = out[-fade_samples:]
+        # send
+        return out[-(HDW_FRAMES_PER_BUFFER + fade_samples) : -fade_samples]
@@ -0,0 +1,86 @@
+"""
+Exports model.pt & b_model.pt to ONNX for the onnxruntime backend, & checks the exported models against TorchScript.
+
+python -m ai.spectrogram_conversion.export_onnx --target-speaker zeus
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from ai.spectrogram_conversion.feature_cache import PREPROCESSOR_HOP
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC, SEED, sample_rate
+from ai.spectrogram_conversion.resampler import PolyphaseResampler
+from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
+from ai.spectrogram_conversion.voice_conversion import MODELS_ROOT
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def export(models_root: str, output_root: str, target_speaker: str, opset_version: int, batch_size: int = 2):
+    pmodel = torch.jit.load(os.path.join(models_root, "b_model.pt"), map_location="cpu").eval()
+    model = torch.jit.load(os.path.join(models_root, "model.pt"), map_location="cpu").eval()
+
+    # example inputs at the size of the online pipeline's window, the batch & time axes are exported as dynamic
+    rng = np.random.default_rng(SEED)
+    p_window_len = PolyphaseResampler(sample_rate, 16000).output_length(MAX_INFER_SAMPLES_VC)
+    wav_src = torch.from_numpy((0.1 * rng.standard_normal((batch_size, p_window_len))).astype(np.float32))
+    target = torch.from_numpy(np.load(os.path.join(models_root, f"targets/{target_speaker}.npy"))).unsqueeze(0)
+    targets = target.expand(batch_size, *target.shape[1:]).contiguous()
+
+    with torch.inference_mode():
+        c = pmodel(wav_src)
+        audio = model(c, targets)
+    frame_axis = min(range(1, c.dim()), key=lambda axis: abs(c.shape[axis] - p_window_len / PREPROCESSOR_HOP))
+
+    os.makedirs(output_root, exist_ok=True)
+    with TimedScope("export b_model.onnx", _LOGGER):
+        torch.onnx.export(
+            pmodel,
+            (wav_src,),
+            os.path.join(output_root, "b_model.onnx"),
+            input_names=["wav_src"],
+            output_names=["c"],
+            dynamic_axes={"wav_src": {0: "batch", 1: "samples"}, "c": {0: "batch", frame_axis: "frames"}},
+            opset_version=opset_version,
+        )
+    with TimedScope("export model.onnx", _LOGGER):
+        torch.onnx.export(
+            model,
+            (c, targets),
+            os.path.join(output_root, "model.onnx"),
+            input_names=["c", "target"],
+            output_names=["audio"],
+            dynamic_axes={
+                "c": {0: "batch", frame_axis: "frames"},
+                "target": {0: "batch"},
+                "audio": {0: "batch", 2: "samples"},
+            },
+            opset_version=opset_version,
+        )
+
+    return wav_src, c, targets, audio
+
+
+def check(output_root: str, wav_src: torch.Tensor, c: torch.Tensor, targets: torch.Tensor, audio: torch.Tensor):
+    import onnxruntime as ort
+
+    psession = ort.InferenceSession(os.path.join(output_root, "b_model.onnx"), providers=["CPUExecutionProvider"])
+    session = ort.InferenceSession(os.path.join(output_root, "model.onnx"), providers=["CPUExecutionProvider"])
+
+    (c_ort,) = psession.run(None, {"wav_src": wav_src.numpy()})
+    (audio_ort,) = session.run(None, {"c": c.numpy(), "target": targets.numpy()})
+    _LOGGER.info(f"b_model.onnx max_abs_err={np.max(np.abs(c_ort - c.numpy())):0.2e}")
+    _LOGGER.info(f"model.onnx max_abs_err={np.max(np.abs(audio_ort - audio.numpy())):0.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-speaker", type=str, required=True, help="embedding used for the example inputs")
+    parser.add_argument("--models-root", type=str, default=MODELS_ROOT)
+    parser.add_argument("--output-root", type=str, default=MODELS_ROOT)
+    parser.add_argument("--opset-version", type=int, default=17)
+    opt = parser.parse_args()
+
+    check(opt.output_root, *export(opt.models_root, opt.output_root, opt.target_speaker, opt.opset_version))
@@ -0,0 +1,99 @@
+import os
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+
+from ai.spectrogram_conversion.resampler import StreamingResampler
+from ai.spectrogram_conversion.timedscope import get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+# frame shift of the content encoder's convolutional feature extractor, in 16kHz samples
+PREPROCESSOR_HOP = 320
+
+
+class FeatureCache:
+    """
+    Caches the preprocessor's content features across consecutive, overlapping windows of a stream. Only the samples
+    that arrived since the previous window are run through the preprocessor, along with `margin_samples` of context on
+    either side of the boundary to cover the encoder's receptive field, and the result is spliced onto the cached
+    frames.
+
+    Frames are computed on the grid of each window's own start, exactly as without the cache, so that the output stays
+    aligned with the end of the window. Cached frames are therefore only reused when the stream advanced by a multiple
+    of `hop` samples since the previous window, e.g. for packet lengths that are a multiple of 20ms. Otherwise all
+    frames are recomputed, which is what the pipeline does without the cache.
+    """
+
+    def __init__(
+        self,
+        preprocessor: Callable[[np.ndarray], torch.Tensor],
+        margin_samples: int,
+        hop: int = PREPROCESSOR_HOP,
+    ):
+        self._preprocessor = preprocessor
+        self.hop = hop
+        self.margin_samples = -(-margin_samples // hop) * hop
+        self.reset()
+
+    def reset(self):
+        self._feats: Optional[torch.Tensor] = None
+        self._frame_axis: Optional[int] = None
+        # absolute sample positions of the first cached frame & the end of the stream when the cache was computed
+        self._start = 0
+        self._end = 0
+        self._warned_misaligned = False
+
+    @torch.inference_mode()
+    def _run(self, stream: StreamingResampler, start: int) -> torch.Tensor:
+        wav_src = stream.window(stream.total_out - start)
+        feats = self._preprocessor(np.ascontiguousarray(wav_src[np.newaxis, :]))
+
+        if self._frame_axis is None:
+            # the frame axis is the one whose size tracks the number of samples
+            n_frames = len(wav_src) / self.hop
+            self._frame_axis = min(range(1, feats.dim()), key=lambda axis: abs(feats.shape[axis] - n_frames))
+        return feats
+
+    def full(self, stream: StreamingResampler, window_len: int) -> torch.Tensor:
+        """Features for the latest `window_len` samples of `stream`, recomputed from scratch"""
+        return self._run(stream, stream.total_out - window_len)
+
+    def __call__(self, stream: StreamingResampler, window_len: int) -> torch.Tensor:
+        """Features for the latest `window_len` samples of `stream`, reusing frames cached from previous windows"""
+        end = stream.total_out
+        start = end - window_len
+        # frames before `tail_start`, on the grid of `start`, are far enough from the end of the previous window to be
+        # reused
+        tail_start = start + ((self._end - self.margin_samples - start) // self.hop) * self.hop
+
+        aligned = (start - self._start) % self.hop == 0
+        if self._feats is not None and not aligned and not self._warned_misaligned:
+            _LOGGER.warn(
+                f"the stream advanced by {start - self._start} samples, not a multiple of {self.hop}, so the features "
+                "are recomputed for every window"
+            )
+            self._warned_misaligned = True
+
+        n_reused = (tail_start - start) // self.hop
+        if (
+            self._feats is None
+            or not aligned
+            or start < self._start
+            or n_reused <= 0
+            or (tail_start - self._start) // self.hop > self._feats.shape[self._frame_axis]
+        ):
+            feats = self._run(stream, start)
+        else:
+            chunk_start = max(tail_start - self.margin_samples, start)
+            tail = self._run(stream, chunk_start)
+            n_skipped = (tail_start - chunk_start) // self.hop
+            tail = tail.narrow(self._frame_axis, n_skipped, tail.shape[self._frame_axis] - n_skipped)
+            reused = self._feats.narrow(self._frame_axis, (start - self._start) // self.hop, n_reused)
+            feats = torch.cat((reused, tail), dim=self._frame_axis)
+
+        self._feats = feats
+        self._start = start
+        self._end = end
+        return feats
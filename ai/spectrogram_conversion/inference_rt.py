@@ -6,26 +6,38 @@ import argparse
 import math
 import multiprocessing
 import os
+import queue
 import time
-from collections import deque
-from multiprocessing import Process, Queue, Value
-from queue import Empty
+from multiprocessing import Process, Value
 from typing import Callable, Optional
 
 import numpy as np
+import psutil
 import pyaudio
 
+from ai.common.process_utils import configure_process, parse_cpu_list
 from ai.common.torch_utils import get_device, set_seed
+from ai.spectrogram_conversion.backends import BACKENDS, ORT_GRAPH_OPTIMIZATION_LEVELS
+from ai.spectrogram_conversion.cross_fade import LinearCrossFade
 from ai.spectrogram_conversion.data_types import InferencePipelineMode
-from ai.spectrogram_conversion.params import (MAX_INFER_SAMPLES_VC, SEED,
-                                              sample_rate)
+from ai.spectrogram_conversion.feature_cache import FeatureCache
+from ai.spectrogram_conversion.params import (
+    CROSS_FADE_DURATION_MS, FEATURE_CACHE_MARGIN_MS, FUTURE_CONTEXT_MS, MAX_FUTURE_CONTEXT_SAMPLES,
+    MAX_INFER_SAMPLES_VC, PAST_CONTEXT_MS, PAST_FUTURE_CROSS_FADE_DURATION_MS, RECORDING_CODEC,
+    RECORDING_RETENTION_S, SEED, sample_rate)
 from ai.spectrogram_conversion.perf_counter import DebugPerfCounter
+from ai.spectrogram_conversion.recording import (RECORDING_CODECS, RecordingBuffers, RecordingWriter,
+                                                 get_recording_buffers_root, get_recording_fname,
+                                                 resolve_recording_codec)
+from ai.spectrogram_conversion.resampler import StreamingResampler
 from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
 from ai.spectrogram_conversion.utils.audio_utils import get_audio_io_indices
-from ai.spectrogram_conversion.utils.multiprocessing_utils import SharedCounter
+from ai.spectrogram_conversion.utils.latency_histogram import LatencyHistograms
+from ai.spectrogram_conversion.utils.multiprocessing_utils import FrameHealth, SharedRingBuffer
+from ai.spectrogram_conversion.utils.network_utils import STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW
 from ai.spectrogram_conversion.utils.utils import (
-    get_conversion_root, get_ordered_data_from_circular_buffer)
-from ai.spectrogram_conversion.voice_conversion import ModelConversionPipeline
+    SlidingWindow, get_conversion_root, get_ordered_data_from_circular_buffer)
+from ai.spectrogram_conversion.voice_conversion import ModelConversionPipeline, get_opt_value
 
 _LOGGER = get_logger(os.path.basename(__file__))
 set_seed(SEED)
@@ -34,34 +46,48 @@ set_seed(SEED)
 #  PyAudio Setup
 # ----------------
 
-p = pyaudio.PyAudio()
+# NOTE: PortAudio is only initialised by run_inference_rt, importing this module must stay cheap
 FORMAT = pyaudio.paFloat32
 CHANNELS = 1
 RATE = sample_rate
 
+# number of packets each of q_in & q_out can hold
+RING_BUFFER_CAPACITY = 8
+# how often an idle conversion worker, blocked on its control queue, checks whether it should stop
+IDLE_POLL_S = 0.5
+
 # serves as the head pointer for the audio_in & audio_out circular buffers
 PACKET_ID = 0
+# monotonically increasing packet id, lets the conversion process detect packets dropped on a full q_in
+PACKET_COUNT = 0
 BUFFER_OVERFLOW = False
 PACKET_START_S = None
 WAV: Optional[np.ndarray] = None
 
 
-# TODO sidroopdaska: remove numpy.ndarray allocation
-# TODO sidroopdaska: create a lock-free, single producer and single consumer ring buffer
 def get_io_stream_callback(
-    q_in: Queue,
-    q_in_counter: Value,
-    data: list,
+    q_in: SharedRingBuffer,
+    window: SlidingWindow,
     audio_in: list,
-    q_out: Queue,
-    q_out_counter: Value,
+    q_out: SharedRingBuffer,
     audio_out: list,
     MAX_RECORD_SEGMENTS: int,
-    latency_queue: Optional[multiprocessing.Queue] = None,
-    frame_dropping: Optional[multiprocessing.Queue] = None,
+    frame_health: Optional[FrameHealth] = None,
+    latency_histograms: Optional[LatencyHistograms] = None,
 ) -> Callable:
+    # preallocated so that the callback doesn't allocate full-size buffers on the audio thread. They're returned to
+    # PyAudio as they are, which copies them into the device buffer before the next callback. It only accepts buffers
+    # without a release hook, i.e. bytes or numpy arrays but not bytearrays or memoryviews
+    out_buffer = np.zeros(q_out.slot_len, dtype=np.float32)
+    silence = np.zeros(q_out.slot_len, dtype=np.float32)
+    if latency_histograms is not None:
+        capture_stage, output_queue_wait_stage, roundtrip_stage = (
+            latency_histograms.index[stage] for stage in ("capture", "output_queue_wait", "roundtrip")
+        )
+
     def callback(in_data, frame_count, time_info, status):
-        global PACKET_ID, PACKET_START_S, WAV, BUFFER_OVERFLOW
+        global PACKET_ID, PACKET_COUNT, PACKET_START_S, WAV, BUFFER_OVERFLOW
+        callback_start_ns = time.perf_counter_ns()
 
         _LOGGER.debug(f"io_stream_callback duration={time.time() - PACKET_START_S}")
         _LOGGER.debug(f"io_stream_callback frame_count={frame_count}")
@@ -71,62 +97,43 @@ def get_io_stream_callback(
         in_data_np = np.frombuffer(in_data, dtype=np.float32)
 
         audio_in[PACKET_ID] = in_data_np
-        data.append(in_data_np)
-        q_in.put_nowait(
-            (
-                PACKET_ID,
-                PACKET_START_S,
-                # passing data as bytes in multiprocessing:Queue is quicker
-                np.array(data).flatten().astype(np.float32)[-MAX_INFER_SAMPLES_VC:].tobytes(),
-            )
-        )
-        q_in_counter.increment()
+        window.append(in_data_np)
+        if not q_in.put(PACKET_COUNT, PACKET_START_S, window.view()):
+            _LOGGER.info("q_in: overflow")
+        if latency_histograms is not None:
+            latency_histograms.record_ns(capture_stage, time.perf_counter_ns() - callback_start_ns)
 
         # prepare output
         out_data = None
         p_id, p_start_s = None, None
-        latency_dump = None
 
-        if q_out_counter.value == 0:
+        q_out_len = len(q_out)
+        if q_out_len == 0:
             _LOGGER.info("q_out: underflow")
-            out_data = np.zeros(frame_count).astype(np.float32).tobytes()
-
-            if frame_dropping:
-                frame_dropping.put_nowait(-1)
-            if latency_queue:
-                latency_dump = 1000
-        elif q_out_counter.value == 1:
-            p_id, p_start_s, out_data = q_out.get_nowait()
-            q_out_counter.increment(-1)
-
-            if frame_dropping:
-                frame_dropping.put_nowait(0)
-            if latency_queue:
-                latency_dump = time.time() - p_start_s
+            out_data = silence if frame_count == q_out.slot_len else np.zeros(frame_count, dtype=np.float32)
+            status = STATUS_UNDERFLOW
+        elif q_out_len == 1:
+            p_id, p_start_s, out_data = q_out.get(out=out_buffer)
+            status = STATUS_OK
         else:
             _LOGGER.info("q_out: overflow")
+            p_id, p_start_s, out_data = q_out.get(out=out_buffer, latest=True)
+            status = STATUS_OVERFLOW
 
-            if frame_dropping:
-                frame_dropping.put_nowait(1)
-            if latency_queue:
-                latency_dump = 0
-
-            while not q_out.empty():
-                try:
-                    p_id, p_start_s, out_data = q_out.get_nowait()
-                    q_out_counter.increment(-1)
-                except Empty:
-                    pass
-
-        if latency_queue:
-            latency_queue.put_nowait(latency_dump)
+        if frame_health is not None:
+            # shared memory, so that nothing is sent between processes on the audio thread
+            frame_health.record(PACKET_COUNT, status, float("nan") if p_start_s is None else time.time() - p_start_s)
+        if latency_histograms is not None and p_start_s is not None:
+            latency_histograms.record_ns(output_queue_wait_stage, q_out.last_wait_ns)
+            latency_histograms.record_s(roundtrip_stage, time.time() - p_start_s)
 
         if p_id and p_id % 3 == 0:
             _LOGGER.info(f"roundtrip: {time.time() - p_start_s}")
 
-        audio_out[PACKET_ID] = np.frombuffer(out_data, dtype=np.float32)
+        audio_out[PACKET_ID] = out_data
 
         # update vars
+        PACKET_COUNT += 1
         if (PACKET_ID + 1) >= MAX_RECORD_SEGMENTS:
             PACKET_ID = 0
             BUFFER_OVERFLOW = True
@@ -146,152 +153,456 @@ class ConversionPipeline(ModelConversionPipeline):
     def __init__(self, opt: argparse.Namespace):
         super().__init__(opt)
 
-        fade_duration_ms = 20
-        self._fade_samples = int(fade_duration_ms / 1000 * sample_rate)  # 20ms
+        # online_with_past_future only emits the center of the window, so boundary artifacts are smaller and a shorter
+        # cross-fade will do
+        self._future_samples = 0
+        fade_duration_ms = CROSS_FADE_DURATION_MS
+        if self._opt.mode == InferencePipelineMode.online_with_past_future:
+            future_context_ms = getattr(self._opt, "future_context_ms", FUTURE_CONTEXT_MS)
+            self._future_samples = min(int(future_context_ms / 1000 * sample_rate), MAX_FUTURE_CONTEXT_SAMPLES)
+            fade_duration_ms = PAST_FUTURE_CROSS_FADE_DURATION_MS
+        fade_duration_ms = getattr(self._opt, "fade_duration_ms", None) or fade_duration_ms
+        self._cross_fade = LinearCrossFade(int(fade_duration_ms / 1000 * sample_rate))
+
+        # only the newly arrived samples of each window are resampled, the rest is sliced out of the rolling buffer
+        self._stream_resampler = StreamingResampler(
+            sample_rate, self.p_sampling_rate, self.p_resampler.output_length(MAX_INFER_SAMPLES_VC)
+        )
 
-        self._linear_fade_in = np.linspace(0, 1, self._fade_samples, dtype=np.float32)
-        self._linear_fade_out = np.linspace(1, 0, self._fade_samples, dtype=np.float32)
-        self._old_samples = np.zeros(self._fade_samples, dtype=np.float32)
+        self._feature_cache = None
+        if getattr(self._opt, "feature_cache", False):
+            margin_ms = getattr(self._opt, "feature_cache_margin_ms", FEATURE_CACHE_MARGIN_MS)
+            self._feature_cache = FeatureCache(self._run_preprocessor, int(margin_ms / 1000 * self.p_sampling_rate))
+
+        self._perf_counter = DebugPerfCounter("voice_conversion", _LOGGER)
+
+    def reset(self):
+        """Drops the streaming state, e.g. left over from warmup, prior to converting a new stream"""
+        self._cross_fade.reset()
+        self._stream_resampler.reset()
+        if self._feature_cache:
+            self._feature_cache.reset()
+
+    def algorithmic_latency_ms(self, HDW_FRAMES_PER_BUFFER: int) -> float:
+        """Delay added by the pipeline itself between capturing and playing back a sample, i.e. excluding compute"""
+        latency_samples = (
+            HDW_FRAMES_PER_BUFFER
+            + self._cross_fade.fade_samples
+            + self._future_samples
+            + self._stream_resampler.half_len / self._stream_resampler.up
+        )
+        return latency_samples / sample_rate * 1000
+
+    def run(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int, n_new_samples: Optional[int] = None):
+        # voice changes take effect on the next packet, & are stitched in by the cross-fade
+        self.update_target()
 
-    def run(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int):
         if self._opt.mode == InferencePipelineMode.online_crossfade:
-            return self.run_cross_fade(wav, HDW_FRAMES_PER_BUFFER)
+            return self.run_cross_fade(wav, HDW_FRAMES_PER_BUFFER, n_new_samples)
         elif self._opt.mode == InferencePipelineMode.online_with_past_future:
-            raise NotImplementedError
+            return self.run_past_future(wav, HDW_FRAMES_PER_BUFFER, n_new_samples)
         else:
             raise Exception(f"Mode: {self._opt.mode} unsupported")
 
+    def _push_window(self, wav: np.ndarray, n_new_samples: int):
+        if n_new_samples >= len(wav):
+            # no overlap with the previous window, e.g. after packets were dropped
+            self._stream_resampler.reset()
+            if self._feature_cache:
+                self._feature_cache.reset()
+            n_new_samples = len(wav)
+
+        self._stream_resampler.push(wav[-n_new_samples:])
+
+    def _convert_window(
+        self,
+        wav: np.ndarray,
+        HDW_FRAMES_PER_BUFFER: int,
+        n_new_samples: int,
+        context_samples: int,
+        future_samples: int = 0,
+    ) -> np.ndarray:
+        """Converts the latest `context_samples` of `wav`, returns the next `HDW_FRAMES_PER_BUFFER` output samples"""
+        with self.time_stage("resample"):
+            self._push_window(wav, n_new_samples)
+
+        p_context_samples = self.p_resampler.output_length(context_samples)
+        with self.time_stage("preprocessor"):
+            if self._feature_cache:
+                c = self._feature_cache(self._stream_resampler, p_context_samples)
+            else:
+                c = self.preprocess(self._stream_resampler.window(p_context_samples)[np.newaxis, :])
+
+        with self.time_stage("model"):
+            audio = self.convert_features(c)
+
+        with self.time_stage("postprocess"):
+            out = self.pp_resampler(audio)[0]
+            out = self.suppress_noise(out, wav[-context_samples:])
+            out = self._cross_fade(out, HDW_FRAMES_PER_BUFFER, future_samples)
+        return out
+
+    def _context_samples(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int) -> int:
+        """Number of samples of the window fed to the model, the whole window unless `context_length_ms` is set"""
+        context_length_ms = self._get_opt_value("context_length_ms")
+        if not context_length_ms:
+            return len(wav)
+
+        context_samples = int(context_length_ms / 1000 * sample_rate)
+        return min(max(context_samples, HDW_FRAMES_PER_BUFFER + self._cross_fade.fade_samples), len(wav))
+
     # Linear cross-fade
-    def run_cross_fade(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int):
-        with DebugPerfCounter("voice_conversion", _LOGGER):
-            with DebugPerfCounter("model", _LOGGER):
-                out = self.infer(wav)
-
-                # suppress output if excessive model amplification detected
-                threshold = None
-                if type(self._opt.noise_suppression_threshold) == float:
-                    threshold = self._opt.noise_suppression_threshold
-                else:
-                    with self._opt.noise_suppression_threshold.get_lock():
-                        threshold = self._opt.noise_suppression_threshold.value
-
-                _LOGGER.debug(f"noise_suppression_threshold: {threshold}")
-                if np.max(np.abs(out)) > (threshold * np.max(np.abs(wav))):
-                    _LOGGER.debug("supressing noise")
-                    out = 0 * out
-
-                # cross-fade = fade_in + fade_out
-                out[-(HDW_FRAMES_PER_BUFFER + self._fade_samples) : -HDW_FRAMES_PER_BUFFER] = (
-                    out[-(HDW_FRAMES_PER_BUFFER + self._fade_samples) : -HDW_FRAMES_PER_BUFFER] * self._linear_fade_in
-                ) + (self._old_samples * self._linear_fade_out)
-                # save
-                self._old_samples = out[-self._fade_samples :]
-                # send
-                out = out[-(HDW_FRAMES_PER_BUFFER + self._fade_samples) : -self._fade_samples]
+    def run_cross_fade(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int, n_new_samples: Optional[int] = None):
+        """`n_new_samples` defaults to HDW_FRAMES_PER_BUFFER, i.e. `wav` follows on from the previous window"""
+        context_samples = self._context_samples(wav, HDW_FRAMES_PER_BUFFER)
+
+        with self._perf_counter:
+            # shorter contexts trade conversion quality for less compute per packet
+            out = self._convert_window(
+                wav, HDW_FRAMES_PER_BUFFER, n_new_samples or HDW_FRAMES_PER_BUFFER, context_samples
+            )
+        return out
+
+    # Past & future context, cross-faded at the boundaries of the emitted center region
+    def run_past_future(self, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int, n_new_samples: Optional[int] = None):
+        """
+        The window fed to the model is trimmed to `past + HDW_FRAMES_PER_BUFFER + future` samples. The latest `future`
+        samples are only used as lookahead, which delays the output by `future` samples.
+        """
+        past_context_ms = getattr(self._opt, "past_context_ms", PAST_CONTEXT_MS)
+        past_samples = max(
+            min(
+                int(past_context_ms / 1000 * sample_rate),
+                len(wav) - HDW_FRAMES_PER_BUFFER - self._future_samples - self._cross_fade.fade_samples,
+            ),
+            0,
+        )
+        context_samples = past_samples + HDW_FRAMES_PER_BUFFER + self._cross_fade.fade_samples + self._future_samples
+
+        with self._perf_counter:
+            out = self._convert_window(
+                wav,
+                HDW_FRAMES_PER_BUFFER,
+                n_new_samples or HDW_FRAMES_PER_BUFFER,
+                context_samples,
+                self._future_samples,
+            )
         return out
 
 
 # -------------------
 #  Main app processes
 # -------------------
+def configure_conversion_process(opt: argparse.Namespace):
+    """Applies the thread, cpu affinity & priority settings of `opt`, keeping the conversion clear of other processes"""
+    cpu_affinity = get_opt_value(opt, "cpu_affinity")
+    try:
+        cpu_affinity = parse_cpu_list(cpu_affinity) if cpu_affinity else None
+    except ValueError as e:
+        # a bad setting mustn't take the conversion down
+        _LOGGER.warn(f"ignoring the cpu affinity: {e}")
+        cpu_affinity = None
+    configure_process(
+        num_threads=int(get_opt_value(opt, "num_threads", 0)),
+        num_interop_threads=int(get_opt_value(opt, "num_interop_threads", 0)),
+        cpu_affinity=cpu_affinity,
+        high_priority=bool(get_opt_value(opt, "high_priority", False)),
+        logger=_LOGGER,
+    )
+
+
+def warmup(voice_conversion: ConversionPipeline, HDW_FRAMES_PER_BUFFER: int, warmup_iterations: int = 10):
+    """Runs the models on random audio to get them into the cache, then drops the streaming state"""
+    for _ in range(warmup_iterations):
+        wav = np.random.rand(MAX_INFER_SAMPLES_VC).astype(np.float32)
+        voice_conversion.run(wav, HDW_FRAMES_PER_BUFFER)
+    voice_conversion.reset()
+
+
+def convert_next_packet(
+    voice_conversion: ConversionPipeline,
+    q_in: SharedRingBuffer,
+    q_out: SharedRingBuffer,
+    wav_buffer: np.ndarray,
+    last_p_id: int,
+    HDW_FRAMES_PER_BUFFER: int,
+) -> Optional[int]:
+    """Converts the next packet of q_in into q_out, returns its packet id or None if q_in is empty"""
+    packet = q_in.get(out=wav_buffer)
+    if packet is None:
+        return None
+
+    p_id, p_start_s, wav = packet
+    voice_conversion.record_stage("queue_wait", q_in.last_wait_ns)
+    out = voice_conversion.run(wav, HDW_FRAMES_PER_BUFFER, (p_id - last_p_id) * HDW_FRAMES_PER_BUFFER)
+
+    if not q_out.put(p_id, p_start_s, out):
+        _LOGGER.info("q_out: full, dropping packet")
+    return p_id
+
+
 def conversion_process_target(
     stop: Value,
-    q_in: Queue,
-    q_out: Queue,
-    q_in_counter: SharedCounter,
-    q_out_counter: SharedCounter,
+    q_in: SharedRingBuffer,
+    q_out: SharedRingBuffer,
     model_warmup_complete: Value,
     opt: dict,
     HDW_FRAMES_PER_BUFFER: int,
 ):
+    # before loading the models, inter-op threads can't be changed once used
+    configure_conversion_process(opt)
     voice_conversion = ConversionPipeline(opt)
 
-    # warmup models into the cache
-    warmup_iterations = 10
-    for _ in range(warmup_iterations):
-        wav = np.random.rand(MAX_INFER_SAMPLES_VC).astype(np.float32)
-        voice_conversion.run(wav, HDW_FRAMES_PER_BUFFER)
+    warmup(voice_conversion, HDW_FRAMES_PER_BUFFER)
+    _LOGGER.info(
+        f"mode={opt.mode} algorithmic_latency={voice_conversion.algorithmic_latency_ms(HDW_FRAMES_PER_BUFFER):0.1f}ms"
+    )
     model_warmup_complete.value = 1
 
+    wav_buffer = np.zeros(q_in.slot_len, dtype=np.float32)
+    last_p_id = -1
     try:
         while not stop.value:
-            p_id, p_start_s, wav_bytes = q_in.get()
-            q_in_counter.increment(-1)
+            p_id = convert_next_packet(voice_conversion, q_in, q_out, wav_buffer, last_p_id, HDW_FRAMES_PER_BUFFER)
+            if p_id is None:
+                time.sleep(0.001)
+                continue
+            last_p_id = p_id
+    except KeyboardInterrupt:
+        pass
+    finally:
+        q_in.close()
+        q_out.close()
+        _LOGGER.info("conversion_process_target: stopped")
+
+
+def conversion_worker_target(
+    stop: Value,
+    control_queue: multiprocessing.Queue,
+    model_warmup_complete: Value,
+    opt: argparse.Namespace,
+):
+    """
+    Same as `conversion_process_target`, but the models are loaded & warmed up once for any number of sessions, which
+    attach their q_in & q_out with ("attach", q_in, q_out, HDW_FRAMES_PER_BUFFER) & leave with ("detach",)
+    """
+    configure_conversion_process(opt)
+    voice_conversion = ConversionPipeline(opt)
+
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * voice_conversion._get_opt_value("callback_latency_ms") / 1000)
+    warmup(voice_conversion, HDW_FRAMES_PER_BUFFER)
+    model_warmup_complete.value = 1
+
+    q_in, q_out, wav_buffer = None, None, None
+    last_p_id = -1
 
-            wav = np.frombuffer(wav_bytes, dtype=np.float32)
-            out = voice_conversion.run(wav, HDW_FRAMES_PER_BUFFER)
+    def detach():
+        nonlocal q_in, q_out
+        if q_in is not None:
+            q_in.close()
+            q_out.close()
+        q_in, q_out = None, None
 
-            q_out.put_nowait((p_id, p_start_s, out.tobytes()))
-            q_out_counter.increment()
+    try:
+        while not stop.value:
+            try:
+                # blocks while idle, the queue is only polled between the packets of an attached session
+                if q_in is None:
+                    message = control_queue.get(timeout=IDLE_POLL_S)
+                else:
+                    message = control_queue.get_nowait()
+                while True:
+                    # a session replaces the previous one, whether or not it detached
+                    detach()
+                    if message[0] == "attach":
+                        _, q_in, q_out, HDW_FRAMES_PER_BUFFER = message
+                        wav_buffer = np.zeros(q_in.slot_len, dtype=np.float32)
+                        last_p_id = -1
+                        voice_conversion.reset()
+                        # the settings may have changed since the worker was started
+                        configure_conversion_process(opt)
+                        _LOGGER.info(
+                            f"attached mode={opt.mode} algorithmic_latency="
+                            f"{voice_conversion.algorithmic_latency_ms(HDW_FRAMES_PER_BUFFER):0.1f}ms"
+                        )
+                    message = control_queue.get_nowait()
+            except queue.Empty:
+                pass
+            except FileNotFoundError:
+                # the session was detached, & its shared memory unlinked, before it was ever attached
+                pass
+
+            if q_in is None:
+                continue
+            p_id = convert_next_packet(voice_conversion, q_in, q_out, wav_buffer, last_p_id, HDW_FRAMES_PER_BUFFER)
+            if p_id is None:
+                time.sleep(0.001)
+                continue
+            last_p_id = p_id
     except KeyboardInterrupt:
         pass
     finally:
-        _LOGGER.info("conversion_process_target: stopped")
+        detach()
+        _LOGGER.info("conversion_worker_target: stopped")
+
+
+class ConversionWorker:
+    """
+    A long-lived conversion process that is started & warmed up ahead of time, so that starting a session only needs
+    to attach its ring buffers. Live settings are read from the `multiprocessing.Value`s of `opt`, which therefore
+    have to be created before the worker is started.
+
+    `wait_until_ready` & `attach` raise RuntimeError if the worker has died, e.g. while loading the models, in which
+    case sessions should convert in their own process instead.
+    """
+
+    def __init__(self, opt: argparse.Namespace):
+        self._opt = opt
+        self._stop = Value("i", 0)
+        self._model_warmup_complete = Value("i", 0)
+        self._control_queue = multiprocessing.Queue()
+        self._process: Optional[Process] = None
+        self._pid: Optional[int] = None
+
+    def __getstate__(self):
+        # sessions run in their own process, which only needs the shared state to attach
+        state = self.__dict__.copy()
+        state["_process"] = None
+        return state
+
+    def start(self):
+        self._process = Process(
+            target=conversion_worker_target,
+            args=(self._stop, self._control_queue, self._model_warmup_complete, self._opt),
+        )
+        self._process.start()
+        self._pid = self._process.pid
+
+    @property
+    def is_ready(self) -> bool:
+        return bool(self._model_warmup_complete.value)
+
+    @property
+    def is_alive(self) -> bool:
+        if self._process is not None:
+            return self._process.is_alive()
+        if self._pid is None:
+            return False
+
+        # in the sessions' processes, which can't join the worker. It stays a zombie until the server joins it
+        try:
+            return psutil.Process(self._pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def _check_alive(self):
+        if not self.is_alive:
+            exitcode = self._process.exitcode if self._process is not None else "unknown"
+            raise RuntimeError(f"the conversion worker has died, exit code: {exitcode}")
+
+    def wait_until_ready(self, poll_s: float = 0.05):
+        with TimedScope("model_warmup", _LOGGER):
+            while not self.is_ready:
+                self._check_alive()
+                time.sleep(poll_s)
+
+    def attach(self, q_in: SharedRingBuffer, q_out: SharedRingBuffer, HDW_FRAMES_PER_BUFFER: int):
+        self._check_alive()
+        self._control_queue.put(("attach", q_in, q_out, HDW_FRAMES_PER_BUFFER))
+
+    def detach(self):
+        self._control_queue.put(("detach",))
+
+    def stop(self):
+        with self._stop.get_lock():
+            self._stop.value = 1
+        if self._process:
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
 
 
 def run_inference_rt(
     opt: argparse.Namespace,
     stop_pipeline: Value,
     has_pipeline_started: Optional[Value] = None,
-    latency_queue: Optional[multiprocessing.Queue] = None,
-    frame_dropping: Optional[multiprocessing.Queue] = None,
+    frame_health: Optional[FrameHealth] = None,
+    worker: Optional[ConversionWorker] = None,
 ):
     """
+    Converts between the PortAudio devices of `opt` until `stop_pipeline` is set. Conversion runs on `worker` if given,
+    otherwise in a new process that loads & warms up the models first.
+
     NOTE: make sure to call 'multiprocessing.freeze_support()' from the __main__
     prior to invoking this function in a frozen application
     """
     global PACKET_START_S, WAV
 
     HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.callback_latency_ms.value / 1000)
-    NUM_CHUNKS = math.ceil(MAX_INFER_SAMPLES_VC / HDW_FRAMES_PER_BUFFER)
-    MAX_RECORD_SEGMENTS = 5 * 60 * sample_rate // HDW_FRAMES_PER_BUFFER  # 5 mins in duration
+    recording_retention_s = getattr(opt, "recording_retention_s", RECORDING_RETENTION_S)
+    MAX_RECORD_SEGMENTS = max(int(recording_retention_s * sample_rate) // HDW_FRAMES_PER_BUFFER, 2)
     # make sure dependencies are updated before starting the pipeline
     _LOGGER.debug(f"MAX_RECORD_SEGMENTS: {MAX_RECORD_SEGMENTS}")
     _LOGGER.debug(f"HDW_FRAMES_PER_BUFFER: {HDW_FRAMES_PER_BUFFER}")
-    _LOGGER.debug(f"NUM_CHUNKS: {NUM_CHUNKS}")
 
     # init
-    audio_in = np.zeros((MAX_RECORD_SEGMENTS, HDW_FRAMES_PER_BUFFER), dtype=np.float32)
-    audio_out = np.zeros((MAX_RECORD_SEGMENTS, HDW_FRAMES_PER_BUFFER), dtype=np.float32)
+    # memory mapped, the server reads the latest audio straight from the buffers once the session is stopped
+    recording = RecordingBuffers(
+        get_recording_buffers_root(), MAX_RECORD_SEGMENTS, HDW_FRAMES_PER_BUFFER, sample_rate
+    )
+    audio_in, audio_out = recording.buffers["original"], recording.buffers["converted"]
 
     stop_process = Value("i", 0)
     model_warmup_complete = Value("i", 0)
-    q_in, q_out = Queue(), Queue()  # TODO sidroopdaska: create wrapper class for multiprocessing:Queue & shared counter
-    q_in_counter, q_out_counter = SharedCounter(0), SharedCounter(0)
+    q_in = SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC)
+    q_out = SharedRingBuffer(RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER)
+    # per-stage latencies, shared with the conversion process. The server passes in its own to expose them
+    latency_histograms = getattr(opt, "latency_histograms", None)
+    owns_latency_histograms = latency_histograms is None
+    if owns_latency_histograms:
+        latency_histograms = opt.latency_histograms = LatencyHistograms()
 
     # create directory for recordings
     conversion_root = get_conversion_root()
     os.makedirs(conversion_root, exist_ok=True)
 
-    # create rolling deque for io_stream data packets
-    data = deque(maxlen=NUM_CHUNKS)
-    for _ in range(NUM_CHUNKS):
-        in_data = np.zeros(HDW_FRAMES_PER_BUFFER, dtype=np.float32)
-        data.append(in_data)
+    # rolling window over the latest io_stream data packets
+    window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+    conversion_process, io_stream, recording_writer = None, None, None
+    p = pyaudio.PyAudio()
 
     # run pipeline
     try:
         _LOGGER.info(f"backend={get_device()}")
         _LOGGER.info(f"opt={opt}")
 
-        conversion_process = Process(
-            target=conversion_process_target,
-            args=(
-                stop_process,
-                q_in,
-                q_out,
-                q_in_counter,
-                q_out_counter,
-                model_warmup_complete,
-                opt,
-                HDW_FRAMES_PER_BUFFER,
-            ),
-        )
-        conversion_process.start()
+        if worker is not None:
+            try:
+                worker.wait_until_ready()
+                worker.attach(q_in, q_out, HDW_FRAMES_PER_BUFFER)
+            except RuntimeError as e:
+                _LOGGER.error(f"{e}, converting in a new process instead")
+                worker = None
+
+        if worker is None:
+            conversion_process = Process(
+                target=conversion_process_target,
+                args=(
+                    stop_process,
+                    q_in,
+                    q_out,
+                    model_warmup_complete,
+                    opt,
+                    HDW_FRAMES_PER_BUFFER,
+                ),
+            )
+            conversion_process.start()
 
-        with TimedScope("model_warmup", _LOGGER):
-            while not model_warmup_complete.value:
-                time.sleep(1)
+            with TimedScope("model_warmup", _LOGGER):
+                while not model_warmup_complete.value:
+                    if not conversion_process.is_alive():
+                        raise RuntimeError(f"the conversion process has died, exit code: {conversion_process.exitcode}")
+                    time.sleep(1)
 
         io_stream = p.open(
             format=FORMAT,
@@ -305,17 +616,27 @@ def run_inference_rt(
             output_device_index=opt.output_device_idx,
             stream_callback=get_io_stream_callback(
                 q_in,
-                q_in_counter,
-                data,
+                window,
                 audio_in,
                 q_out,
-                q_out_counter,
                 audio_out,
                 MAX_RECORD_SEGMENTS,
-                latency_queue,
-                frame_dropping,
+                frame_health,
+                latency_histograms,
             ),
         )
+        # packet n is recorded in segment n % MAX_RECORD_SEGMENTS, as PACKET_COUNT & PACKET_ID both start at 0
+        recording_codec = resolve_recording_codec(getattr(opt, "recording_codec", RECORDING_CODEC))
+        recording_writer = RecordingWriter(
+            {
+                get_recording_fname(conversion_root, "original", recording_codec): audio_in,
+                get_recording_fname(conversion_root, "converted", recording_codec): audio_out,
+            },
+            lambda: PACKET_COUNT,
+            sample_rate,
+            codec=recording_codec,
+        )
+        recording_writer.start()
         io_stream.start_stream()
         PACKET_START_S = time.time()
 
@@ -328,27 +649,33 @@ def run_inference_rt(
             time.sleep(0.2)
 
     finally:
-        with stop_process.get_lock():
-            stop_process.value = 1
-        conversion_process.join()
+        if conversion_process is not None:
+            with stop_process.get_lock():
+                stop_process.value = 1
+            conversion_process.join()
+        if worker is not None:
+            worker.detach()
 
         if io_stream:
             io_stream.close()
         p.terminate()
-
-        # empty out the queues prior to deletion
-        while not q_in.empty():
-            try:
-                q_in.get_nowait()
-            except Empty:
-                pass
-        while not q_out.empty():
-            try:
-                q_out.get_nowait()
-            except Empty:
-                pass
-
-        del q_in, q_out, q_in_counter, q_out_counter, stop_process, model_warmup_complete
+        if recording_writer:
+            # the recordings are complete once this returns
+            recording_writer.stop()
+        recording.save(PACKET_COUNT)
+
+        q_in.close()
+        q_in.unlink()
+        q_out.close()
+        q_out.unlink()
+
+        if owns_latency_histograms:
+            _LOGGER.info(f"latency: {latency_histograms.summary()}")
+            latency_histograms.close()
+            latency_histograms.unlink()
+            del opt.latency_histograms
+
+        del q_in, q_out, stop_process, model_warmup_complete
         _LOGGER.info("Done cleaning, exiting.")
 
 
@@ -376,7 +703,84 @@ if __name__ == "__main__":
         default=None,
         help="path to store session audio segments within s3. if provided, data will be uploaded periodically.",
     )
+    parser.add_argument(
+        "--context-length-ms",
+        type=float,
+        default=0,
+        help="online_crossfade: length of the window fed to the model, 0 uses the whole window",
+    )
+    parser.add_argument(
+        "--feature-cache",
+        action="store_true",
+        help="reuse the content features of the overlapping part of consecutive windows",
+    )
+    parser.add_argument(
+        "--feature-cache-margin-ms",
+        type=float,
+        default=FEATURE_CACHE_MARGIN_MS,
+        help="context recomputed on either side of the boundary between cached & new features",
+    )
+    parser.add_argument(
+        "--past-context-ms",
+        type=float,
+        default=PAST_CONTEXT_MS,
+        help="online_with_past_future: past context fed to the model",
+    )
+    parser.add_argument(
+        "--future-context-ms",
+        type=float,
+        default=FUTURE_CONTEXT_MS,
+        help="online_with_past_future: lookahead fed to the model, adds to the latency",
+    )
+    parser.add_argument(
+        "--fade-duration-ms",
+        type=float,
+        default=None,
+        help="cross-fade duration, defaults to 20ms for online_crossfade and 5ms for online_with_past_future",
+    )
+    parser.add_argument(
+        "--recording-retention-s",
+        type=float,
+        default=RECORDING_RETENTION_S,
+        help="length of the latest audio kept in the memory mapped recording buffers",
+    )
+    parser.add_argument("--recording-codec", type=str, choices=list(RECORDING_CODECS), default=RECORDING_CODEC)
     parser.add_argument("--target-speaker", type=int, default=0)
+    parser.add_argument(
+        "--no-optimize-models",
+        dest="optimize_models",
+        action="store_false",
+        help="load the TorchScript models as is, instead of the frozen & optimized variants",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="cpu only: use dynamically quantized int8 models, faster but less accurate",
+    )
+    parser.add_argument("--num-threads", type=int, default=0, help="torch intra-op threads, 0 keeps the default")
+    parser.add_argument(
+        "--num-interop-threads", type=int, default=0, help="torch inter-op threads, 0 keeps the default"
+    )
+    parser.add_argument(
+        "--cpu-affinity",
+        type=str,
+        default="",
+        help="cores to pin the conversion process to, e.g. 2-5, empty for no pinning",
+    )
+    parser.add_argument("--high-priority", action="store_true", help="raise the conversion process' priority")
+    parser.add_argument("--backend", type=str, default="torchscript", choices=list(BACKENDS))
+    parser.add_argument(
+        "--ort-intra-op-threads",
+        type=int,
+        default=0,
+        help="onnxruntime: threads used within an op, 0 picks one per physical core",
+    )
+    parser.add_argument(
+        "--ort-graph-optimization-level",
+        type=str,
+        default="all",
+        choices=list(ORT_GRAPH_OPTIMIZATION_LEVELS),
+    )
     opt = parser.parse_args()
 
     # capture audio io device indices from the user
@@ -0,0 +1,86 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import torch
+
+from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def _cache_name(model_path: str, device: torch.device, variant: str) -> str:
+    # frozen graphs have their weights inlined as constants on `device`, & aren't portable across torch versions
+    return f"{Path(model_path).stem}.{variant}.torch-{torch.__version__}.{device.type}.pt"
+
+
+def optimized_model_paths(model_path: str, device: torch.device, fallback_root: str, variant: str) -> List[str]:
+    """Locations of the cached optimized artifact, next to `model_path` first & under `fallback_root` otherwise"""
+    name = _cache_name(model_path, device, variant)
+    return [os.path.join(os.path.dirname(model_path), name), os.path.join(fallback_root, name)]
+
+
+def optimize(model: torch.jit.ScriptModule) -> torch.jit.ScriptModule:
+    """Freezes the module, inlining weights & attributes as constants, & runs the inference-only graph passes"""
+    return torch.jit.optimize_for_inference(torch.jit.freeze(model.eval()))
+
+
+def quantize(model: torch.jit.ScriptModule) -> torch.jit.ScriptModule:
+    """
+    Dynamic int8 quantization: the weights of linear layers are stored in int8 & activations are quantized on the fly.
+    CPU only, as there are no CUDA kernels for the dynamically quantized ops
+    """
+    qconfig_dict = {"": torch.quantization.default_dynamic_qconfig}
+    return torch.jit.freeze(torch.quantization.quantize_dynamic_jit(model.eval(), qconfig_dict))
+
+
+OPTIMIZATIONS: Dict[str, Callable[[torch.jit.ScriptModule], torch.jit.ScriptModule]] = {
+    "frozen": optimize,
+    "int8": quantize,
+}
+
+
+def load_optimized(
+    model_path: str,
+    device: torch.device,
+    fallback_root: str,
+    variant: str = "frozen",
+) -> torch.jit.ScriptModule:
+    """
+    Loads the `variant` of the TorchScript model at `model_path`, one of OPTIMIZATIONS, optimizing & caching it on first
+    use. Falls back to the unoptimized model if optimization fails.
+    """
+    cache_paths = optimized_model_paths(model_path, device, fallback_root, variant)
+    for cache_path in cache_paths:
+        if os.path.exists(cache_path):
+            try:
+                return torch.jit.load(cache_path, map_location=device)
+            except Exception as e:
+                # e.g. truncated by a crash while it was being written
+                _LOGGER.warn(f"failed to load the cached optimized model {cache_path}, regenerating it: {e}")
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+
+    # weights have to be on `device` before freezing, moving a frozen module doesn't move its constants
+    model = torch.jit.load(model_path, map_location=device)
+    try:
+        with TimedScope(f"{variant} {os.path.basename(model_path)}", _LOGGER):
+            optimized = OPTIMIZATIONS[variant](model)
+    except Exception as e:
+        _LOGGER.warn(f"failed to produce the {variant} variant of {model_path}, using it as is: {e}")
+        return model
+
+    for cache_path in cache_paths:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # written aside & moved into place, so that an interrupted save never leaves a partial artifact behind
+            torch.jit.save(optimized, f"{cache_path}.tmp")
+            os.replace(f"{cache_path}.tmp", cache_path)
+            _LOGGER.info(f"cached optimized model at {cache_path}")
+            break
+        except OSError as e:
+            # the models folder of an installed app may be read-only
+            _LOGGER.info(f"can't cache optimized model at {cache_path}: {e}")
+    return optimized
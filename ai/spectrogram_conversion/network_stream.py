@@ -0,0 +1,141 @@
+"""
+Conversion of PCM streamed over the network rather than captured from a local PortAudio device. Frames are encoded
+with `network_utils.encode_frame`, & the packet id and capture timestamp of a frame are echoed back with its converted
+counterpart.
+"""
+import argparse
+import os
+import time
+import uuid
+from multiprocessing import Process, Value
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ai.spectrogram_conversion.batched_conversion import BatchedConversionServer
+from ai.spectrogram_conversion.inference_rt import RING_BUFFER_CAPACITY, conversion_process_target
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.multiprocessing_utils import SharedRingBuffer
+from ai.spectrogram_conversion.utils.network_utils import STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+class NetworkConversionSession:
+    """
+    Plays the role of the PyAudio callback for a network client. Each incoming frame is appended to the rolling window
+    & queued for conversion, and answered straight away with the next converted frame, silence on underflow or the
+    latest converted frame on overflow, so the client is paced the same way a local audio device is.
+
+    The session is converted by `server` along with the other sessions attached to it if given, otherwise in a process
+    of its own that loads the models first.
+    """
+
+    def __init__(
+        self,
+        opt: argparse.Namespace,
+        HDW_FRAMES_PER_BUFFER: int,
+        server: Optional[BatchedConversionServer] = None,
+    ):
+        self._opt = opt
+        self.HDW_FRAMES_PER_BUFFER = HDW_FRAMES_PER_BUFFER
+        self._server = server
+        self._session_id = uuid.uuid4().hex
+
+        self._stop = Value("i", 0)
+        self._model_warmup_complete = Value("i", 0)
+        # created by `start`, the server creates those of the sessions attached to it
+        self._q_in: Optional[SharedRingBuffer] = None
+        self._q_out: Optional[SharedRingBuffer] = None
+        self._window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+        self._out_buffer = np.zeros(HDW_FRAMES_PER_BUFFER, dtype=np.float32)
+        self._silence = np.zeros(HDW_FRAMES_PER_BUFFER, dtype=np.float32)
+
+        # the conversion process detects dropped packets from gaps in the packet ids, so packets are numbered by the
+        # session & mapped back to the client's packet ids on the way out
+        self._packet_count = 0
+        self._client_packet_ids = np.zeros(4 * RING_BUFFER_CAPACITY, dtype=np.int64)
+
+        self._process: Optional[Process] = None
+
+    def start(self):
+        """Starts loading the models, poll `is_ready` before sending frames"""
+        if self._server is not None:
+            self._q_in, self._q_out = self._server.attach(
+                self._session_id,
+                self.HDW_FRAMES_PER_BUFFER,
+                self._opt.target_speaker,
+                self._opt.noise_suppression_threshold,
+            )
+            return
+
+        self._q_in = SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC)
+        self._q_out = SharedRingBuffer(RING_BUFFER_CAPACITY, self.HDW_FRAMES_PER_BUFFER)
+        self._process = Process(
+            target=conversion_process_target,
+            args=(
+                self._stop,
+                self._q_in,
+                self._q_out,
+                self._model_warmup_complete,
+                self._opt,
+                self.HDW_FRAMES_PER_BUFFER,
+            ),
+        )
+        self._process.start()
+
+    @property
+    def is_ready(self) -> bool:
+        if self._server is not None:
+            return self._server.is_ready
+        return bool(self._model_warmup_complete.value)
+
+    @property
+    def is_alive(self) -> bool:
+        if self._server is not None:
+            return self._server.is_alive
+        return self._process is not None and self._process.is_alive()
+
+    def process_frame(self, packet_id: int, timestamp_s: float, wav: np.ndarray) -> Tuple[int, float, int, np.ndarray]:
+        """Queues `wav` for conversion, returns the packet id, timestamp, status & samples of the frame to send back"""
+        if len(wav) != self.HDW_FRAMES_PER_BUFFER:
+            raise ValueError(f"expected frames of {self.HDW_FRAMES_PER_BUFFER} samples, got {len(wav)}")
+
+        self._client_packet_ids[self._packet_count % len(self._client_packet_ids)] = packet_id
+        self._window.append(wav)
+        if not self._q_in.put(self._packet_count, timestamp_s, self._window.view()):
+            _LOGGER.info("q_in: overflow")
+        self._packet_count += 1
+
+        q_out_len = len(self._q_out)
+        if q_out_len == 0:
+            _LOGGER.debug("q_out: underflow")
+            return -1, time.time(), STATUS_UNDERFLOW, self._silence
+
+        status = STATUS_OK
+        if q_out_len > 1:
+            _LOGGER.info("q_out: overflow")
+            status = STATUS_OVERFLOW
+
+        p_id, p_start_s, out = self._q_out.get(out=self._out_buffer, latest=q_out_len > 1)
+        return int(self._client_packet_ids[p_id % len(self._client_packet_ids)]), p_start_s, status, out
+
+    def stop(self):
+        if self._server is not None:
+            # also frees the session's ring buffers
+            self._server.detach(self._session_id)
+            return
+
+        with self._stop.get_lock():
+            self._stop.value = 1
+        if self._process:
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+
+        for q in (self._q_in, self._q_out):
+            if q is not None:
+                q.close()
+                q.unlink()
@@ -0,0 +1,189 @@
+"""
+Converts a recorded WAV/FLAC file without going through PyAudio in real time.
+
+python -m ai.spectrogram_conversion.offline_conversion --input in.wav --output out.wav --target-speaker zeus
+"""
+import argparse
+import math
+import os
+import time
+from typing import Iterator
+
+import numpy as np
+import soundfile as sf
+
+from ai.common.torch_utils import set_seed
+from ai.spectrogram_conversion.backends import BACKENDS, ORT_GRAPH_OPTIMIZATION_LEVELS
+from ai.spectrogram_conversion.cross_fade import LinearCrossFade
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.params import CROSS_FADE_DURATION_MS, MAX_INFER_SAMPLES_VC, SEED, sample_rate
+from ai.spectrogram_conversion.resampler import StreamingResampler
+from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+from ai.spectrogram_conversion.voice_conversion import ModelConversionPipeline
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def read_hops(path: str, HDW_FRAMES_PER_BUFFER: int, block_s: float = 10) -> Iterator[np.ndarray]:
+    """
+    Streams a mono `sample_rate` version of the audio file at `path` in chunks of HDW_FRAMES_PER_BUFFER samples. The
+    last chunk may be shorter.
+    """
+    with sf.SoundFile(path) as f:
+        resampler = None
+        if f.samplerate != sample_rate:
+            block_len = math.ceil(block_s * f.samplerate)
+            resampler = StreamingResampler(f.samplerate, sample_rate, math.ceil(block_len * sample_rate / f.samplerate))
+
+        pending = np.zeros(0, dtype=np.float32)
+        for block in f.blocks(blocksize=math.ceil(block_s * f.samplerate), dtype="float32", always_2d=True):
+            block = block.mean(axis=1)
+            if resampler is not None:
+                block = resampler.window(resampler.push(block)).copy()
+
+            pending = np.concatenate((pending, block))
+            n_hops = len(pending) // HDW_FRAMES_PER_BUFFER
+            for i in range(n_hops):
+                yield pending[i * HDW_FRAMES_PER_BUFFER : (i + 1) * HDW_FRAMES_PER_BUFFER]
+            pending = pending[n_hops * HDW_FRAMES_PER_BUFFER :]
+
+        if resampler is not None:
+            # the samples held back by the resampling filter
+            pending = np.concatenate((pending, resampler.flush()))
+
+        for i in range(0, len(pending), HDW_FRAMES_PER_BUFFER):
+            yield pending[i : i + HDW_FRAMES_PER_BUFFER]
+
+
+class OfflineConversionPipeline(ModelConversionPipeline):
+    """
+    Converts audio from disk in overlapping windows, the same way as the online cross-fade pipeline, but batches many
+    windows into a single forward pass since nothing has to wait for the audio to arrive.
+    """
+
+    def __init__(self, opt: argparse.Namespace):
+        super().__init__(opt)
+
+        self._cross_fade = LinearCrossFade(int(CROSS_FADE_DURATION_MS / 1000 * sample_rate))
+
+        self._p_window_len = self.p_resampler.output_length(MAX_INFER_SAMPLES_VC)
+        self._stream_resampler = StreamingResampler(sample_rate, self.p_sampling_rate, self._p_window_len)
+
+    def run(self, wavs: np.ndarray, HDW_FRAMES_PER_BUFFER: int, wav_srcs: np.ndarray) -> np.ndarray:
+        if self._opt.mode != InferencePipelineMode.offline_with_overlap:
+            raise Exception(f"Mode: {self._opt.mode} unsupported")
+
+        outs = self.infer_batch(wavs, wav_srcs=wav_srcs)
+        return np.concatenate(
+            [self._cross_fade(self.suppress_noise(out, wav), HDW_FRAMES_PER_BUFFER) for wav, out in zip(wavs, outs)]
+        )
+
+    def convert_file(self, input_path: str, output_path: str, HDW_FRAMES_PER_BUFFER: int, batch_size: int):
+        self._cross_fade.reset()
+        self._stream_resampler.reset()
+
+        window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+        wavs = np.zeros((batch_size, MAX_INFER_SAMPLES_VC), dtype=np.float32)
+        wav_srcs = np.zeros((batch_size, self._p_window_len), dtype=np.float32)
+
+        # the output trails the input by the cross-fade and by half of the 16kHz resampling filter
+        delay = self._cross_fade.fade_samples + self._stream_resampler.half_len // self._stream_resampler.up + 1
+        n_flush_hops = math.ceil(delay / HDW_FRAMES_PER_BUFFER)
+
+        n_in, n_out = 0, 0
+        with sf.SoundFile(output_path, "w", samplerate=sample_rate, channels=1) as f_out:
+
+            def write(out: np.ndarray):
+                nonlocal n_out
+                start = max(delay - n_out, 0)
+                end = min(len(out), n_in + delay - n_out)
+                if end > start:
+                    f_out.write(out[start:end])
+                n_out += len(out)
+
+            def hops() -> Iterator[np.ndarray]:
+                nonlocal n_in
+                for hop in read_hops(input_path, HDW_FRAMES_PER_BUFFER):
+                    n_in += len(hop)
+                    yield np.pad(hop, (0, HDW_FRAMES_PER_BUFFER - len(hop)))
+                for _ in range(n_flush_hops):
+                    yield np.zeros(HDW_FRAMES_PER_BUFFER, dtype=np.float32)
+
+            n_batch = 0
+            for hop in hops():
+                window.append(hop)
+                self._stream_resampler.push(hop)
+                wavs[n_batch] = window.view()
+                wav_srcs[n_batch] = self._stream_resampler.window(self._p_window_len)
+                n_batch += 1
+
+                if n_batch == batch_size:
+                    write(self.run(wavs, HDW_FRAMES_PER_BUFFER, wav_srcs))
+                    n_batch = 0
+
+            if n_batch:
+                write(self.run(wavs[:n_batch], HDW_FRAMES_PER_BUFFER, wav_srcs[:n_batch]))
+
+        return n_in
+
+
+def convert_file(opt: argparse.Namespace) -> None:
+    set_seed(SEED)
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * opt.hop_ms / 1000)
+
+    voice_conversion = OfflineConversionPipeline(opt)
+    start_s = time.time()
+    with TimedScope("convert_file", _LOGGER):
+        n_samples = voice_conversion.convert_file(opt.input, opt.output, HDW_FRAMES_PER_BUFFER, opt.batch_size)
+
+    duration_s = n_samples / sample_rate
+    _LOGGER.info(f"converted {duration_s:0.2f}s of audio at {duration_s / (time.time() - start_s):0.2f}x real time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, required=True, help="WAV/FLAC file to convert")
+    parser.add_argument("--output", type=str, required=True, help="path to write the converted audio to")
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument(
+        "--noise-suppression-threshold",
+        type=float,
+        default=5,
+        help="Threshold magnitude value for suppressing noise",
+    )
+    parser.add_argument(
+        "--hop-ms",
+        type=float,
+        default=400,
+        help="Distance between consecutive windows, i.e. the callback latency of the online pipeline",
+    )
+    parser.add_argument("--batch-size", type=int, default=16, help="Number of windows per forward pass")
+    parser.add_argument(
+        "--no-optimize-models",
+        dest="optimize_models",
+        action="store_false",
+        help="load the TorchScript models as is, instead of the frozen & optimized variants",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="cpu only: use dynamically quantized int8 models, faster but less accurate",
+    )
+    parser.add_argument("--backend", type=str, default="torchscript", choices=list(BACKENDS))
+    parser.add_argument(
+        "--ort-intra-op-threads",
+        type=int,
+        default=0,
+        help="onnxruntime: threads used within an op, 0 picks one per physical core",
+    )
+    parser.add_argument(
+        "--ort-graph-optimization-level",
+        type=str,
+        default="all",
+        choices=list(ORT_GRAPH_OPTIMIZATION_LEVELS),
+    )
+    opt = parser.parse_args()
+    opt.mode = InferencePipelineMode.offline_with_overlap
+
+    convert_file(opt)
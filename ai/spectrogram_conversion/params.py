@@ -17,4 +17,19 @@ MAX_INFER_SAMPLES_VC = num_samples * hop_length
 ## Vocoder
 VOCODER_FUTURE_CONTEXT_SPEC_FRAMES = 16 * 2
 
+## Online pipeline
+CROSS_FADE_DURATION_MS = 20
+# online_with_past_future: the model sees `past + new + future` context, only the new samples are emitted. The future
+# context is bounded by the vocoder's future context
+PAST_CONTEXT_MS = 1000
+FUTURE_CONTEXT_MS = 50
+MAX_FUTURE_CONTEXT_SAMPLES = VOCODER_FUTURE_CONTEXT_SPEC_FRAMES * hop_length
+PAST_FUTURE_CROSS_FADE_DURATION_MS = 5
+# context recomputed on either side of the boundary between cached & new content features
+FEATURE_CACHE_MARGIN_MS = 200
+# length of the latest audio kept in the session's recording buffers
+RECORDING_RETENTION_S = 5 * 60
+# codec the session's recordings are written to disk & uploaded in, one of recording.RECORDING_CODECS
+RECORDING_CODEC = "flac"
+
 SEED = 1234  # numpy & torch PRNG seed
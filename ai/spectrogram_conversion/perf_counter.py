@@ -1,75 +1,131 @@
 import logging
 import time
-from collections import deque
 from functools import partial
 from logging import Logger
+from time import perf_counter_ns
+from typing import Dict, Optional
 
 import numpy as np
 
+from ai.spectrogram_conversion.utils.latency_histogram import (N_BUCKETS, SUB_BUCKET_BITS, SUB_BUCKET_HALF_BITS,
+                                                               LatencyHistograms, bucket_index, summarize)
+
+# counters named after one of the stages of these record into them, see `use_histograms`
+_HISTOGRAMS: Optional[LatencyHistograms] = None
+# the other counters record into process memory
+_LOCAL_HISTOGRAMS: Dict[str, LatencyHistograms] = {}
+
+
+def use_histograms(histograms: Optional[LatencyHistograms]):
+    """
+    Counters created from now on in this process record into `histograms` if it has a stage of their name, e.g. the
+    shared memory histograms read by the server. Affects neither existing counters nor other processes.
+    """
+    global _HISTOGRAMS
+    _HISTOGRAMS = histograms
+
+
+def _get_counts(name: str) -> memoryview:
+    if _HISTOGRAMS is not None and name in _HISTOGRAMS.index:
+        return _HISTOGRAMS.counts(name)
+    if name not in _LOCAL_HISTOGRAMS:
+        _LOCAL_HISTOGRAMS[name] = LatencyHistograms((name,), shared=False)
+    return _LOCAL_HISTOGRAMS[name].counts(name)
+
 
 class PerfCounter:
-    counter_index = {}
-    q_ms_index = {}
+    """
+    Times its scope with `time.perf_counter_ns` into the preallocated histogram of `name`. If `logger` is enabled for
+    `log_level`, the mean, p95 & max over every `window_len` scopes are logged as well.
+
+    Creating a counter costs more than timing a scope, so counters on the audio path should be created once & reused.
+    A counter is neither reentrant nor thread-safe.
+    """
+
+    __slots__ = (
+        "_name",
+        "_counts",
+        "_logger",
+        "_log_level",
+        "_window_len",
+        "_window_count",
+        "_window_start",
+        "_start_ns",
+    )
 
     def __init__(
         self,
         name: str,
-        logger: Logger,
+        logger: Optional[Logger] = None,
         log_level: int = logging.INFO,
         window_len=10,
     ) -> None:
-        if name not in PerfCounter.counter_index:
-            PerfCounter.counter_index[name] = 0
-        if name not in PerfCounter.q_ms_index:
-            PerfCounter.q_ms_index[name] = deque(maxlen=window_len)
-
         self._name = name
-        self._logger = logger
+        self._counts = _get_counts(name)
+        # checked once, rather than on every scope
+        self._logger = logger if logger is not None and logger.isEnabledFor(log_level) else None
         self._log_level = log_level
         self._window_len = window_len
-        self._start_sec = None
+        self._window_count = 0
+        self._window_start = np.array(self._counts) if self._logger else None
+        self._start_ns = 0
 
     def __enter__(self):
-        self._start_sec = time.time()
+        self._start_ns = perf_counter_ns()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         del exc_type, exc_val, exc_tb  # unused
 
-        duration_ms = (time.time() - self._start_sec) * 1000
-        PerfCounter.q_ms_index[self._name].append(duration_ms)
+        # bucket_index, inlined as it's on the audio path
+        value_us = (perf_counter_ns() - self._start_ns) // 1000
+        shift = value_us.bit_length() - SUB_BUCKET_BITS
+        if shift > 0:
+            value_us = min((shift << SUB_BUCKET_HALF_BITS) + (value_us >> shift), N_BUCKETS - 1)
+        self._counts[value_us] += 1
+
+        if self._logger is not None:
+            self._log_window()
+
+    def record_ns(self, duration_ns: int):
+        """Records a duration measured elsewhere, e.g. the time a packet spent queued"""
+        self._counts[bucket_index(duration_ns // 1000 if duration_ns > 0 else 0)] += 1
 
-        counter = PerfCounter.counter_index[self._name]
-        counter = (counter + 1) % self._window_len
+        if self._logger is not None:
+            self._log_window()
 
-        if counter >= self._window_len - 1:
-            q = PerfCounter.q_ms_index[self._name]
-            mean = np.mean(q)
-            pct_95 = np.percentile(q, 95)
-            max = np.max(q)
+    def _log_window(self):
+        self._window_count += 1
+        if self._window_count < self._window_len:
+            return
 
-            spacing = " " * (20 - len(self._name))
-            self._logger.log(
-                self._log_level,
-                f"{self._name}: {spacing}mean: {mean:0.2f}ms \tpct_95: {pct_95:0.2f}ms \tmax: {max:0.2f}ms",
-            )
+        counts = np.array(self._counts)
+        stats = summarize(counts - self._window_start, percentiles=(95,))
+        self._window_start = counts
+        self._window_count = 0
 
-        PerfCounter.counter_index[self._name] = counter
+        spacing = " " * (20 - len(self._name))
+        self._logger.log(
+            self._log_level,
+            f"{self._name}: {spacing}mean: {stats['mean_ms']:0.2f}ms \tpct_95: {stats['p95_ms']:0.2f}ms \t"
+            f"max: {stats['max_ms']:0.2f}ms",
+        )
 
 
 DebugPerfCounter = partial(PerfCounter, log_level=logging.DEBUG)
 
 
 if __name__ == "__main__":
-    from timedscope import get_logger
+    from ai.spectrogram_conversion.timedscope import get_logger
 
     LOGGER = get_logger(__name__)
 
+    foo, bar = PerfCounter("foo", LOGGER), PerfCounter("bar", LOGGER)
     for i in range(20):
-        with PerfCounter("foo", LOGGER):
+        with foo:
             a = 1 + 1
             time.sleep(0.1)
 
-        with PerfCounter("bar", LOGGER):
+        with bar:
             a = 1 + 1
             time.sleep(0.05)
@@ -0,0 +1,343 @@
+import json
+import math
+import os
+import struct
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from ai.spectrogram_conversion.params import RECORDING_CODEC
+from ai.spectrogram_conversion.resampler import StreamingResampler
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.utils import get_conversion_root, get_ordered_data_from_circular_buffer
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+# recordings of a session, i.e. the captured & the converted audio
+RECORDINGS = ("original", "converted")
+RECORDING_META_FNAME = "recording.json"
+# frames read at a time when trimming a recording file
+TRIM_BLOCKSIZE = 1 << 16
+
+
+@dataclass(frozen=True)
+class RecordingCodec:
+    format: str
+    subtype: str
+    extension: str
+    # sample rates the codec supports, None for any. Other rates are resampled to the first one above them
+    samplerates: Optional[Tuple[int, ...]] = None
+
+    def get_samplerate(self, samplerate: int) -> int:
+        if self.samplerates is None or samplerate in self.samplerates:
+            return samplerate
+        return next((sr for sr in self.samplerates if sr > samplerate), self.samplerates[-1])
+
+
+# codecs the recordings of a session can be written in, see `RecordingWriter`
+RECORDING_CODECS = {
+    # uncompressed, ~5MB per minute at 22050Hz
+    "wav": RecordingCodec("WAV", "FLOAT", "wav"),
+    # lossless at 16 bits, roughly half the size of 16 bit PCM for speech
+    "flac": RecordingCodec("FLAC", "PCM_16", "flac"),
+    # lossy, a fraction of the size of FLAC
+    "opus": RecordingCodec("OGG", "OPUS", "opus", samplerates=(8000, 12000, 16000, 24000, 48000)),
+}
+
+
+def resolve_recording_codec(codec: str) -> str:
+    """
+    Validates `codec`, raising ValueError if it isn't one of RECORDING_CODECS. Falls back to the default codec if the
+    installed libsndfile can't encode it, e.g. OPUS requires libsndfile 1.0.29+
+    """
+    if codec not in RECORDING_CODECS:
+        raise ValueError(f"unknown recording codec {codec}, expected one of {', '.join(RECORDING_CODECS)}")
+    if RECORDING_CODECS[codec].subtype not in sf.available_subtypes(RECORDING_CODECS[codec].format):
+        _LOGGER.warn(f"libsndfile {sf.__libsndfile_version__} can't encode {codec}, recording in {RECORDING_CODEC}")
+        return RECORDING_CODEC
+    return codec
+
+
+def get_recording_fname(root: str, name: str, codec: str = RECORDING_CODEC) -> str:
+    return os.path.join(root, f"{name}.{RECORDING_CODECS[codec].extension}")
+
+
+def find_recording(root: str, name: str) -> Optional[str]:
+    """The file of recording `name` under `root`, whichever codec it was written in. None if there's none"""
+    for codec in RECORDING_CODECS:
+        fname = get_recording_fname(root, name, codec)
+        if os.path.exists(fname):
+            return fname
+    return None
+
+
+def get_recording_buffers_root() -> str:
+    return os.path.join(get_conversion_root(), "buffers")
+
+
+class RecordingBuffers:
+    """
+    Circular buffers of (n_segments, segment_len) float32 segments, one per recording, backed by files under `root` so
+    that they don't take up RAM & can be read by the server as they are, see `read_recording`.
+
+    The files are named after the session, as the server may still have the previous session's mapped: truncating a
+    file under a live mapping crashes the reader with SIGBUS. The previous files are removed once the metadata points
+    to the new ones, or by a later session if they're still open on Windows, which can't remove mapped files.
+    """
+
+    def __init__(
+        self, root: str, n_segments: int, segment_len: int, samplerate: int, names: Sequence[str] = RECORDINGS
+    ):
+        os.makedirs(root, exist_ok=True)
+        self._root = root
+        session_id = uuid.uuid4().hex
+        self._meta = {
+            "session_id": session_id,
+            "n_segments": n_segments,
+            "segment_len": segment_len,
+            "samplerate": samplerate,
+            "packet_count": 0,
+        }
+
+        self.buffers: Dict[str, np.memmap] = {
+            name: np.memmap(
+                _get_buffer_fname(root, name, session_id),
+                dtype=np.float32,
+                mode="w+",
+                shape=(n_segments, segment_len),
+            )
+            for name in names
+        }
+        self.save(0)
+
+        for fname in os.listdir(root):
+            if fname.endswith(".f32") and not fname.endswith(f".{session_id}.f32"):
+                try:
+                    os.remove(os.path.join(root, fname))
+                except OSError:
+                    pass
+
+    def save(self, packet_count: int):
+        """Flushes the buffers, along with the number of packets they've received which is needed to order them"""
+        for buffer in self.buffers.values():
+            buffer.flush()
+
+        self._meta["packet_count"] = packet_count
+        fname = os.path.join(self._root, RECORDING_META_FNAME)
+        with open(f"{fname}.tmp", "w") as f:
+            json.dump(self._meta, f)
+        os.replace(f"{fname}.tmp", fname)
+
+
+def _get_buffer_fname(root: str, name: str, session_id: str) -> str:
+    return os.path.join(root, f"{name}.{session_id}.f32")
+
+
+def read_recording(
+    name: str, duration_s: Optional[float] = None, root: Optional[str] = None
+) -> Tuple[List[np.ndarray], int]:
+    """
+    The latest `duration_s` of recording `name` of the `RecordingBuffers` at `root`, all of it if not given, along
+    with its sample rate. The samples are returned in order, as up to two views into the memory map, so that nothing
+    is copied. Raises FileNotFoundError if there's no such recording.
+    """
+    root = root or get_recording_buffers_root()
+    with open(os.path.join(root, RECORDING_META_FNAME)) as f:
+        meta = json.load(f)
+    n_segments, segment_len, samplerate = meta["n_segments"], meta["segment_len"], meta["samplerate"]
+    packet_count = meta["packet_count"]
+    if "session_id" not in meta:
+        # written by a version that didn't name the buffers after the session
+        raise FileNotFoundError(f"no recording buffers under {root}")
+    buffer = np.memmap(
+        _get_buffer_fname(root, name, meta["session_id"]), dtype=np.float32, mode="r", shape=(n_segments, segment_len)
+    )
+
+    n = min(packet_count, n_segments)
+    n_samples = n * segment_len
+    if duration_s is not None:
+        n_samples = min(n_samples, int(duration_s * samplerate))
+        n = min(n, math.ceil(n_samples / segment_len))
+
+    # the oldest segment of the range, which wraps around the end of the buffer at most once
+    head = (packet_count - n) % n_segments
+    split = min(n, n_segments - head)
+    parts = [get_ordered_data_from_circular_buffer(buffer, False, head, segment_len=split)]
+    if n > split:
+        parts.append(get_ordered_data_from_circular_buffer(buffer, False, 0, segment_len=n - split))
+
+    # drop the samples of the oldest segment that are outside of `duration_s`
+    parts[0] = parts[0][n * segment_len - n_samples :]
+    return parts, samplerate
+
+
+def trim_recording(fname: str, duration_s: float, name: Optional[str] = None, root: Optional[str] = None) -> bool:
+    """
+    Rewrites the recording at `fname` as its latest `duration_s`, reading only that: from the recording buffers of
+    recording `name` if they still hold it, otherwise by seeking to it in `fname`. The cost depends on `duration_s`
+    rather than on the length of the session. Returns False, leaving `fname` as is, if it's shorter than `duration_s`.
+    """
+    tmp_fname = f"{fname}.tmp"
+    info = sf.info(fname)
+
+    def open_tmp(samplerate: int, channels: int = 1) -> sf.SoundFile:
+        # same codec as `fname`
+        return sf.SoundFile(
+            tmp_fname, mode="w", samplerate=samplerate, channels=channels, subtype=info.subtype, format=info.format
+        )
+
+    if name is not None:
+        try:
+            parts, samplerate = read_recording(name, duration_s=duration_s, root=root)
+        except FileNotFoundError:
+            parts, samplerate = [], 0
+        # the buffers can't be used for recordings that were resampled for their codec
+        if samplerate == info.samplerate and sum(len(part) for part in parts) >= int(duration_s * samplerate):
+            with open_tmp(samplerate) as f:
+                for part in parts:
+                    f.write(part)
+            os.replace(tmp_fname, fname)
+            return True
+
+    with sf.SoundFile(fname) as src:
+        n_frames = int(duration_s * src.samplerate)
+        if src.frames < n_frames:
+            return False
+
+        src.seek(src.frames - n_frames)
+        with open_tmp(src.samplerate, src.channels) as dst:
+            # in blocks, to keep memory bounded for long durations
+            for block in src.blocks(blocksize=TRIM_BLOCKSIZE, frames=n_frames, dtype="float32"):
+                dst.write(block)
+    os.replace(tmp_fname, fname)
+    return True
+
+
+def wav_header(n_samples: int, samplerate: int) -> bytes:
+    """Header of a mono, 32-bit float WAV file of `n_samples`, to be followed by the raw samples"""
+    data_nbytes = 4 * n_samples
+    # WAVE_FORMAT_IEEE_FLOAT, which requires a fact chunk
+    fmt = struct.pack("<HHIIHH", 3, 1, samplerate, 4 * samplerate, 4, 32)
+    return b"".join(
+        [
+            b"RIFF",
+            struct.pack("<I", 4 + (8 + len(fmt)) + (8 + 4) + (8 + data_nbytes)),
+            b"WAVE",
+            b"fmt ",
+            struct.pack("<I", len(fmt)),
+            fmt,
+            b"fact",
+            struct.pack("<II", 4, n_samples),
+            b"data",
+            struct.pack("<I", data_nbytes),
+        ]
+    )
+
+
+class RecordingWriter:
+    """
+    Appends the audio of a session to files on a background thread, so that nothing is written to disk on the audio
+    thread. The audio callback fills the circular buffers in `buffers`, by file name, one (segment_len,) segment per
+    packet: packet `n` goes to segment `n % len(buffer)`. `get_packet_count` returns the number of packets the callback
+    has completed so far.
+
+    The files are encoded as they're written with `codec`, one of `RECORDING_CODECS`, resampling the audio first if
+    the codec doesn't support `samplerate`. Any recording of the same name in another codec is removed.
+
+    Memory stays bounded by the buffers themselves, segments that aren't written before the callback wraps around to
+    them again are dropped.
+    """
+
+    def __init__(
+        self,
+        buffers: Dict[str, np.ndarray],
+        get_packet_count: Callable[[], int],
+        samplerate: int,
+        codec: str = RECORDING_CODEC,
+        poll_s: float = 0.5,
+    ):
+        self._buffers = buffers
+        self._get_packet_count = get_packet_count
+        self._poll_s = poll_s
+        # segments written at a time, about what the callback completes between two polls, which bounds the memory of
+        # the resamplers regardless of the length of the buffers
+        segment_len = next(iter(buffers.values())).shape[1]
+        self._write_segments = max(math.ceil(2 * poll_s * samplerate / segment_len), 1)
+
+        codec = RECORDING_CODECS[codec]
+        file_samplerate = codec.get_samplerate(samplerate)
+        self._files = {}
+        self._resamplers: Dict[str, StreamingResampler] = {}
+        for fname in buffers:
+            stem, extension = os.path.splitext(fname)
+            for other in RECORDING_CODECS.values():
+                if f".{other.extension}" != extension and os.path.exists(f"{stem}.{other.extension}"):
+                    os.remove(f"{stem}.{other.extension}")
+
+            self._files[fname] = sf.SoundFile(
+                fname,
+                mode="w",
+                samplerate=file_samplerate,
+                channels=1,
+                format=codec.format,
+                subtype=codec.subtype,
+            )
+            if file_samplerate != samplerate:
+                # large enough for the samples of a write, & for the tail flushed at close which is much shorter
+                self._resamplers[fname] = StreamingResampler(
+                    samplerate,
+                    file_samplerate,
+                    math.ceil(self._write_segments * segment_len * file_samplerate / samplerate) + 1,
+                )
+        self._written = get_packet_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self._poll_s):
+                self._write_completed()
+            self._write_completed()
+        finally:
+            for fname, f in self._files.items():
+                resampler = self._resamplers.get(fname)
+                if resampler is not None:
+                    # the resampler holds back the last few ms of the recording
+                    f.write(resampler.flush())
+                # writes the final header, the files are complete once closed
+                f.close()
+
+    def _write_completed(self):
+        count = self._get_packet_count()
+        n_segments = len(next(iter(self._buffers.values())))
+
+        # the callback may be writing the segment of packet `count`, i.e. the one of packet `count - n_segments`
+        if count - self._written >= n_segments:
+            _LOGGER.warn(f"recording fell behind, dropping {count - self._written - n_segments + 1} packets")
+            self._written = count - n_segments + 1
+
+        while self._written < count:
+            n = min(count - self._written, self._write_segments)
+            for fname, buffer in self._buffers.items():
+                wav = get_ordered_data_from_circular_buffer(buffer, False, self._written % n_segments, segment_len=n)
+                resampler = self._resamplers.get(fname)
+                if resampler is not None:
+                    wav = resampler.window(resampler.push(wav))
+                self._files[fname].write(wav)
+            self._written += n
+
+    def stop(self):
+        """Writes out the remaining segments & finalizes the files, the callback must have stopped by then"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            # never started
+            self._run()
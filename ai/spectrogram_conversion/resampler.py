@@ -0,0 +1,158 @@
+import math
+from typing import Union
+
+import numpy as np
+import torch
+from scipy.signal import firwin, upfirdn
+
+Buffer = Union[np.ndarray, torch.Tensor]
+
+# defaults mirror resampy's `kaiser_best` filter, which is what `librosa.load(..., sr=...)` used under the hood
+KAISER_BEST_NUM_ZEROS = 64
+KAISER_BEST_ROLLOFF = 0.9475937167399596
+KAISER_BEST_BETA = 14.769656459379492
+
+
+class PolyphaseResampler:
+    """
+    In-memory resampler between two fixed sampling rates. The low-pass FIR filter is designed once at construction
+    and applied with a polyphase up-sample -> filter -> down-sample, so no per-call filter design or disk I/O happens.
+    """
+
+    def __init__(
+        self,
+        orig_sr: int,
+        target_sr: int,
+        num_zeros: int = KAISER_BEST_NUM_ZEROS,
+        rolloff: float = KAISER_BEST_ROLLOFF,
+        beta: float = KAISER_BEST_BETA,
+    ):
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+
+        gcd = math.gcd(orig_sr, target_sr)
+        self.up = target_sr // gcd
+        self.down = orig_sr // gcd
+
+        max_rate = max(self.up, self.down)
+        self.half_len = num_zeros * max_rate
+        self.filter = (firwin(2 * self.half_len + 1, rolloff / max_rate, window=("kaiser", beta)) * self.up).astype(
+            np.float32
+        )
+
+        # zero-pad the filter so that output samples sit at the center of the filter. The post padding only has to be
+        # long enough for `upfirdn` to always produce `n_out` samples after the delay is removed.
+        n_pre_pad = self.down - self.half_len % self.down
+        self._n_pre_remove = (self.half_len + n_pre_pad) // self.down
+        self._padded_filter = np.concatenate(
+            (
+                np.zeros(n_pre_pad, dtype=np.float32),
+                self.filter,
+                np.zeros(self.up + self.down, dtype=np.float32),
+            )
+        )
+
+    def output_length(self, n_in: int) -> int:
+        return math.ceil(n_in * self.up / self.down)
+
+    def __call__(self, wav: Buffer) -> Buffer:
+        if isinstance(wav, torch.Tensor):
+            out = self._resample(wav.detach().cpu().numpy())
+            return torch.from_numpy(out).to(wav.device)
+
+        return self._resample(wav)
+
+    def _resample(self, wav: np.ndarray) -> np.ndarray:
+        wav = np.ascontiguousarray(wav, dtype=np.float32)
+        n_out = self.output_length(wav.shape[-1])
+
+        out = upfirdn(self._padded_filter, wav, self.up, self.down, axis=-1)
+        out = out[..., self._n_pre_remove : self._n_pre_remove + n_out]
+        return out.astype(np.float32, copy=False)
+
+
+class StreamingResampler:
+    """
+    Stateful counterpart of PolyphaseResampler for a continuous stream. Only newly arrived samples are filtered on each
+    `push`, with the filter history carried over between calls, and the resampled stream is kept in a rolling buffer
+    from which fixed size windows can be sliced.
+
+    Output samples are produced once the whole filter support has arrived, so the rolling buffer trails the input by
+    `half_len / up` input samples (~4ms for 22050Hz -> 16kHz with the default filter).
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int, buffer_len: int, **filter_kwargs):
+        self._resampler = PolyphaseResampler(orig_sr, target_sr, **filter_kwargs)
+        self.up = self._resampler.up
+        self.down = self._resampler.down
+        self.half_len = self._resampler.half_len
+
+        self._buffer = np.zeros(buffer_len, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        # samples prior to the start of the stream are treated as silence
+        self._history_start = self._history_start_for(0)
+        self._history = np.zeros(-self._history_start, dtype=np.float32)
+        self._n_in = 0
+        self._n_out = 0
+        self._buffer[:] = 0
+
+    def _history_start_for(self, m: int) -> int:
+        # first input sample within the filter support of output `m`, rounded down to a multiple of `down` so that
+        # the output grid of `upfirdn` over the history lines up with the output grid of the whole stream
+        first_input = -((self.half_len - m * self.down) // self.up)
+        return (first_input // self.down) * self.down
+
+    @property
+    def total_out(self) -> int:
+        """Number of output samples produced since the last reset"""
+        return self._n_out
+
+    def push(self, wav: np.ndarray) -> int:
+        """Resamples the newly arrived `wav` samples into the rolling buffer and returns the number of new samples"""
+        history = np.concatenate((self._history, np.asarray(wav, dtype=np.float32)))
+        self._n_in += len(wav)
+
+        # only emit outputs whose filter support is fully covered by the samples received so far
+        m_end = max((self._n_in * self.up - 1 - self.half_len) // self.down + 1, self._n_out)
+
+        offset = self._resampler._n_pre_remove - self._history_start * self.up // self.down
+        out = upfirdn(self._resampler._padded_filter, history, self.up, self.down)
+        out = out[self._n_out + offset : m_end + offset].astype(np.float32, copy=False)
+
+        next_start = self._history_start_for(m_end)
+        self._history = history[next_start - self._history_start :]
+        self._history_start = next_start
+        self._n_out = m_end
+
+        n_new = len(out)
+        if n_new >= len(self._buffer):
+            self._buffer[:] = out[-len(self._buffer) :]
+        elif n_new:
+            self._buffer[:-n_new] = self._buffer[n_new:]
+            self._buffer[-n_new:] = out
+        return n_new
+
+    def window(self, n: int) -> np.ndarray:
+        """Returns a view of the latest `n` resampled samples. Only valid until the next call to `push`"""
+        return self._buffer[len(self._buffer) - n :]
+
+    def flush(self) -> np.ndarray:
+        """
+        Ends the stream, resampling the input samples `push` held back as if the stream was followed by silence, so that
+        the whole stream is resampled into `output_length` samples like PolyphaseResampler does. Returns a view of the
+        samples that weren't produced yet, only valid until the next call to `push`. `reset` before reusing it.
+        """
+        n_out = self._resampler.output_length(self._n_in)
+        n_missing = n_out - self._n_out
+        if n_missing <= 0:
+            return self._buffer[:0]
+
+        # input samples up to the end of the filter support of the last output sample
+        n_in = ((n_out - 1) * self.down + self.half_len) // self.up + 1
+        self.push(np.zeros(n_in - self._n_in, dtype=np.float32))
+        # upsampling may produce an output sample past the end of the stream
+        n_extra = self._n_out - n_out
+        return self._buffer[len(self._buffer) - n_missing - n_extra : len(self._buffer) - n_extra]
+
@@ -0,0 +1,178 @@
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# stages of a packet's trip through the realtime pipeline, in order
+PIPELINE_STAGES = (
+    # callback: copying the captured packet into q_in
+    "capture",
+    # q_in: from being queued by the callback to being picked up by the conversion process
+    "queue_wait",
+    # 22050Hz -> 16kHz resampling of the new samples of the window
+    "resample",
+    "preprocessor",
+    "model",
+    # 24kHz -> 22050Hz resampling, noise suppression & cross-fade
+    "postprocess",
+    # q_out: from being queued by the conversion process to being played back by the callback
+    "output_queue_wait",
+    # from the packet's capture to its playback
+    "roundtrip",
+)
+# other scopes timed by the conversion processes, see `perf_counter.PerfCounter`
+PERF_COUNTERS = (
+    "voice_conversion",
+    "batched_voice_conversion",
+)
+
+# HDR-style log-linear buckets over microseconds: values below 2 ** SUB_BUCKET_BITS get a bucket each, above that
+# every power of two is split into 2 ** (SUB_BUCKET_BITS - 1) buckets, i.e. < 1% relative error
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF_BITS = SUB_BUCKET_BITS - 1
+# up to ~134s, longer durations are counted in the last bucket
+MAX_VALUE_BITS = 27
+N_BUCKETS = ((MAX_VALUE_BITS - SUB_BUCKET_BITS) + 2) << SUB_BUCKET_HALF_BITS
+
+
+def _bucket_bounds_us():
+    idx = np.arange(N_BUCKETS, dtype=np.int64)
+    shift = np.maximum(idx >> SUB_BUCKET_HALF_BITS, 1) - 1
+    sub = idx - (shift << SUB_BUCKET_HALF_BITS)
+    return sub << shift, (sub + 1) << shift
+
+
+BUCKET_LOWER_US, BUCKET_UPPER_US = _bucket_bounds_us()
+# all values of a bucket are taken to be its midpoint for sums & means, as HDR histograms do
+BUCKET_MID_US = (BUCKET_LOWER_US + BUCKET_UPPER_US - 1) / 2
+
+# upper bounds of the buckets exported to prometheus
+PROMETHEUS_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def bucket_index(value_us: int) -> int:
+    shift = value_us.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return value_us
+    return min((shift << SUB_BUCKET_HALF_BITS) + (value_us >> shift), N_BUCKETS - 1)
+
+
+class LatencyHistograms(object):
+    """
+    Fixed-size latency histograms, one per named stage, backed by shared memory so that the processes of the pipeline
+    record into them & the server reads them without any IPC on the audio path. `shared=False` keeps them in process
+    memory instead, e.g. for counters nobody else reads, in which case they can't be sent to other processes.
+
+    Recording is a single int64 increment & doesn't take a lock, so each stage should only be recorded by one process
+    at a time. Readers may see a histogram mid-update, which is off by at most a single sample.
+    """
+
+    def __init__(self, stages: Sequence[str] = PIPELINE_STAGES + PERF_COUNTERS, shared: bool = True):
+        self.stages = tuple(stages)
+
+        if shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+            self._buf = self._shm.buf
+        else:
+            self._shm = None
+            self._buf = memoryview(bytearray(self._nbytes()))
+        self._attach()
+        self._data[:] = 0
+
+    def _nbytes(self) -> int:
+        return 8 * len(self.stages) * N_BUCKETS
+
+    def _attach(self):
+        self.index: Dict[str, int] = {stage: i for i, stage in enumerate(self.stages)}
+        self._data = np.ndarray((len(self.stages), N_BUCKETS), dtype=np.int64, buffer=self._buf)
+        # element-wise access through a memoryview is several times faster than through numpy
+        row_nbytes = 8 * N_BUCKETS
+        self._counts = [self._buf[i * row_nbytes : (i + 1) * row_nbytes].cast("q") for i in range(len(self.stages))]
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, which then attach to the same block
+        return {"stages": self.stages, "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.stages = state["stages"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._buf = self._shm.buf
+        self._attach()
+
+    def counts(self, stage: str) -> memoryview:
+        """The int64 bucket counts of `stage`, indexed by `bucket_index` of a duration in us"""
+        return self._counts[self.index[stage]]
+
+    def record_ns(self, stage: int, duration_ns: int):
+        """Records a duration for the stage at `stage` of `self.stages`, see `self.index`"""
+        self._counts[stage][bucket_index(duration_ns // 1000 if duration_ns > 0 else 0)] += 1
+
+    def record_s(self, stage: int, duration_s: float):
+        self.record_ns(stage, int(duration_s * 1e9))
+
+    def snapshot(self) -> np.ndarray:
+        """A (stages, buckets) copy of the counts"""
+        return self._data.copy()
+
+    def reset(self):
+        self._data[:] = 0
+
+    def summary(self, snapshot: Optional[np.ndarray] = None, percentiles: Sequence[float] = (50, 90, 99)) -> Dict:
+        """
+        Per stage sample count, mean, percentiles & max in ms, of `snapshot` if given, e.g. the difference of two
+        snapshots for the latencies over an interval
+        """
+        data = self.snapshot() if snapshot is None else snapshot
+        return {stage: summarize(data[i], percentiles) for i, stage in enumerate(self.stages)}
+
+    def close(self):
+        """Release this process' view of the shared memory"""
+        for counts in self._counts:
+            counts.release()
+        del self._data, self._counts, self._buf
+        if self._shm is not None:
+            self._shm.close()
+
+    def unlink(self):
+        """Free the shared memory. Should be called once, by the process that created the histograms"""
+        self._shm.unlink()
+
+
+def summarize(counts: np.ndarray, percentiles: Sequence[float] = (50, 90, 99)) -> Dict[str, float]:
+    """Count, mean, percentiles & max in ms of a single stage's row of a `LatencyHistograms` snapshot"""
+    count = int(counts.sum())
+    out = {"count": count}
+    if count == 0:
+        return out
+
+    # percentiles are reported as the upper bound of their bucket, as HDR histograms do
+    cumulative = np.cumsum(counts)
+    out["mean_ms"] = float(np.dot(counts, BUCKET_MID_US)) / count / 1000
+    for p in percentiles:
+        bucket = int(np.searchsorted(cumulative, p / 100 * count))
+        out[f"p{p:g}_ms"] = float(BUCKET_UPPER_US[bucket]) / 1000
+    out["max_ms"] = float(BUCKET_UPPER_US[np.flatnonzero(counts)[-1]]) / 1000
+    return out
+
+
+def to_prometheus(histograms: LatencyHistograms, name: str = "voice_conversion_stage_latency_seconds") -> str:
+    """Renders the histograms in the prometheus text exposition format, with a `stage` label per histogram"""
+    data = histograms.snapshot()
+    upper_s = BUCKET_UPPER_US / 1e6
+
+    lines: List[str] = [
+        f"# HELP {name} Latency of each stage of the realtime voice conversion pipeline.",
+        f"# TYPE {name} histogram",
+    ]
+    for i, stage in enumerate(histograms.stages):
+        counts = data[i]
+        cumulative = np.cumsum(counts)
+        for le in PROMETHEUS_BUCKETS_S:
+            # last bucket that lies fully below `le`
+            bucket = int(np.searchsorted(upper_s, le, side="right")) - 1
+            count = int(cumulative[bucket]) if bucket >= 0 else 0
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le:g}"}} {count}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {int(cumulative[-1])}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {np.dot(counts, BUCKET_MID_US) / 1e6:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {int(cumulative[-1])}')
+    return "\n".join(lines) + "\n"
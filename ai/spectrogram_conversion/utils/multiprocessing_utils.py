@@ -1,4 +1,11 @@
 import multiprocessing
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ai.spectrogram_conversion.utils.network_utils import STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW
 
 
 class SharedCounter(object):
@@ -16,3 +23,196 @@ class SharedCounter(object):
     def value(self):
         """Return the value of the counter"""
         return self.count.value
+
+
+class SharedRingBuffer(object):
+    """
+    A lock-free, single producer & single consumer ring buffer backed by shared memory. Each slot holds up to
+    `slot_len` float32 samples along with a packet id & packet start timestamp header. The time each packet spent in
+    the buffer is available to the consumer as `last_wait_ns` after every `get`.
+
+    The producer only ever writes `head` and the consumer only ever writes `tail`. Both are aligned int64 values, so
+    their loads & stores are atomic, and a slot is published by bumping `head` only after its contents are written.
+    """
+
+    def __init__(self, capacity: int, slot_len: int):
+        self.capacity = capacity
+        self.slot_len = slot_len
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+        self._attach()
+        self._indices[:] = 0
+        self.last_wait_ns = 0
+
+    def _nbytes(self) -> int:
+        # head & tail, then packet ids, start timestamps, lengths & enqueue timestamps, then the samples
+        return 8 * (2 + 4 * self.capacity) + 4 * self.capacity * self.slot_len
+
+    def _attach(self):
+        buf = self._shm.buf
+        offset = 0
+        self._indices = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._indices.nbytes
+        self._packet_ids = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._packet_ids.nbytes
+        self._start_s = np.ndarray((self.capacity,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._start_s.nbytes
+        self._lengths = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._lengths.nbytes
+        # time.perf_counter_ns of the put, a system-wide clock on the supported platforms
+        self._put_ns = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._put_ns.nbytes
+        self._data = np.ndarray((self.capacity, self.slot_len), dtype=np.float32, buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, which then attach to the same block
+        return {"capacity": self.capacity, "slot_len": self.slot_len, "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self.slot_len = state["slot_len"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+        self.last_wait_ns = 0
+
+    def __len__(self):
+        """Return the number of packets ready to be consumed"""
+        return int(self._indices[0] - self._indices[1])
+
+    def put(self, packet_id: int, start_s: float, data: np.ndarray) -> bool:
+        """Producer only. Copies `data` into the next free slot, returns False if the buffer is full"""
+        head = self._indices[0]
+        if head - self._indices[1] >= self.capacity:
+            return False
+
+        slot = head % self.capacity
+        n = len(data)
+        self._data[slot, :n] = data
+        self._lengths[slot] = n
+        self._packet_ids[slot] = packet_id
+        self._start_s[slot] = start_s
+        self._put_ns[slot] = time.perf_counter_ns()
+
+        # publish
+        self._indices[0] = head + 1
+        return True
+
+    def get(self, out: Optional[np.ndarray] = None, latest: bool = False) -> Optional[Tuple[int, float, np.ndarray]]:
+        """
+        Consumer only. Returns (packet_id, start_s, data) for the oldest packet, or None if the buffer is empty. If
+        `latest` is set, all but the newest packet are dropped. `data` is copied into `out` when given.
+        """
+        head, tail = self._indices[0], self._indices[1]
+        if head == tail:
+            return None
+        if latest:
+            tail = head - 1
+
+        slot = tail % self.capacity
+        n = self._lengths[slot]
+        if out is None:
+            data = self._data[slot, :n].copy()
+        else:
+            data = out[:n]
+            data[:] = self._data[slot, :n]
+        packet = (int(self._packet_ids[slot]), float(self._start_s[slot]), data)
+        self.last_wait_ns = time.perf_counter_ns() - int(self._put_ns[slot])
+
+        # release the slot back to the producer
+        self._indices[1] = tail + 1
+        return packet
+
+    def close(self):
+        """Release this process' view of the shared memory"""
+        del self._indices, self._packet_ids, self._start_s, self._lengths, self._put_ns, self._data
+        self._shm.close()
+
+    def unlink(self):
+        """Free the shared memory. Should be called once, by the process that created the buffer"""
+        self._shm.unlink()
+
+
+class FrameHealth(object):
+    """
+    Playback health of a stream, written by the audio callback & read by the server without any IPC: the number of
+    packets that underflowed, played on time & overflowed, plus the latest `capacity` of those events along with the
+    packet id & roundtrip latency.
+
+    Single producer, any number of readers. Events are published by bumping `head` after they're written, but a reader
+    that falls `capacity` events behind may see events being overwritten.
+    """
+
+    STATUSES = (STATUS_UNDERFLOW, STATUS_OK, STATUS_OVERFLOW)
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+        self._attach()
+        self._head[:] = 0
+        self._counts[:] = 0
+
+    def _nbytes(self) -> int:
+        # head & a counter per status, then the packet ids, statuses & latencies of the events
+        return 8 * (1 + len(self.STATUSES) + 3 * self.capacity)
+
+    def _attach(self):
+        buf = self._shm.buf
+        offset = 0
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._head.nbytes
+        self._counts = np.ndarray((len(self.STATUSES),), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._counts.nbytes
+        self._packet_ids = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._packet_ids.nbytes
+        self._statuses = np.ndarray((self.capacity,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._statuses.nbytes
+        self._latency_s = np.ndarray((self.capacity,), dtype=np.float64, buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        # only the shared memory name is sent to child processes, which then attach to the same block
+        return {"capacity": self.capacity, "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+
+    @property
+    def head(self) -> int:
+        """Number of events recorded so far"""
+        return int(self._head[0])
+
+    def record(self, packet_id: int, status: int, latency_s: float = float("nan")):
+        """Producer only. `latency_s` is the roundtrip latency of the packet played, if any"""
+        self._counts[status - STATUS_UNDERFLOW] += 1
+
+        head = self._head[0]
+        slot = head % self.capacity
+        self._packet_ids[slot] = packet_id
+        self._statuses[slot] = status
+        self._latency_s[slot] = latency_s
+        self._head[0] = head + 1
+
+    def counts(self) -> Dict[int, int]:
+        """Number of events per status"""
+        counts = self._counts.copy()
+        return {status: int(counts[status - STATUS_UNDERFLOW]) for status in self.STATUSES}
+
+    def events(self, since: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The packet ids, statuses & latencies of the events recorded from the `since`-th on, or of the latest
+        `capacity` events if more were recorded since
+        """
+        head = self.head
+        idx = np.arange(max(since, head - self.capacity, 0), head) % self.capacity
+        return self._packet_ids[idx], self._statuses[idx], self._latency_s[idx]
+
+    def close(self):
+        """Release this process' view of the shared memory"""
+        del self._head, self._counts, self._packet_ids, self._statuses, self._latency_s
+        self._shm.close()
+
+    def unlink(self):
+        """Free the shared memory. Should be called once, by the process that created it"""
+        self._shm.unlink()
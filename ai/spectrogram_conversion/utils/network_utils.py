@@ -0,0 +1,32 @@
+import struct
+from typing import Tuple
+
+import numpy as np
+
+# packet id, capture timestamp in seconds & frame status, followed by the samples
+FRAME_HEADER = struct.Struct("<qdb")
+PCM_DTYPES = {"float32": np.float32, "int16": np.int16}
+INT16_SCALE = 32768
+
+# frame status, same values as recorded into FrameHealth by the PyAudio callback
+STATUS_UNDERFLOW = -1
+STATUS_OK = 0
+STATUS_OVERFLOW = 1
+
+
+def encode_frame(packet_id: int, timestamp_s: float, wav: np.ndarray, dtype: str, status: int = STATUS_OK) -> bytes:
+    if dtype == "int16":
+        wav = np.clip(wav * INT16_SCALE, -INT16_SCALE, INT16_SCALE - 1).astype(np.int16)
+    return FRAME_HEADER.pack(packet_id, timestamp_s, status) + np.ascontiguousarray(wav, PCM_DTYPES[dtype]).tobytes()
+
+
+def decode_frame(data: bytes, dtype: str) -> Tuple[int, float, int, np.ndarray]:
+    """Returns the packet id, timestamp, status & float32 samples of a frame"""
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError(f"frame of {len(data)} bytes is shorter than the header")
+
+    packet_id, timestamp_s, status = FRAME_HEADER.unpack_from(data)
+    wav = np.frombuffer(data, dtype=PCM_DTYPES[dtype], offset=FRAME_HEADER.size)
+    if dtype == "int16":
+        wav = wav.astype(np.float32) / INT16_SCALE
+    return packet_id, timestamp_s, status, wav
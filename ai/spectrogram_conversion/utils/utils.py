@@ -20,16 +20,54 @@ def get_ordered_data_from_circular_buffer(
     if segment_len == -1:
         # return the entire buffer in order
         out = np.concatenate((buffer[head:], buffer[:head]), axis=0) if buffer_overflow else buffer[:head]
-        return out.flatten()
+        return out.reshape(-1)
 
-    if head + segment_len >= len(buffer):
+    if head + segment_len > len(buffer):
         out = np.concatenate(
             (
                 buffer[head:],
-                buffer[0:(head + segment_len - len(buffer) + 1)]
+                buffer[0:(head + segment_len - len(buffer))]
             ),
             axis=0
         )
     else:
         out = buffer[head : head+segment_len]
-    return out.flatten()
+    # a view rather than a copy, unless the segments wrap around the end of the buffer
+    return out.reshape(-1)
+
+
+class SlidingWindow:
+    """
+    Preallocated window over the latest `window_len` samples of a stream. Every sample is written twice, `window_len`
+    samples apart, so the window is always available as a contiguous view without shifting or copying the buffer.
+    """
+
+    def __init__(self, window_len: int, dtype=np.float32):
+        self.window_len = window_len
+        self._buffer = np.zeros(2 * window_len, dtype=dtype)
+        # next write position, within [0, window_len)
+        self._pos = 0
+
+    def append(self, data: np.ndarray):
+        n = len(data)
+        if n >= self.window_len:
+            data = data[-self.window_len :]
+            n = self.window_len
+
+        pos, window_len = self._pos, self.window_len
+        end = pos + n
+        if end <= window_len:
+            self._buffer[pos:end] = data
+            self._buffer[pos + window_len : end + window_len] = data
+        else:
+            split = window_len - pos
+            self._buffer[pos:window_len] = data[:split]
+            self._buffer[pos + window_len :] = data[:split]
+            self._buffer[: n - split] = data[split:]
+            self._buffer[window_len : window_len + n - split] = data[split:]
+
+        self._pos = end % window_len
+
+    def view(self) -> np.ndarray:
+        """Returns the window, oldest sample first. Only valid until the next call to `append`"""
+        return self._buffer[self._pos : self._pos + self.window_len]
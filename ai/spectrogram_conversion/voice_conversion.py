@@ -4,41 +4,92 @@ import os
 import tempfile
 from abc import abstractmethod
 from multiprocessing import Value
+from typing import Dict, Optional
 
-import librosa
 import numpy as np
 import platformdirs
-import soundfile as sf
 import torch
 
 import ai.spectrogram_conversion.params as params
 from ai.common.app_freeze_utils import get_application_root
 from ai.common.torch_utils import get_device
-from ai.spectrogram_conversion.utils.utils import get_conversion_root
+from ai.spectrogram_conversion.backends import BACKENDS
+from ai.spectrogram_conversion.perf_counter import PerfCounter, use_histograms
+from ai.spectrogram_conversion.resampler import PolyphaseResampler
+from ai.spectrogram_conversion.timedscope import get_logger
+from ai.spectrogram_conversion.utils.latency_histogram import PIPELINE_STAGES
 
 # electron prefers the roaming folder for user data
 USER_DATA_ROOT = os.path.join(platformdirs.user_data_dir("MetaVoice", roaming=True), "..")
 MODELS_ROOT = os.path.join(get_application_root(), "ai/models")
 USER_MODELS_ROOT = os.path.join(USER_DATA_ROOT, "speakers")
+# optimized models are cached here when the application's models folder is read-only
+USER_OPTIMIZED_MODELS_ROOT = os.path.join(USER_DATA_ROOT, "optimized_models")
+
+_LOGGER = get_logger(os.path.basename(__file__))
+
+
+def get_opt_value(opt: argparse.Namespace, name: str, default=None):
+    """
+    opt values are either plain values or a multiprocessing.Value, which can be updated while the pipeline runs.
+    Strings are shared as a multiprocessing.Array of chars
+    """
+    value = getattr(opt, name, default)
+    if hasattr(value, "get_lock"):
+        with value.get_lock():
+            value = value.value
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
 
 
 class ModelConversionPipeline(abc.ABC):
     def __init__(self, opt: argparse.Namespace):
         self._opt = opt
+        # LatencyHistograms shared with the server, which the perf counters of this process then record into
+        latency_histograms = getattr(opt, "latency_histograms", None)
+        if latency_histograms is not None:
+            use_histograms(latency_histograms)
+        self._stage_counters = {stage: PerfCounter(stage) for stage in PIPELINE_STAGES}
         self.p_sampling_rate = 16000
         self.pp_sampling_rate = 24000
 
-        self.device = get_device()
-        self.mac_silicon_device = torch.backends.mps.is_available()
-
-        # TODO: add brancing logic for windows vs mac.
-        self.model = torch.jit.load(os.path.join(MODELS_ROOT, "model.pt")).to(self.device)
-        self._load_model_preprocessor()
-
-        self._set_target(self._opt.target_speaker)
-        self.tmp_file = os.path.join(get_conversion_root(), os.urandom(8).hex() + ".wav")
+        backend = getattr(opt, "backend", "torchscript")
+        # the onnxruntime backend only runs on cpu
+        self.device = get_device() if backend == "torchscript" else torch.device("cpu")
+        self.backend = BACKENDS[backend](opt, self.device, MODELS_ROOT, USER_OPTIMIZED_MODELS_ROOT)
+
+        # target speaker embeddings are small, so all of them are kept on the device to swap voices between packets
+        self._targets: Dict[str, torch.Tensor] = {}
+        self._preload_targets()
+        speaker_id = self._get_opt_value("target_speaker")
+        if not speaker_id and self._targets:
+            # e.g. a worker warmed up before any session picked a voice
+            speaker_id = next(iter(self._targets))
+        self._set_target(speaker_id)
+
+        # incoming 22050Hz audio is resampled to 16kHz for the preprocessor, and the 24kHz model output back to
+        # 22050Hz as expected for the rest of the pipeline
+        self.p_resampler = PolyphaseResampler(params.sample_rate, self.p_sampling_rate)
+        self.pp_resampler = PolyphaseResampler(self.pp_sampling_rate, params.sample_rate)
 
     def _set_target(self, speaker_id: str):
+        self.target = self._load_target(speaker_id)
+        self._target_speaker = speaker_id
+
+    def _preload_targets(self):
+        for root in (os.path.join(MODELS_ROOT, "targets"), USER_MODELS_ROOT):
+            if not os.path.isdir(root):
+                continue
+            for fname in sorted(os.listdir(root)):
+                if fname.endswith(".npy"):
+                    self._load_target(fname[: -len(".npy")])
+
+    def _load_target(self, speaker_id: str) -> torch.Tensor:
+        """Returns the (1, ...) target speaker embedding of `speaker_id`, loading it onto the device on first use"""
+        if speaker_id in self._targets:
+            return self._targets[speaker_id]
+
         path_model = os.path.join(MODELS_ROOT, f"targets/{speaker_id}.npy")
         path = path_model
 
@@ -49,40 +100,81 @@ class ModelConversionPipeline(abc.ABC):
         if not os.path.exists(path):
             raise FileNotFoundError(f"Target speaker {speaker_id} not found in {path_model} or {path_user}.")
 
-        self.target = np.load(path)
-        self.target = torch.from_numpy(self.target).unsqueeze(0).to(self.device)
-
-    def _load_model_preprocessor(self):
-        if self.mac_silicon_device:
-            import coremltools as ct
-
-            self.pmodel = ct.models.MLModel(os.path.join(MODELS_ROOT, "model.mlpackage"))
-        else:
-            # TODO: add branching logic for windows vs mac
-            self.pmodel = torch.jit.load(os.path.join(MODELS_ROOT, "b_model.pt")).to(self.device)
-
-    def infer(self, wav: np.ndarray) -> np.ndarray:
-        # TODO: fix hack. we write incoming 22050Hz audio into 16khz file, use preprocessor, then inference which
-        # returns file at 24kHz, and write it back into 22050Hz file as expected for rest of the pipeline.
-        with torch.no_grad():
-            sf.write(self.tmp_file, wav, params.sample_rate)
-
-            wav_src, _ = librosa.load(self.tmp_file, sr=self.p_sampling_rate)
-            if not self.mac_silicon_device:
-                wav_src = torch.from_numpy(wav_src).unsqueeze(0).to(self.device)
-                c = self.pmodel(wav_src.squeeze(1))
-            else:
-                c = self.pmodel.predict({"input_values": wav_src[np.newaxis, :]})["var_3641"]
-                c = torch.from_numpy(c).to(self.device)
-
-            audio = self.model(c, self.target)
-            audio = audio[0][0].data.cpu().float().numpy()
-
-            sf.write(self.tmp_file, audio, self.pp_sampling_rate)
-
-            out, _ = librosa.load(self.tmp_file, sr=params.sample_rate)
-            os.remove(self.tmp_file)
-
+        self._targets[speaker_id] = torch.from_numpy(np.load(path)).unsqueeze(0).to(self.device)
+        return self._targets[speaker_id]
+
+    def update_target(self):
+        """Swaps in the target speaker if `opt.target_speaker` was changed while the pipeline runs"""
+        speaker_id = self._get_opt_value("target_speaker")
+        if not speaker_id or speaker_id == self._target_speaker:
+            return
+
+        try:
+            self._set_target(speaker_id)
+            _LOGGER.info(f"target_speaker={speaker_id}")
+        except FileNotFoundError as e:
+            # keep converting to the previous target, without retrying on every packet
+            _LOGGER.warn(e)
+            self._target_speaker = speaker_id
+
+    def _run_preprocessor(self, wav_src: np.ndarray) -> torch.Tensor:
+        """`wav_src` is a (batch, samples) array of 16kHz audio"""
+        return self.backend.preprocess(wav_src)
+
+    def infer(self, wav: np.ndarray, wav_src: Optional[np.ndarray] = None) -> np.ndarray:
+        """`wav_src` can be passed in when the 16kHz preprocessor input has already been resampled by the caller"""
+        return self.infer_batch(
+            wav[np.newaxis, :],
+            wav_srcs=None if wav_src is None else wav_src[np.newaxis, :],
+        )[0]
+
+    def infer_batch(
+        self,
+        wavs: np.ndarray,
+        wav_srcs: Optional[np.ndarray] = None,
+        targets: Optional[torch.Tensor] = None,
+    ) -> np.ndarray:
+        """
+        Converts a (batch, samples) array of equal length windows in a single forward pass. `targets` defaults to the
+        pipeline's target speaker for every window.
+        """
+        if wav_srcs is None:
+            wav_srcs = self.p_resampler(wavs)
+        return self.infer_features(self.preprocess(wav_srcs), targets)
+
+    def preprocess(self, wav_srcs: np.ndarray) -> torch.Tensor:
+        """Content features of a (batch, samples) array of 16kHz audio"""
+        with torch.inference_mode():
+            return self._run_preprocessor(np.ascontiguousarray(wav_srcs, dtype=np.float32))
+
+    def infer_features(self, c: torch.Tensor, targets: Optional[torch.Tensor] = None) -> np.ndarray:
+        """Runs the model on a batch of preprocessor features, returns `params.sample_rate` audio"""
+        return self.pp_resampler(self.convert_features(c, targets))
+
+    def convert_features(self, c: torch.Tensor, targets: Optional[torch.Tensor] = None) -> np.ndarray:
+        """Runs the model on a batch of preprocessor features, returns the model's 24kHz audio"""
+        with torch.inference_mode():
+            if targets is None:
+                targets = self.target.expand(len(c), *self.target.shape[1:])
+            audio = self.backend.convert(c, targets)
+            return audio[:, 0].data.cpu().float().numpy()
+
+    def record_stage(self, stage: str, duration_ns: int):
+        self._stage_counters[stage].record_ns(duration_ns)
+
+    def time_stage(self, stage: str) -> PerfCounter:
+        """Context manager recording the duration of its scope for `stage` of PIPELINE_STAGES"""
+        return self._stage_counters[stage]
+
+    def _get_opt_value(self, name: str, default=None):
+        return get_opt_value(self._opt, name, default)
+
+    def suppress_noise(self, out: np.ndarray, wav: np.ndarray, threshold: Optional[float] = None) -> np.ndarray:
+        """Suppresses the output if excessive model amplification is detected"""
+        if threshold is None:
+            threshold = self._get_opt_value("noise_suppression_threshold")
+        if np.max(np.abs(out)) > (threshold * np.max(np.abs(wav))):
+            return 0 * out
         return out
 
     @abstractmethod
@@ -1,7 +1,10 @@
 import os
+from typing import Optional, Sequence
 
 import boto3
 
+from common.upload_queue import UploadQueue
+
 ACCESS_KEY = None
 SECRET_KEY = None
 BUCKET = "BUCKET_TO_PUSH_TO"
@@ -16,13 +19,23 @@ if ACCESS_KEY and SECRET_KEY:
     )
 
 
-def upload_directory_to_s3(path: str, object_prefix: str) -> None:
+def upload_directory_to_s3(path: str, object_prefix: str, exclude: Sequence[str] = ()) -> None:
+    """Uploads the files under `path`, skipping the directories named in `exclude`"""
     if not S3:
         return
 
     assert os.path.exists(path)
 
-    for root, _, files in os.walk(path):
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in exclude]
         for file in files:
             filename = os.path.join(root, file)
             S3.upload_file(Filename=filename, Bucket=BUCKET, Key=f"{object_prefix}/{os.path.relpath(filename, path)}")
+
+
+def create_upload_queue(root: str, **kwargs) -> Optional[UploadQueue]:
+    """A queue of background uploads to the bucket, persisted under `root`. None if there are no credentials"""
+    if not S3:
+        return None
+
+    return UploadQueue(S3, BUCKET, root, **kwargs)
@@ -0,0 +1,264 @@
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+_LOGGER = logging.getLogger(__name__)
+
+# files above this are uploaded in parts, so that an interrupted upload resumes from its last completed part
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+# S3 requires at least 5MB for all but the last part
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+MAX_ATTEMPTS = 5
+# doubled after every failed attempt of a file
+RETRY_BACKOFF_S = 2.0
+
+
+class UploadQueue:
+    """
+    Uploads directories to S3 in the background. A queued directory's files are moved under `root` along with a job
+    file that records the progress of each of them, so that pending jobs survive restarts: `start` resumes them,
+    skipping the files that were uploaded & continuing multipart uploads from their last uploaded part.
+
+    Files are uploaded concurrently by `num_workers` threads. A failed file is retried with exponential backoff, up to
+    `max_attempts` times after which its job is moved to `root/failed` & left there.
+
+    `client` is a boto3 S3 client, or anything implementing the methods of one used here, e.g. a fake for testing.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        root: str,
+        num_workers: int = 4,
+        max_attempts: int = MAX_ATTEMPTS,
+        multipart_threshold: int = MULTIPART_THRESHOLD,
+        multipart_chunksize: int = MULTIPART_CHUNKSIZE,
+    ):
+        self._client = client
+        self._bucket = bucket
+        self._num_workers = num_workers
+        self._max_attempts = max_attempts
+        self._multipart_threshold = multipart_threshold
+        self._multipart_chunksize = multipart_chunksize
+
+        self._jobs_root = os.path.join(root, "jobs")
+        self._data_root = os.path.join(root, "data")
+        self._failed_root = os.path.join(root, "failed")
+        for path in (self._jobs_root, self._data_root, self._failed_root):
+            os.makedirs(path, exist_ok=True)
+
+        # pending jobs by id, guarded by `_lock` along with their job files
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._retry_timers: List[threading.Timer] = []
+        self._stopped = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Starts the workers & resumes the jobs left pending by a previous run"""
+        self._executor = ThreadPoolExecutor(max_workers=self._num_workers, thread_name_prefix="upload")
+
+        for fname in sorted(os.listdir(self._jobs_root)):
+            if not fname.endswith(".json"):
+                continue
+            with open(os.path.join(self._jobs_root, fname)) as f:
+                job = json.load(f)
+            _LOGGER.info(f"resuming upload {job['id']} to {job['object_prefix']}")
+            self._add_job(job)
+
+    def enqueue(self, path: str, object_prefix: str, exclude: Sequence[str] = ()) -> str:
+        """
+        Queues the upload of the files under `path`, except for those under the top-level entries named in `exclude`,
+        to `object_prefix`. The files are moved out of `path` before this returns. Returns the id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        data_path = os.path.join(self._data_root, job_id)
+        os.makedirs(data_path)
+        for entry in os.listdir(path):
+            if entry not in exclude:
+                shutil.move(os.path.join(path, entry), os.path.join(data_path, entry))
+
+        files = {}
+        for root, _, fnames in os.walk(data_path):
+            for fname in fnames:
+                relpath = os.path.relpath(os.path.join(root, fname), data_path).replace(os.sep, "/")
+                files[relpath] = {"done": False, "attempts": 0, "upload_id": None}
+
+        job = {"id": job_id, "object_prefix": object_prefix, "files": files}
+        with self._lock:
+            self._save_job(job)
+        self._add_job(job)
+        return job_id
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits until no jobs are pending. Returns False if `timeout` expired first"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._jobs, timeout)
+
+    def stop(self):
+        """
+        Stops the workers once their current file or part is uploaded. Unfinished jobs stay on disk for the next `start`
+        """
+        with self._lock:
+            # set under the lock, so that no file is submitted once the executor is shutting down
+            self._stopped.set()
+            for timer in self._retry_timers:
+                timer.cancel()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+    def _add_job(self, job: Dict):
+        pending = [relpath for relpath, state in job["files"].items() if not state["done"]]
+        with self._lock:
+            self._jobs[job["id"]] = job
+        if not pending:
+            self._finish_job(job["id"])
+        for relpath in pending:
+            self._submit(job["id"], relpath)
+
+    def _save_job(self, job: Dict):
+        fname = os.path.join(self._jobs_root, f"{job['id']}.json")
+        with open(f"{fname}.tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(f"{fname}.tmp", fname)
+
+    def _finish_job(self, job_id: str, failed: bool = False):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return
+
+            fname = os.path.join(self._jobs_root, f"{job_id}.json")
+            data_path = os.path.join(self._data_root, job_id)
+            if failed:
+                # kept for inspection, along with its files
+                os.replace(fname, os.path.join(self._failed_root, f"{job_id}.json"))
+                shutil.move(data_path, os.path.join(self._failed_root, job_id))
+            else:
+                os.remove(fname)
+                shutil.rmtree(data_path, ignore_errors=True)
+            self._idle.notify_all()
+
+    def _upload_file(self, job_id: str, relpath: str):
+        job = self._jobs.get(job_id)
+        if job is None or self._stopped.is_set():
+            # stopped, or the job failed on another of its files
+            return
+
+        filename = os.path.join(self._data_root, job_id, relpath)
+        key = f"{job['object_prefix']}/{relpath}"
+        try:
+            if os.path.getsize(filename) > self._multipart_threshold:
+                completed = self._upload_multipart(job, relpath, filename, key)
+            else:
+                with open(filename, "rb") as f:
+                    self._client.put_object(Bucket=self._bucket, Key=key, Body=f)
+                completed = True
+        except Exception as e:
+            if not self._stopped.is_set():
+                self._retry(job, relpath, e)
+            return
+        if not completed:
+            # stopped between parts, resumed by the next `start`
+            return
+
+        with self._lock:
+            if job_id not in self._jobs:
+                return
+            job["files"][relpath]["done"] = True
+            self._save_job(job)
+            done = all(state["done"] for state in job["files"].values())
+        if done:
+            _LOGGER.info(f"uploaded {job['object_prefix']}")
+            self._finish_job(job_id)
+
+    def _retry(self, job: Dict, relpath: str, error: Exception):
+        with self._lock:
+            if job["id"] not in self._jobs:
+                return
+            state = job["files"][relpath]
+            state["attempts"] += 1
+            self._save_job(job)
+            attempts = state["attempts"]
+
+        if attempts >= self._max_attempts:
+            _LOGGER.error(f"giving up on {job['object_prefix']}/{relpath} after {attempts} attempts: {error}")
+            self._finish_job(job["id"], failed=True)
+            return
+
+        delay_s = RETRY_BACKOFF_S * 2 ** (attempts - 1)
+        _LOGGER.warning(f"failed to upload {job['object_prefix']}/{relpath}, retrying in {delay_s:0.0f}s: {error}")
+        timer = threading.Timer(delay_s, self._submit, args=(job["id"], relpath))
+        timer.daemon = True
+        with self._lock:
+            self._retry_timers = [t for t in self._retry_timers if t.is_alive()] + [timer]
+        timer.start()
+
+    def _submit(self, job_id: str, relpath: str):
+        with self._lock:
+            # once stopped, the file is left for the next `start`
+            if not self._stopped.is_set():
+                self._executor.submit(self._upload_file, job_id, relpath)
+
+    def _upload_multipart(self, job: Dict, relpath: str, filename: str, key: str) -> bool:
+        """Returns False if stopped before all the parts were uploaded"""
+        state = job["files"][relpath]
+
+        # S3 keeps the parts of an unfinished upload, so only the missing ones are uploaded when resuming
+        etags: Dict[int, str] = {}
+        if state["upload_id"] is not None:
+            try:
+                etags = self._list_parts(key, state["upload_id"])
+            except Exception as e:
+                # e.g. aborted by a bucket lifecycle rule, starts over
+                _LOGGER.warning(f"can't resume the upload of {key}, restarting it: {e}")
+                state["upload_id"] = None
+        if state["upload_id"] is None:
+            upload_id = self._client.create_multipart_upload(Bucket=self._bucket, Key=key)["UploadId"]
+            with self._lock:
+                state["upload_id"] = upload_id
+                self._save_job(job)
+
+        n_parts = max(math.ceil(os.path.getsize(filename) / self._multipart_chunksize), 1)
+        with open(filename, "rb") as f:
+            for part_number in range(1, n_parts + 1):
+                if part_number in etags:
+                    continue
+                if self._stopped.is_set():
+                    return False
+                f.seek((part_number - 1) * self._multipart_chunksize)
+                response = self._client.upload_part(
+                    Bucket=self._bucket,
+                    Key=key,
+                    UploadId=state["upload_id"],
+                    PartNumber=part_number,
+                    Body=f.read(self._multipart_chunksize),
+                )
+                etags[part_number] = response["ETag"]
+
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket,
+            Key=key,
+            UploadId=state["upload_id"],
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": etags[n]} for n in sorted(etags)]},
+        )
+        return True
+
+    def _list_parts(self, key: str, upload_id: str) -> Dict[int, str]:
+        etags = {}
+        kwargs = {"Bucket": self._bucket, "Key": key, "UploadId": upload_id}
+        while True:
+            response = self._client.list_parts(**kwargs)
+            for part in response.get("Parts", []):
+                etags[part["PartNumber"]] = part["ETag"]
+            if not response.get("IsTruncated"):
+                return etags
+            kwargs["PartNumberMarker"] = response["NextPartNumberMarker"]
@@ -1,32 +1,23 @@
 import argparse
 import asyncio
+import math
 import multiprocessing
 import multiprocessing as mp
 import os
+import threading
 import time
 from dataclasses import dataclass
-from multiprocessing import Process, Value
-from typing import Optional
+from multiprocessing import Array, Process, Value
+from typing import TYPE_CHECKING, Optional
 
-import numpy as np
-
-# librosa uses the deprecated alias
-np.complex = complex
-
-import librosa
-import sounddevice as sd
-import soundfile as sf
-import urllib3
 import uvicorn
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 import sys
 
 from data_types import DeviceMap
-from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from portaudio_utils import get_devices
 
 # TODO is this safe? ai wasn't found otherwise, but depending on how this file is loaded,
@@ -34,15 +25,49 @@ from portaudio_utils import get_devices
 # as they can override the files directly anyway?
 sys.path.append('../..')
 
+# NOTE: only lightweight modules are imported at module level so that the API is up straight away. The ML & audio
+# stacks are imported by `preload_modules`, either from a background thread at startup or on first use
 from ai.spectrogram_conversion.data_types import InferencePipelineMode
-from ai.spectrogram_conversion.inference_rt import run_inference_rt
-from ai.spectrogram_conversion.params import num_mels, num_samples, sample_rate
+from ai.spectrogram_conversion.params import sample_rate
 from ai.spectrogram_conversion.timedscope import TimedScope, get_logger
-from ai.spectrogram_conversion.utils.utils import get_conversion_root
-from common.aws_utils import upload_directory_to_s3
+
+if TYPE_CHECKING:
+    from ai.spectrogram_conversion.batched_conversion import BatchedConversionServer
+    from ai.spectrogram_conversion.inference_rt import ConversionWorker
+    from ai.spectrogram_conversion.utils.latency_histogram import LatencyHistograms
+    from ai.spectrogram_conversion.utils.multiprocessing_utils import FrameHealth
+    from common.upload_queue import UploadQueue
 
 _LOGGER = get_logger(__name__)
 IS_MOCK = os.environ.get("IS_MOCK", "false") == "true"
+# one of ai.spectrogram_conversion.backends.BACKENDS
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torchscript")
+# one of ai.spectrogram_conversion.recording.RECORDING_CODECS, validated by `preload_target`
+RECORDING_CODEC = os.environ.get("RECORDING_CODEC", "flac")
+
+
+_PRELOAD_LOCK = threading.Lock()
+_PRELOADED = False
+
+
+def preload_modules():
+    """Imports the ML & audio stacks. Blocks until they're imported if another thread is already importing them"""
+    global _PRELOADED
+
+    with _PRELOAD_LOCK:
+        if _PRELOADED:
+            return
+
+        with TimedScope("preload_modules", _LOGGER):
+            import soundfile
+            import urllib3
+
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+            import ai.spectrogram_conversion.inference_rt
+            import ai.spectrogram_conversion.network_stream
+            import common.aws_utils
+        _PRELOADED = True
 
 
 @dataclass
@@ -54,14 +79,116 @@ class UserState:
 
 USER_STATE = UserState()
 convert_process: Optional[Process] = None
+# loaded & warmed up at startup, sessions attach to it rather than loading their own models
+conversion_worker: Optional["ConversionWorker"] = None
+# held while (re)starting the worker & while starting a session, so that a restart never pulls it from under a session
+_CONVERSION_WORKER_LOCK = threading.Lock()
+# set once the background preload at startup is done, including starting the conversion worker
+preload_complete = threading.Event()
 stop_pipeline: Optional[Value] = None
 has_pipeline_started: Optional[Value] = None
 # TODO sidroopdaska: swap this for application hooks
 # TODO sidroopdaska: use mp.Manager.dict
 noise_suppression_threshold: Optional[Value] = None
 callback_latency_ms: Optional[Value] = None
-latency_queue: Optional[multiprocessing.Queue] = None
-frame_dropping: Optional[multiprocessing.Queue] = None
+context_length_ms: Optional[Value] = None
+# null terminated chars, read by the conversion process before every packet
+target_speaker_id: Optional[Array] = None
+TARGET_SPEAKER_MAX_LEN = 256
+# conversion worker cpu settings, applied whenever a session attaches, see `get_conversion_settings`
+num_threads: Optional[Value] = None
+# only applied when the conversion process starts, as torch can't change it afterwards
+num_interop_threads: Optional[Value] = None
+cpu_affinity: Optional[Array] = None
+high_priority: Optional[Value] = None
+# underflow / ok / overflow of every packet played, written by the session's audio callback. Created by the preload
+# thread & shared by all sessions, each of which starts reading from the event at `frame_health_session_start`
+frame_health: Optional["FrameHealth"] = None
+frame_health_session_start = 0
+# per-stage latencies recorded by the sessions & the conversion worker, created by the preload thread
+latency_histograms: Optional["LatencyHistograms"] = None
+# background uploads of the sessions shared via /feedback, see `get_upload_queue`
+upload_queue: Optional["UploadQueue"] = None
+_UPLOAD_QUEUE_LOCK = threading.Lock()
+# converts the /ws-convert sessions, all of them with one copy of the models, see `get_batched_conversion_server`
+batched_conversion_server: Optional["BatchedConversionServer"] = None
+_BATCHED_CONVERSION_SERVER_LOCK = threading.Lock()
+
+
+def get_upload_queue() -> Optional["UploadQueue"]:
+    """Started on first use, which resumes the uploads left pending by the last run. None without S3 credentials"""
+    global upload_queue
+
+    with _UPLOAD_QUEUE_LOCK:
+        if upload_queue is None:
+            from ai.spectrogram_conversion.utils.utils import get_conversion_root
+            from common.aws_utils import create_upload_queue
+
+            upload_queue = create_upload_queue(os.path.join(os.path.dirname(get_conversion_root()), "uploads"))
+            if upload_queue:
+                upload_queue.start()
+        return upload_queue
+
+
+def get_batched_conversion_server() -> "BatchedConversionServer":
+    """Started on first use, or if it has died, so the models are only loaded once network sessions are used"""
+    global batched_conversion_server
+
+    from ai.spectrogram_conversion.batched_conversion import BatchedConversionServer
+
+    with _BATCHED_CONVERSION_SERVER_LOCK:
+        if batched_conversion_server is None or not batched_conversion_server.is_alive:
+            if batched_conversion_server is not None:
+                _LOGGER.error("the batched conversion worker has died, restarting it")
+                batched_conversion_server.stop()
+
+            batched_conversion_server = BatchedConversionServer(
+                argparse.Namespace(mode=InferencePipelineMode.online_crossfade, backend=INFERENCE_BACKEND)
+            )
+            batched_conversion_server.start()
+        return batched_conversion_server
+
+
+def get_conversion_settings() -> dict:
+    """The thread, cpu affinity & priority settings of /register-user, for the opt of the conversion processes"""
+    return dict(
+        num_threads=num_threads,
+        num_interop_threads=num_interop_threads,
+        cpu_affinity=cpu_affinity,
+        high_priority=high_priority,
+    )
+
+
+def is_session_running() -> bool:
+    return convert_process is not None and convert_process.is_alive()
+
+
+def start_conversion_worker():
+    """Starts the persistent conversion worker with the current settings, replacing the running one if any"""
+    global conversion_worker
+
+    from ai.spectrogram_conversion.inference_rt import ConversionWorker
+
+    with _CONVERSION_WORKER_LOCK:
+        if conversion_worker is not None:
+            if is_session_running():
+                _LOGGER.warn("a session is attached to the conversion worker, not restarting it")
+                return
+            conversion_worker.stop()
+
+        conversion_worker = ConversionWorker(
+            argparse.Namespace(
+                mode=InferencePipelineMode.online_crossfade,
+                noise_suppression_threshold=noise_suppression_threshold,
+                callback_latency_ms=callback_latency_ms,
+                context_length_ms=context_length_ms,
+                target_speaker=target_speaker_id,
+                backend=INFERENCE_BACKEND,
+                latency_histograms=latency_histograms,
+                **get_conversion_settings(),
+            )
+        )
+        conversion_worker.start()
 
 
 def sigterm_handler():
@@ -79,11 +206,17 @@ def convert_process_target(
     output_device_idx: int,
     noise_suppression_threshold: Value,
     callback_latency_ms: Value,
-    target_speaker: str,
+    context_length_ms: Value,
+    target_speaker: Array,
     session_upload_path: str,
-    latency_queue: multiprocessing.Queue,
-    frame_dropping: multiprocessing.Queue,
+    recording_codec: str,
+    frame_health: "FrameHealth",
+    conversion_worker: Optional["ConversionWorker"],
+    latency_histograms: Optional["LatencyHistograms"],
+    conversion_settings: dict,
 ):
+    from ai.spectrogram_conversion.inference_rt import run_inference_rt
+
     # TODO sidroopdaska: replace argparse.Namespace with dataclass
     # TODO sidroopdaska: lazy loading of model
     opt = argparse.Namespace(
@@ -92,16 +225,21 @@ def convert_process_target(
         output_device_idx=output_device_idx,
         noise_suppression_threshold=noise_suppression_threshold,
         callback_latency_ms=callback_latency_ms,
+        context_length_ms=context_length_ms,
         session_upload_path=session_upload_path,
+        recording_codec=recording_codec,
         target_speaker=target_speaker,
+        latency_histograms=latency_histograms,
+        # used by the session's own conversion process, when there's no worker
+        **conversion_settings,
     )
 
     run_inference_rt(
         opt,
         stop_pipeline=stop_pipeline,
         has_pipeline_started=has_pipeline_started,
-        latency_queue=latency_queue,
-        frame_dropping=frame_dropping,
+        frame_health=frame_health,
+        worker=conversion_worker,
     )
 
 
@@ -123,21 +261,59 @@ def get_device_map(mode: str = "all") -> DeviceMap:
 
 
 @app.get("/register-user")
-def register_user(email: str, issuer: str, share_data: bool, noise_suppression: float, callback_latency_ms_: int):
-    global USER_STATE, noise_suppression_threshold, callback_latency_ms
+def register_user(
+    email: str,
+    issuer: str,
+    share_data: bool,
+    noise_suppression: float,
+    callback_latency_ms_: int,
+    context_length_ms_: int = 0,
+    num_threads_: int = 0,
+    num_interop_threads_: int = 0,
+    cpu_affinity_: str = "",
+    high_priority_: bool = False,
+):
+    global USER_STATE, noise_suppression_threshold, callback_latency_ms, context_length_ms, num_threads, num_interop_threads, cpu_affinity, high_priority
+
+    # validated up front, as the conversion worker can only ignore bad settings
+    if num_threads_ < 0 or num_interop_threads_ < 0:
+        raise HTTPException(status_code=400, detail="Bad request. Thread counts can't be negative")
+    if len(cpu_affinity_.encode()) >= len(cpu_affinity):
+        raise HTTPException(status_code=400, detail="Bad request. `cpu_affinity_` is too long")
+    if cpu_affinity_:
+        from ai.common.process_utils import validate_cpu_list
+
+        try:
+            validate_cpu_list(cpu_affinity_)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Bad request. {e}")
+    interop_threads_changed = num_interop_threads_ != num_interop_threads.value
+
     USER_STATE.email = email
     USER_STATE.issuer = issuer
     USER_STATE.should_capture_data = share_data
 
-    # double
-    noise_suppression_threshold = Value("d", noise_suppression)
-    # unsigned int
-    callback_latency_ms = Value("I", callback_latency_ms_)
+    # the values are shared with the conversion worker, so they're updated in place
+    for value, value_ in [
+        (noise_suppression_threshold, noise_suppression),
+        (callback_latency_ms, callback_latency_ms_),
+        (context_length_ms, context_length_ms_),
+        (num_threads, num_threads_),
+        (num_interop_threads, num_interop_threads_),
+        (cpu_affinity, cpu_affinity_.encode()),
+        (high_priority, int(high_priority_)),
+    ]:
+        with value.get_lock():
+            value.value = value_
     print(share_data)
     print(type(share_data))
     print(type(noise_suppression))
     print(noise_suppression_threshold.value)
     print(callback_latency_ms.value)
+
+    # torch can't change the inter-op threads once the worker's models have run, so it's restarted to apply them
+    if interop_threads_changed and conversion_worker is not None:
+        threading.Thread(target=start_conversion_worker, daemon=True).start()
     return True
 
 
@@ -151,53 +327,186 @@ def get_start_convert(input_device_idx: int, output_device_idx: int, app_version
         return True
 
     with TimedScope("get_start_convert", _LOGGER):
-        global convert_process, stop_pipeline, has_pipeline_started, noise_suppression_threshold, callback_latency_ms, latency_queue, frame_dropping
+        global convert_process, stop_pipeline, has_pipeline_started, noise_suppression_threshold, callback_latency_ms, context_length_ms, target_speaker_id, frame_health_session_start
+
+        # the worker is started by the preload thread, make sure it exists before sessions attach to it
+        preload_complete.wait()
+        if frame_health is None or latency_histograms is None:
+            raise HTTPException(status_code=503, detail="Service unavailable. The conversion failed to load")
 
         stop_pipeline = Value("i", 0)
+        with target_speaker_id.get_lock():
+            target_speaker_id.value = target_speaker.encode()
         has_pipeline_started = Value("i", 0)
-        latency_queue = multiprocessing.Queue()
-        frame_dropping = multiprocessing.Queue()
-        convert_process = Process(
-            target=convert_process_target,
-            args=(
-                stop_pipeline,
-                has_pipeline_started,
-                input_device_idx,
-                output_device_idx,
-                noise_suppression_threshold,
-                callback_latency_ms,
-                target_speaker,
-                (f"{USER_STATE.email}/{session_id}" if USER_STATE.should_capture_data else None),
-                latency_queue,
-                frame_dropping,
-            ),
-        )
-        convert_process.start()
+        frame_health_session_start = frame_health.head
+        with _CONVERSION_WORKER_LOCK:
+            convert_process = Process(
+                target=convert_process_target,
+                args=(
+                    stop_pipeline,
+                    has_pipeline_started,
+                    input_device_idx,
+                    output_device_idx,
+                    noise_suppression_threshold,
+                    callback_latency_ms,
+                    context_length_ms,
+                    target_speaker_id,
+                    (f"{USER_STATE.email}/{session_id}" if USER_STATE.should_capture_data else None),
+                    # passed on, as the global is only resolved in this process
+                    RECORDING_CODEC,
+                    frame_health,
+                    # sessions convert in their own process if the worker died, e.g. while loading the models
+                    conversion_worker if conversion_worker is not None and conversion_worker.is_alive else None,
+                    latency_histograms,
+                    get_conversion_settings(),
+                ),
+            )
+            convert_process.start()
 
         while not has_pipeline_started.value:
+            if not convert_process.is_alive():
+                raise HTTPException(status_code=500, detail="Conversion failed to start")
             time.sleep(0.2)
         return True
 
 
-@app.websocket_route("/ws-frame-health")
-async def get_latency(websocket: WebSocket):
+@app.websocket("/ws-frame-health")
+async def get_latency(websocket: WebSocket, interval_ms: int = 500):
+    """
+    Every `interval_ms` in which packets were played, sends a single element list with the health of those packets: 0 if
+    all of them played on time, otherwise the more frequent of -1 for underflows & 1 for overflows
+    """
+    await websocket.accept()
+    await asyncio.get_running_loop().run_in_executor(None, preload_complete.wait)
+    if frame_health is None:
+        await websocket.close()
+        return
+
+    from ai.spectrogram_conversion.utils.network_utils import STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW
+
+    try:
+        previous = frame_health.counts()
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            counts = frame_health.counts()
+            frames = {status: counts[status] - previous[status] for status in counts}
+            previous = counts
+            if not any(frames.values()):
+                continue
+
+            status = max((STATUS_UNDERFLOW, STATUS_OVERFLOW), key=frames.get)
+            await websocket.send_json([status if frames[status] else STATUS_OK])
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Per-stage latency histograms of the conversion pipeline, in the prometheus text format"""
+    if latency_histograms is None:
+        return ""
+
+    from ai.spectrogram_conversion.utils.latency_histogram import to_prometheus
+    from ai.spectrogram_conversion.utils.network_utils import STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW
+
+    name = "voice_conversion_frames_total"
+    lines = [f"# HELP {name} Packets played by the audio callback, by status.", f"# TYPE {name} counter"]
+    counts = frame_health.counts()
+    for status, label in [(STATUS_UNDERFLOW, "underflow"), (STATUS_OK, "ok"), (STATUS_OVERFLOW, "overflow")]:
+        lines.append(f'{name}{{status="{label}"}} {counts[status]}')
+    return to_prometheus(latency_histograms) + "\n".join(lines) + "\n"
+
+
+@app.websocket("/ws-metrics")
+async def ws_metrics(websocket: WebSocket, interval_ms: int = 1000):
+    """Streams the count, mean, percentiles & max of each stage's latency over every `interval_ms`"""
+    await websocket.accept()
+    await asyncio.get_running_loop().run_in_executor(None, preload_complete.wait)
+    if latency_histograms is None:
+        await websocket.close(code=1011)
+        return
+
+    try:
+        previous = latency_histograms.snapshot()
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            current = latency_histograms.snapshot()
+            await websocket.send_json(
+                {"interval_ms": interval_ms, "stages": latency_histograms.summary(current - previous)}
+            )
+            previous = current
+    except WebSocketDisconnect:
+        pass
+
+
+@app.websocket("/ws-convert")
+async def ws_convert(
+    websocket: WebSocket,
+    target_speaker: str,
+    callback_latency_ms: int = 100,
+    dtype: str = "float32",
+    noise_suppression: float = 5.0,
+):
+    """
+    Converts PCM streamed by a remote client. Once the models are loaded, a JSON message with the stream format is
+    sent, after which every binary frame of `frames_per_buffer` samples is answered with a converted frame.
+    """
     await websocket.accept()
+    await asyncio.get_running_loop().run_in_executor(None, preload_modules)
+    from ai.spectrogram_conversion.network_stream import NetworkConversionSession
+    from ai.spectrogram_conversion.utils.network_utils import PCM_DTYPES, decode_frame, encode_frame
 
-    global frame_dropping
+    if dtype not in PCM_DTYPES:
+        await websocket.close(code=1003)
+        return
 
-    while True:
-        if frame_dropping:
-            frame_drops = []
+    HDW_FRAMES_PER_BUFFER = math.ceil(sample_rate * callback_latency_ms / 1000)
+    stream_format = {"sample_rate": sample_rate, "frames_per_buffer": HDW_FRAMES_PER_BUFFER, "dtype": dtype}
 
-            while not frame_dropping.empty():
-                frame_drops.append(frame_dropping.get_nowait())
+    if IS_MOCK:
+        await websocket.send_json(stream_format)
+        try:
+            while True:
+                packet_id, timestamp_s, _, wav = decode_frame(await websocket.receive_bytes(), dtype)
+                # rejected like NetworkConversionSession does, so that clients can be tested against the mock
+                if len(wav) != HDW_FRAMES_PER_BUFFER:
+                    raise ValueError(f"expected frames of {HDW_FRAMES_PER_BUFFER} samples, got {len(wav)}")
+                await websocket.send_bytes(encode_frame(packet_id, timestamp_s, wav, dtype))
+        except WebSocketDisconnect:
+            pass
+        except ValueError as e:
+            _LOGGER.info(f"ws_convert: {e}")
+            await websocket.close(code=1007)
+        return
 
-            if len(frame_drops) > 0:
-                await websocket.send_json(frame_drops)
-            else:
-                await asyncio.sleep(1)
-        else:
-            await asyncio.sleep(1)
+    opt = argparse.Namespace(
+        mode=InferencePipelineMode.online_crossfade,
+        noise_suppression_threshold=noise_suppression,
+        target_speaker=target_speaker,
+    )
+    server = await asyncio.get_running_loop().run_in_executor(None, get_batched_conversion_server)
+    session = NetworkConversionSession(opt, HDW_FRAMES_PER_BUFFER, server)
+    session.start()
+    try:
+        with TimedScope("ws_convert_model_warmup", _LOGGER):
+            while not session.is_ready:
+                if not session.is_alive:
+                    await websocket.close(code=1011)
+                    return
+                await asyncio.sleep(0.2)
+        await websocket.send_json(stream_format)
+
+        while True:
+            packet_id, timestamp_s, _, wav = decode_frame(await websocket.receive_bytes(), dtype)
+            packet_id, timestamp_s, status, out = session.process_frame(packet_id, timestamp_s, wav)
+            await websocket.send_bytes(encode_frame(packet_id, timestamp_s, out, dtype, status))
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        _LOGGER.info(f"ws_convert: {e}")
+        await websocket.close(code=1007)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, session.stop)
 
 
 # TODO sidroopdaska: use correct HTTP verbs. Using GET right now since its easy to test from the browser
@@ -208,16 +517,19 @@ def get_stop_convert():
         return True
 
     with TimedScope("get_stop_convert", _LOGGER):
-        global convert_process, stop_pipeline, latency_queue
+        global convert_process, stop_pipeline
         if not convert_process:
             return True
 
-        latency_records = []
-        while not latency_queue.empty():
-            latency_records.append(latency_queue.get_nowait())
-        if len(latency_records) > 30:
-            latency_records = latency_records[-30:]
-        latency_records
+        from ai.spectrogram_conversion.utils.network_utils import STATUS_OVERFLOW, STATUS_UNDERFLOW
+
+        # the latest 30 packets of the session, in the format the analytics expect: the roundtrip latency in s of
+        # packets played on time, 1000 for underflows & 0 for overflows
+        _, statuses, latencies_s = frame_health.events(since=frame_health_session_start)
+        latency_records = [
+            {STATUS_UNDERFLOW: 1000, STATUS_OVERFLOW: 0}.get(int(status), float(latency_s))
+            for status, latency_s in zip(statuses[-30:], latencies_s[-30:])
+        ]
 
         with stop_pipeline.get_lock():
             stop_pipeline.value = 1
@@ -248,6 +560,29 @@ def get_callback_latency_ms(value: int):
     return True
 
 
+@app.get("/context-length-ms")
+def get_context_length_ms(value: int):
+    global context_length_ms
+
+    with context_length_ms.get_lock():
+        context_length_ms.value = value
+    return True
+
+
+@app.get("/target-speaker")
+def get_target_speaker(value: str):
+    """Swaps the voice of the running conversion without restarting it"""
+    global target_speaker_id
+
+    value = value.encode()
+    if len(value) >= TARGET_SPEAKER_MAX_LEN:
+        raise HTTPException(status_code=400, detail="Bad request. `value` is too long")
+
+    with target_speaker_id.get_lock():
+        target_speaker_id.value = value
+    return True
+
+
 @app.get("/data-share")
 def get_data_share(value: bool):
     global USER_STATE
@@ -258,13 +593,22 @@ def get_data_share(value: bool):
 @app.get("/audio")
 def get_audio(audio_type: str):
     if audio_type not in ["original", "converted"]:
-        return HTTPException(status_code=400, detail="Bad request. Wrong `audio_type` requested")
+        raise HTTPException(status_code=400, detail="Bad request. Wrong `audio_type` requested")
 
-    fname = os.path.join(get_conversion_root(), f"{audio_type}.wav")
-    if not os.path.exists(fname):
-        return HTTPException(status_code=404, detail=f"Audio {audio_type}.wav does not exist")
+    from ai.spectrogram_conversion.recording import read_recording, wav_header
 
-    return StreamingResponse(content=open(fname, "rb"), media_type="audio/wav")
+    # served straight from the recording buffers of the last session, without decoding the recording files
+    try:
+        parts, sr = read_recording(audio_type)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Audio {audio_type} does not exist")
+
+    def iter_wav():
+        yield wav_header(sum(len(part) for part in parts), sr)
+        for part in parts:
+            yield part.tobytes()
+
+    return StreamingResponse(content=iter_wav(), media_type="audio/wav")
 
 
 # TODO sidroopdaska: POST results in CORS and doesn't work with the react development server
@@ -272,33 +616,104 @@ def get_audio(audio_type: str):
 def get_feedback(content: str, duration: int):
     global USER_STATE
 
+    preload_modules()
+    from ai.spectrogram_conversion.recording import RECORDINGS, find_recording, trim_recording
+    from ai.spectrogram_conversion.utils.utils import get_conversion_root
+
     # write content to disk
     if content:
         with open(f"{get_conversion_root()}/content.txt", "w") as f:
             f.write(content)
 
     # trim audio length
-    for f in ["original.wav", "converted.wav"]:
-        fname = os.path.join(get_conversion_root(), f)
-        wav, sr = librosa.load(fname)
-        if len(wav) < duration * sample_rate:
-            continue
-        wav = wav[-(duration * sample_rate) :]
-        sf.write(fname, wav, sample_rate)
+    for audio_type in RECORDINGS:
+        fname = find_recording(get_conversion_root(), audio_type)
+        if fname:
+            trim_recording(fname, duration, name=audio_type)
 
     # not a true session id, but avoids conflicts
     session_id = time.time()
 
-    # upload to cloud
-    upload_directory_to_s3(
-        get_conversion_root(),
-        object_prefix=f"{USER_STATE.email}/{session_id}",
-    )
+    # upload to cloud in the background, the files are moved out of the conversion root before this returns so that
+    # the next session can't overwrite them
+    queue = get_upload_queue()
+    if queue:
+        queue.enqueue(
+            get_conversion_root(),
+            object_prefix=f"{USER_STATE.email}/{session_id}",
+            # raw buffers, already in the recording files
+            exclude=["buffers"],
+        )
+
+
+@app.on_event("startup")
+def startup_event():
+    global noise_suppression_threshold, callback_latency_ms, context_length_ms, target_speaker_id, num_threads, num_interop_threads, cpu_affinity, high_priority
+
+    # created once & shared with the conversion worker, /register-user & the setters update them in place
+    # double
+    noise_suppression_threshold = Value("d", 5.0)
+    # unsigned int
+    callback_latency_ms = Value("I", 400)
+    # unsigned int, 0 feeds the whole window to the model
+    context_length_ms = Value("I", 0)
+    target_speaker_id = Array("c", TARGET_SPEAKER_MAX_LEN)
+    # unsigned int, 0 keeps the torch default
+    num_threads = Value("I", 0)
+    num_interop_threads = Value("I", 0)
+    # cpu list, e.g. "2-5", empty for no pinning
+    cpu_affinity = Array("c", 256)
+    # bool
+    high_priority = Value("i", 0)
+
+    # the API is served straight away, while the models load in the background
+    threading.Thread(target=preload_target, daemon=True).start()
+
+
+def preload_target():
+    global latency_histograms, frame_health, RECORDING_CODEC
+
+    try:
+        preload_modules()
+
+        from ai.spectrogram_conversion.recording import resolve_recording_codec
+
+        try:
+            RECORDING_CODEC = resolve_recording_codec(RECORDING_CODEC)
+        except ValueError as e:
+            _LOGGER.error(f"RECORDING_CODEC: {e}, recording in flac")
+            RECORDING_CODEC = "flac"
+
+        if IS_MOCK:
+            return
+
+        get_upload_queue()
+
+        from ai.spectrogram_conversion.utils.latency_histogram import LatencyHistograms
+        from ai.spectrogram_conversion.utils.multiprocessing_utils import FrameHealth
+
+        latency_histograms = LatencyHistograms()
+        frame_health = FrameHealth()
+
+        start_conversion_worker()
+    finally:
+        preload_complete.set()
 
 
 @app.on_event("shutdown")
 def shutdown_event():
     sigterm_handler()
+    if conversion_worker:
+        conversion_worker.stop()
+    if upload_queue:
+        # unfinished uploads are resumed on the next startup
+        upload_queue.stop()
+    if batched_conversion_server:
+        batched_conversion_server.stop()
+    for shared in (latency_histograms, frame_health):
+        if shared is not None:
+            shared.close()
+            shared.unlink()
 
 
 if __name__ == "__main__":
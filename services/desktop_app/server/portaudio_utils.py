@@ -1,10 +1,12 @@
 from typing import Dict, List
 
-import sounddevice as sd
 from data_types import DeviceInfo
 
 
 def get_devices(mode) -> Dict[str, List[DeviceInfo]]:
+    # imported lazily, loading PortAudio would otherwise delay the server startup
+    import sounddevice as sd
+
     sd._terminate()
     sd._initialize()
 
@@ -0,0 +1,86 @@
+"""
+Drives the /ws-convert endpoint from a WAV file at real-time rate & reports the round-trip latency.
+
+python ws_client.py --input clip.wav --output converted.wav --target-speaker zeus
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+import librosa
+import numpy as np
+import soundfile as sf
+import websockets
+
+sys.path.append('../..')
+
+from ai.spectrogram_conversion.utils.network_utils import (STATUS_OK, STATUS_OVERFLOW, STATUS_UNDERFLOW,
+                                                            decode_frame, encode_frame)
+
+
+async def stream_file(opt: argparse.Namespace):
+    query = urlencode(
+        {
+            "target_speaker": opt.target_speaker,
+            "callback_latency_ms": opt.callback_latency_ms,
+            "dtype": opt.dtype,
+            "noise_suppression": opt.noise_suppression,
+        }
+    )
+    async with websockets.connect(f"{opt.url}?{query}", max_size=None) as websocket:
+        # sent once the models are loaded
+        stream_format = json.loads(await websocket.recv())
+        sample_rate, HDW_FRAMES_PER_BUFFER = stream_format["sample_rate"], stream_format["frames_per_buffer"]
+
+        wav, _ = librosa.load(opt.input, sr=sample_rate)
+        n_packets = len(wav) // HDW_FRAMES_PER_BUFFER
+
+        outs, roundtrips_ms = [], []
+        statuses = {STATUS_UNDERFLOW: 0, STATUS_OK: 0, STATUS_OVERFLOW: 0}
+
+        async def send():
+            start_s = time.time()
+            for packet_id in range(n_packets):
+                wav_packet = wav[packet_id * HDW_FRAMES_PER_BUFFER : (packet_id + 1) * HDW_FRAMES_PER_BUFFER]
+                await websocket.send(encode_frame(packet_id, time.time(), wav_packet, opt.dtype))
+
+                # pace packets as an audio device would
+                next_s = start_s + (packet_id + 1) * HDW_FRAMES_PER_BUFFER / sample_rate
+                await asyncio.sleep(max(0.0, next_s - time.time()))
+
+        async def receive():
+            for _ in range(n_packets):
+                packet_id, timestamp_s, status, out = decode_frame(await websocket.recv(), opt.dtype)
+                statuses[status] += 1
+                outs.append(out)
+                if packet_id >= 0:
+                    roundtrips_ms.append(1000 * (time.time() - timestamp_s))
+
+        await asyncio.gather(send(), receive())
+
+    if opt.output:
+        sf.write(opt.output, np.concatenate(outs), sample_rate)
+
+    print(f"packets: {n_packets} underflow: {statuses[STATUS_UNDERFLOW]} overflow: {statuses[STATUS_OVERFLOW]}")
+    if roundtrips_ms:
+        print(
+            f"roundtrip mean: {np.mean(roundtrips_ms):0.1f}ms p50: {np.percentile(roundtrips_ms, 50):0.1f}ms "
+            f"p99: {np.percentile(roundtrips_ms, 99):0.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="ws://127.0.0.1:58000/ws-convert")
+    parser.add_argument("--input", type=str, required=True, help="WAV file to stream")
+    parser.add_argument("--output", type=str, default=None, help="path to write the converted audio to")
+    parser.add_argument("--target-speaker", type=str, required=True)
+    parser.add_argument("--callback-latency-ms", type=int, default=100)
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "int16"])
+    parser.add_argument("--noise-suppression", type=float, default=5.0)
+    opt = parser.parse_args()
+
+    asyncio.run(stream_file(opt))
@@ -0,0 +1,60 @@
+"""
+Stand-ins for the content encoder & the conversion model, so that the pipelines can be tested without the model files.
+Like the real preprocessor, features are computed over frames of `RECEPTIVE_FIELD` samples every `PREPROCESSOR_HOP`
+samples, & the model turns every frame into `MODEL_HOP` samples of 24kHz audio.
+"""
+import argparse
+
+import numpy as np
+import torch
+
+import ai.spectrogram_conversion.voice_conversion as voice_conversion
+from ai.spectrogram_conversion.data_types import InferencePipelineMode
+from ai.spectrogram_conversion.feature_cache import PREPROCESSOR_HOP
+
+RECEPTIVE_FIELD = 400
+MODEL_HOP = 480
+TARGETS = {"a": 1.0, "b": -0.5}
+
+
+class FakeBackend:
+    def __init__(self, opt, device, *roots):
+        self.preprocessed_samples = []
+
+    def preprocess(self, wav_src: np.ndarray) -> torch.Tensor:
+        self.preprocessed_samples.append(wav_src.shape[1])
+        frames = np.lib.stride_tricks.sliding_window_view(wav_src, RECEPTIVE_FIELD, axis=1)[:, ::PREPROCESSOR_HOP]
+        # (batch, frames, features)
+        return torch.from_numpy(np.ascontiguousarray(np.stack((frames.mean(axis=2), frames.max(axis=2)), axis=2)))
+
+    def convert(self, c: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        # every frame's features, scaled by the target's embedding
+        feats = c.numpy()[:, :, 0] * targets.numpy()[:, :1]
+        return torch.from_numpy(np.ascontiguousarray(np.repeat(feats, MODEL_HOP, axis=1)[:, np.newaxis, :]))
+
+
+def _preload_targets(self):
+    for speaker_id, scale in TARGETS.items():
+        self._targets[speaker_id] = torch.from_numpy(np.full((1, 4), scale, dtype=np.float32))
+
+
+def use_fake_models(monkeypatch):
+    monkeypatch.setitem(voice_conversion.BACKENDS, "fake", FakeBackend)
+    monkeypatch.setattr(voice_conversion.ModelConversionPipeline, "_preload_targets", _preload_targets)
+
+
+def make_opt(**kwargs) -> argparse.Namespace:
+    opt = dict(
+        mode=InferencePipelineMode.online_crossfade,
+        backend="fake",
+        # never suppressed, so that outputs can be compared sample by sample
+        noise_suppression_threshold=1e9,
+        target_speaker="a",
+    )
+    opt.update(kwargs)
+    return argparse.Namespace(**opt)
+
+
+def make_stream(n_samples: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return (0.1 * rng.standard_normal(n_samples)).astype(np.float32)
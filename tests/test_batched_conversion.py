@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+# the realtime pipeline needs the audio stack
+inference_rt = pytest.importorskip("ai.spectrogram_conversion.inference_rt")
+
+from ai.spectrogram_conversion.batched_conversion import RING_BUFFER_CAPACITY, BatchedConversionWorker, SessionSpec
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC
+from ai.spectrogram_conversion.utils.multiprocessing_utils import SharedRingBuffer
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+from fake_models import TARGETS, make_opt, make_stream, use_fake_models
+
+HDW_FRAMES_PER_BUFFER = 2205
+N_PACKETS = 30
+
+
+@pytest.fixture
+def sessions():
+    """Ring buffers of a session per target speaker"""
+    queues = {
+        speaker_id: (
+            SharedRingBuffer(RING_BUFFER_CAPACITY, MAX_INFER_SAMPLES_VC),
+            SharedRingBuffer(RING_BUFFER_CAPACITY, HDW_FRAMES_PER_BUFFER),
+        )
+        for speaker_id in TARGETS
+    }
+    yield queues
+    for q_in, q_out in queues.values():
+        for q in (q_in, q_out):
+            q.close()
+            q.unlink()
+
+
+def test_batched_output_matches_per_session_output(monkeypatch, sessions):
+    use_fake_models(monkeypatch)
+    streams = {
+        speaker_id: make_stream(N_PACKETS * HDW_FRAMES_PER_BUFFER, seed) for seed, speaker_id in enumerate(TARGETS)
+    }
+
+    expected = {}
+    for speaker_id, wav in streams.items():
+        pipeline = inference_rt.ConversionPipeline(make_opt(target_speaker=speaker_id))
+        window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+        outs = []
+        for p_id in range(N_PACKETS):
+            window.append(wav[p_id * HDW_FRAMES_PER_BUFFER : (p_id + 1) * HDW_FRAMES_PER_BUFFER])
+            outs.append(np.array(pipeline.run(window.view(), HDW_FRAMES_PER_BUFFER, HDW_FRAMES_PER_BUFFER)))
+        expected[speaker_id] = np.concatenate(outs)
+
+    worker = BatchedConversionWorker(make_opt(batch_window_ms=0))
+    for speaker_id, (q_in, q_out) in sessions.items():
+        worker.attach(SessionSpec(speaker_id, q_in, q_out, HDW_FRAMES_PER_BUFFER, speaker_id, 1e9))
+
+    windows = {speaker_id: SlidingWindow(MAX_INFER_SAMPLES_VC) for speaker_id in sessions}
+    outs = {speaker_id: [] for speaker_id in sessions}
+    for p_id in range(N_PACKETS):
+        for speaker_id, (q_in, _) in sessions.items():
+            wav = streams[speaker_id][p_id * HDW_FRAMES_PER_BUFFER : (p_id + 1) * HDW_FRAMES_PER_BUFFER]
+            windows[speaker_id].append(wav)
+            q_in.put(p_id, 0.0, windows[speaker_id].view())
+
+        # every session's packet in a single forward pass
+        assert worker.step() == len(sessions)
+        for speaker_id, (_, q_out) in sessions.items():
+            out_p_id, _, out = q_out.get()
+            assert out_p_id == p_id
+            outs[speaker_id].append(np.array(out))
+
+    for speaker_id in sessions:
+        np.testing.assert_allclose(np.concatenate(outs[speaker_id]), expected[speaker_id], atol=1e-6)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+# the realtime pipeline needs the audio stack
+inference_rt = pytest.importorskip("ai.spectrogram_conversion.inference_rt")
+
+from ai.spectrogram_conversion.params import MAX_INFER_SAMPLES_VC
+from ai.spectrogram_conversion.utils.utils import SlidingWindow
+from fake_models import make_opt, make_stream, use_fake_models
+
+
+def stream_through(pipeline, wav: np.ndarray, HDW_FRAMES_PER_BUFFER: int) -> np.ndarray:
+    pipeline.reset()
+    window = SlidingWindow(MAX_INFER_SAMPLES_VC)
+    outs = []
+    for i in range(0, len(wav) - HDW_FRAMES_PER_BUFFER + 1, HDW_FRAMES_PER_BUFFER):
+        window.append(wav[i : i + HDW_FRAMES_PER_BUFFER])
+        outs.append(np.array(pipeline.run(window.view(), HDW_FRAMES_PER_BUFFER)))
+    return np.concatenate(outs)
+
+
+@pytest.mark.parametrize(
+    "HDW_FRAMES_PER_BUFFER",
+    [
+        # 50ms & 73ms, not a multiple of the preprocessor's hop
+        1103,
+        1610,
+        # 100ms, i.e. 5 hops
+        2205,
+    ],
+)
+def test_cached_output_matches_uncached(monkeypatch, HDW_FRAMES_PER_BUFFER):
+    use_fake_models(monkeypatch)
+    wav = make_stream(60 * HDW_FRAMES_PER_BUFFER)
+
+    uncached = stream_through(inference_rt.ConversionPipeline(make_opt()), wav, HDW_FRAMES_PER_BUFFER)
+    cached = stream_through(inference_rt.ConversionPipeline(make_opt(feature_cache=True)), wav, HDW_FRAMES_PER_BUFFER)
+
+    # the fake preprocessor's frames only depend on their own samples, so reusing them is exact
+    np.testing.assert_allclose(cached, uncached, atol=1e-6)
+
+
+def test_cache_reuses_frames_when_aligned(monkeypatch):
+    use_fake_models(monkeypatch)
+    HDW_FRAMES_PER_BUFFER = 2205
+    pipeline = inference_rt.ConversionPipeline(make_opt(feature_cache=True))
+    stream_through(pipeline, make_stream(60 * HDW_FRAMES_PER_BUFFER), HDW_FRAMES_PER_BUFFER)
+
+    window_len = pipeline.p_resampler.output_length(MAX_INFER_SAMPLES_VC)
+    # after the first window, only the tail of each window is run through the preprocessor
+    assert max(pipeline.backend.preprocessed_samples[1:]) < window_len / 2
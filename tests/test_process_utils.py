@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+process_utils = pytest.importorskip("ai.common.process_utils")
+
+
+def test_parse_cpu_list():
+    assert process_utils.parse_cpu_list("0") == [0]
+    if os.cpu_count() > 1:
+        assert process_utils.parse_cpu_list(f"0-{os.cpu_count() - 1}") == list(range(os.cpu_count()))
+
+
+@pytest.mark.parametrize("cpus", ["a", "0-1-2", "1-0", "-1", f"0-{os.cpu_count()}", "0-999999999"])
+def test_parse_cpu_list_rejects_invalid_lists(cpus):
+    with pytest.raises(ValueError):
+        process_utils.parse_cpu_list(cpus)
+
+
+def test_validate_cpu_list_reports_a_bounded_message(monkeypatch):
+    monkeypatch.setattr(process_utils.os, "cpu_count", lambda: 4096)
+    monkeypatch.setattr(process_utils, "get_available_cpus", lambda: [0, 1])
+
+    with pytest.raises(ValueError) as e:
+        process_utils.validate_cpu_list("0-4095")
+    assert "4094 of the cpus" in str(e.value)
+    assert len(str(e.value)) < 200
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+sf = pytest.importorskip("soundfile")
+
+from ai.spectrogram_conversion import recording
+from ai.spectrogram_conversion.recording import (RecordingBuffers, RecordingCodec, RecordingWriter, get_recording_fname,
+                                                 read_recording)
+from ai.spectrogram_conversion.resampler import PolyphaseResampler
+
+SAMPLE_RATE = 22050
+SEGMENT_LEN = 2205
+N_SEGMENTS = 400
+
+
+def test_resampled_recording_matches_one_shot_resampling(monkeypatch, tmp_path):
+    # lossless, so that the file can be compared sample by sample
+    monkeypatch.setitem(recording.RECORDING_CODECS, "wav24k", RecordingCodec("WAV", "FLOAT", "wav", (24000,)))
+    fname = get_recording_fname(str(tmp_path), "original", "wav24k")
+    rng = np.random.default_rng(0)
+    buffer = (0.1 * rng.standard_normal((N_SEGMENTS, SEGMENT_LEN))).astype(np.float32)
+
+    packet_count = 0
+    writer = RecordingWriter({fname: buffer}, lambda: packet_count, SAMPLE_RATE, codec="wav24k", poll_s=0.5)
+    # sized for a write rather than for the whole buffer
+    assert len(writer._resamplers[fname]._buffer) < buffer.size / 10
+
+    # including a poll that fell far behind
+    for packet_count in (3, 7, 50, 300, N_SEGMENTS - 1):
+        writer._write_completed()
+    writer.stop()
+
+    wav, samplerate = sf.read(fname, dtype="float32")
+    expected = PolyphaseResampler(SAMPLE_RATE, 24000)(buffer[: N_SEGMENTS - 1].reshape(-1))
+    assert samplerate == 24000
+    # the tail held back by the streaming resampler is flushed at close
+    assert len(wav) == len(expected)
+    np.testing.assert_allclose(wav, expected, atol=1e-6)
+
+
+def test_new_session_leaves_mapped_buffers_of_previous_session_intact(tmp_path):
+    root = str(tmp_path)
+    previous = RecordingBuffers(root, 4, SEGMENT_LEN, SAMPLE_RATE)
+    previous.buffers["original"][:] = 1
+    previous.save(4)
+    parts, _ = read_recording("original", root=root)
+
+    current = RecordingBuffers(root, 8, SEGMENT_LEN, SAMPLE_RATE)
+    current.buffers["original"][:2] = 2
+    current.save(2)
+
+    # still mapped by the reader, rather than truncated under it
+    assert all(np.all(part == 1) for part in parts)
+    parts, _ = read_recording("original", root=root)
+    assert sum(len(part) for part in parts) == 2 * SEGMENT_LEN
+    assert all(np.all(part == 2) for part in parts)
+    # the previous session's buffers are removed once they're no longer referenced
+    assert len([fname for fname in os.listdir(root) if fname.endswith(".f32")]) == len(current.buffers)
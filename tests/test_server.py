@@ -0,0 +1,44 @@
+import os
+import sys
+from multiprocessing import Array
+
+import pytest
+
+pytest.importorskip("fastapi")
+# TestClient
+pytest.importorskip("httpx")
+
+# the server imports its own modules as top-level modules, as it's run from its folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "services", "desktop_app", "server"))
+main = pytest.importorskip("main")
+
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # created by the startup event, which isn't run so that no models are loaded
+    monkeypatch.setattr(main, "target_speaker_id", Array("c", main.TARGET_SPEAKER_MAX_LEN))
+    return TestClient(main.app)
+
+
+def test_sets_target_speaker(client):
+    response = client.get("/target-speaker", params={"value": "speaker"})
+    assert response.status_code == 200
+    assert main.target_speaker_id.value == b"speaker"
+
+
+def test_rejects_too_long_target_speaker(client):
+    response = client.get("/target-speaker", params={"value": "s" * main.TARGET_SPEAKER_MAX_LEN})
+    assert response.status_code == 400
+    assert main.target_speaker_id.value == b""
+
+
+def test_audio_of_unknown_type_is_rejected(client):
+    assert client.get("/audio", params={"audio_type": "other"}).status_code == 400
+
+
+def test_audio_without_recording_is_not_found(client, monkeypatch, tmp_path):
+    recording = pytest.importorskip("ai.spectrogram_conversion.recording")
+    monkeypatch.setattr(recording, "get_recording_buffers_root", lambda: str(tmp_path))
+    assert client.get("/audio", params={"audio_type": "original"}).status_code == 404
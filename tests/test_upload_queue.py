@@ -0,0 +1,170 @@
+import os
+import threading
+
+import pytest
+
+import common.upload_queue
+from common.upload_queue import UploadQueue
+
+MULTIPART_THRESHOLD = 4096
+MULTIPART_CHUNKSIZE = 1024
+
+
+class FakeS3:
+    """In-memory stand-in for the methods of a boto3 S3 client used by UploadQueue"""
+
+    def __init__(self, fail_calls: int = 0, fail_parts=()):
+        self.objects = {}
+        self.uploads = {}
+        self.uploaded_parts = []
+        self.n_created_uploads = 0
+        # the next `fail_calls` calls fail, as well as every upload of the part numbers in `fail_parts`
+        self.fail_calls = fail_calls
+        self.fail_parts = set(fail_parts)
+        self.failed = threading.Event()
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self, part_number=None):
+        with self._lock:
+            if self.fail_calls > 0 or part_number in self.fail_parts:
+                self.fail_calls = max(self.fail_calls - 1, 0)
+                self.failed.set()
+                raise IOError("connection reset")
+
+    def put_object(self, Bucket, Key, Body):
+        self._maybe_fail()
+        self.objects[Key] = Body.read()
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._maybe_fail()
+        with self._lock:
+            self.n_created_uploads += 1
+            upload_id = f"upload-{self.n_created_uploads}"
+            self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._maybe_fail(PartNumber)
+        self.uploads[UploadId][PartNumber] = Body
+        self.uploaded_parts.append(PartNumber)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0):
+        # 2 parts per page, to go through the pagination
+        part_numbers = [n for n in sorted(self.uploads[UploadId]) if n > PartNumberMarker]
+        response = {"Parts": [{"PartNumber": n, "ETag": f"etag-{n}"} for n in part_numbers[:2]]}
+        response["IsTruncated"] = len(part_numbers) > 2
+        if response["IsTruncated"]:
+            response["NextPartNumberMarker"] = part_numbers[1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part["PartNumber"] for part in MultipartUpload["Parts"]] == sorted(parts)
+        self.objects[Key] = b"".join(parts[n] for n in sorted(parts))
+
+
+@pytest.fixture
+def session_root(tmp_path):
+    root = tmp_path / "session"
+    (root / "buffers").mkdir(parents=True)
+    (root / "buffers" / "original.f32").write_bytes(b"raw")
+    (root / "content.txt").write_text("feedback")
+    # uploaded in parts
+    (root / "original.flac").write_bytes(os.urandom(10 * MULTIPART_CHUNKSIZE + 5))
+    return root
+
+
+def make_queue(client, tmp_path, **kwargs) -> UploadQueue:
+    queue = UploadQueue(
+        client,
+        "bucket",
+        str(tmp_path / "uploads"),
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        **kwargs,
+    )
+    queue.start()
+    return queue
+
+
+def assert_uploaded(client, expected, tmp_path):
+    assert client.objects == {f"user/1/{relpath}": data for relpath, data in expected.items()}
+    # nothing is left pending
+    assert os.listdir(tmp_path / "uploads" / "jobs") == []
+    assert os.listdir(tmp_path / "uploads" / "data") == []
+
+
+def read_files(session_root, relpaths):
+    return {relpath: (session_root / relpath).read_bytes() for relpath in relpaths}
+
+
+def test_retries_failed_uploads(monkeypatch, tmp_path, session_root):
+    monkeypatch.setattr(common.upload_queue, "RETRY_BACKOFF_S", 0.01)
+    expected = read_files(session_root, ["content.txt", "original.flac"])
+    client = FakeS3(fail_calls=3)
+
+    queue = make_queue(client, tmp_path)
+    queue.enqueue(str(session_root), "user/1", exclude=["buffers"])
+    assert queue.join(10)
+    queue.stop()
+
+    assert_uploaded(client, expected, tmp_path)
+    # only the excluded files are left behind
+    assert os.listdir(session_root) == ["buffers"]
+
+
+def test_gives_up_after_max_attempts(monkeypatch, tmp_path, session_root):
+    monkeypatch.setattr(common.upload_queue, "RETRY_BACKOFF_S", 0.01)
+    client = FakeS3(fail_calls=1000)
+
+    queue = make_queue(client, tmp_path, max_attempts=2)
+    job_id = queue.enqueue(str(session_root), "user/1", exclude=["buffers"])
+    assert queue.join(10)
+    queue.stop()
+
+    assert client.objects == {}
+    assert sorted(os.listdir(tmp_path / "uploads" / "failed")) == [job_id, f"{job_id}.json"]
+
+
+def test_resumes_multipart_upload(monkeypatch, tmp_path, session_root):
+    # retried after the queue is stopped, if at all
+    monkeypatch.setattr(common.upload_queue, "RETRY_BACKOFF_S", 60)
+    expected = read_files(session_root, ["content.txt", "original.flac"])
+    client = FakeS3(fail_parts=[4])
+
+    queue = make_queue(client, tmp_path)
+    queue.enqueue(str(session_root), "user/1", exclude=["buffers"])
+    assert client.failed.wait(10)
+    queue.stop()
+    assert client.uploaded_parts == [1, 2, 3]
+
+    client.fail_parts.clear()
+    client.uploaded_parts.clear()
+    queue = make_queue(client, tmp_path)
+    assert queue.join(10)
+    queue.stop()
+
+    assert_uploaded(client, expected, tmp_path)
+    # continued the upload from the persisted upload id, without uploading its first parts again
+    assert client.n_created_uploads == 1
+    assert client.uploaded_parts == list(range(4, 12))
+
+
+def test_resumes_pending_jobs_after_restart(monkeypatch, tmp_path, session_root):
+    monkeypatch.setattr(common.upload_queue, "RETRY_BACKOFF_S", 60)
+    expected = read_files(session_root, ["content.txt", "original.flac"])
+
+    queue = make_queue(FakeS3(fail_calls=1000), tmp_path)
+    job_id = queue.enqueue(str(session_root), "user/1", exclude=["buffers"])
+    queue.stop()
+    # a retry firing after the stop is dropped rather than submitted to the shut down executor
+    queue._submit(job_id, "content.txt")
+    assert os.listdir(tmp_path / "uploads" / "jobs") == [f"{job_id}.json"]
+
+    client = FakeS3()
+    queue = make_queue(client, tmp_path)
+    assert queue.join(10)
+    queue.stop()
+
+    assert_uploaded(client, expected, tmp_path)